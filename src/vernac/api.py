@@ -0,0 +1,293 @@
+import os
+import os.path
+import asyncio
+
+from typing import Callable
+from dataclasses import (
+    dataclass,
+    field,
+)
+from tempfile import TemporaryDirectory
+
+from rich.progress import Progress
+
+from vernac.llm import ModelRouter
+from vernac.logs import (
+    LogFormat,
+    LogSink,
+)
+from vernac.pipeline import (
+    VernacPipeline,
+    progress as default_progress,
+)
+from vernac.module_index import (
+    ModuleIndex,
+    get_cache_dir,
+)
+from vernac.build_store import BuildStore
+from vernac.prefetch import DependencyPrefetcher
+from vernac.remote_cache import CacheClient
+from vernac.stats import StatsStore
+from vernac.work_queue import JobQueue
+from vernac.convergence import ConvergencePolicy
+from vernac.lockfile import (
+    Lockfile,
+    get_default_lock_path,
+)
+from vernac.stages.all import (
+    ReadSourceStage,
+    MapModulesStage,
+    RunPipelinesStage,
+)
+from vernac.stages.package import (
+    PackageLayout,
+    PackageOptions,
+)
+
+@dataclass
+class BuildOptions:
+    """
+    Settings for one build. Shared resources, such as models and caches,
+    belong to the `Compiler` instead.
+    """
+
+    verbose: bool = False
+    injects: dict[str, str] = field(default_factory=dict)
+    package_dir: str | None = None
+    layout: str = PackageLayout.SHIV.value
+    python: str | None = None
+    compile_pyc: bool = False
+    strip: bool = False
+    measure: bool = False
+    env_root: str | None = None
+    max_prompt_tokens: int | None = 6000
+    contract_first: bool = False
+    check_performance: bool = False
+    optimize: bool = False
+    fork_server: bool = False
+    combine_module_calls: bool = False
+    jobs: int | None = None
+    max_iterations: int | None = 8
+    time_budget: float | None = None
+    token_budget: int | None = None
+    reuse: bool = True
+    reuse_similarity: float = 0.6
+    warm_start: bool = True
+    lockfile: str | None = None
+    locked: bool = False
+    log_root: str | None = None
+    log_format: str = LogFormat.DIRECTORY.value
+    log_keep: int | None = None
+    log_max_bytes: int | None = None
+
+    @property
+    def package_options(self) -> PackageOptions:
+        return PackageOptions(
+            layout=PackageLayout(self.layout),
+            python=self.python,
+            compile_pyc=self.compile_pyc,
+            strip=self.strip,
+            measure=self.measure,
+            env_root=self.env_root,
+        )
+
+    @property
+    def convergence(self) -> ConvergencePolicy:
+        return ConvergencePolicy(
+            max_iterations=self.max_iterations or None,
+            max_seconds=self.time_budget,
+            max_tokens=self.token_budget,
+        )
+
+@dataclass
+class BuildResult:
+    artifact: bytes
+    sources: dict[str, str]
+    dependencies: list[str]
+    log_path: str
+
+class Compiler:
+    """
+    Build programs from specs, sharing models, caches and the dependency
+    wheelhouse across builds.
+    """
+
+    def __init__(
+            self,
+            models: ModelRouter | None = None,
+            cache_dir: str | None = None,
+            prefetch: bool = True,
+            remote_cache: CacheClient | None = None,
+            job_queue: JobQueue | None = None,
+        ):
+        self.models = ModelRouter() if models is None else models
+        self.cache_dir = get_cache_dir(cache_dir)
+        self.module_index = ModuleIndex(os.path.join(self.cache_dir, "modules.jsonl"))
+        self.wheelhouse = os.path.join(self.cache_dir, "wheels")
+        self.stats = StatsStore(os.path.join(self.cache_dir, "stats.sqlite3"))
+        self.remote_cache = remote_cache
+        self.job_queue = job_queue
+
+        if prefetch:
+            self.prefetcher = DependencyPrefetcher(self.wheelhouse)
+        else:
+            self.prefetcher = None
+
+    async def build(
+            self,
+            out_path: str,
+            options: BuildOptions = BuildOptions(),
+            in_paths: list[str] = [],
+            english_all: dict[str, str] = {},
+            progress: Progress = default_progress,
+            on_event: Callable[[dict], None] = lambda e: None,
+            target: str | None = None,
+        ) -> tuple[dict, str]:
+        """
+        Build specs, read from `in_paths` or given in `english_all`, into
+        an executable at `out_path`. Warm starts come from the last build
+        of `target`, which defaults to the absolute `out_path`.
+
+        Returns the final pipeline state and the path of the build log.
+        """
+
+        if options.lockfile is not None:
+            lock_path = options.lockfile
+        elif len(in_paths) > 0:
+            lock_path = get_default_lock_path(in_paths)
+        else:
+            lock_path = None
+
+        lock = None if lock_path is None else Lockfile.load(lock_path)
+
+        if options.locked and lock is None:
+            raise FileNotFoundError(f"--locked needs a lockfile at {lock_path}")
+
+        if options.warm_start:
+            build_store = BuildStore(
+                os.path.join(self.cache_dir, "builds"),
+                os.path.abspath(out_path) if target is None else target,
+            )
+        else:
+            build_store = None
+
+        package_options = options.package_options
+
+        if package_options.env_root is None:
+            package_options.env_root = os.path.join(self.cache_dir, "envs")
+
+        if options.log_root is None:
+            log_root = os.path.join(self.cache_dir, "logs")
+        else:
+            log_root = options.log_root
+
+        log_sink = LogSink(
+            root=log_root,
+            format=LogFormat(options.log_format),
+            keep=options.log_keep,
+            max_bytes=options.log_max_bytes,
+        )
+
+        # completions reach the shared cache only if the build passes
+        models = self.models.buffered()
+
+        with log_sink:
+            pipeline = VernacPipeline(
+                "start",
+                [
+                    ReadSourceStage("Reading source"),
+                    MapModulesStage(
+                        "Mapping modules",
+                        lock=lock if options.locked else None,
+                    ),
+                    RunPipelinesStage(
+                        out_path=out_path,
+                        injects=options.injects,
+                        package_dir=options.package_dir,
+                        package_options=package_options,
+                        max_prompt_tokens=options.max_prompt_tokens,
+                        contract_first=options.contract_first,
+                        check_performance=options.check_performance,
+                        optimize=options.optimize,
+                        module_index=self.module_index if options.reuse else None,
+                        reuse_similarity=options.reuse_similarity,
+                        build_store=build_store,
+                        lock_path=lock_path,
+                        lock=lock,
+                        locked=options.locked,
+                        wheelhouse=self.wheelhouse,
+                        prefetcher=self.prefetcher,
+                        fork_server=options.fork_server,
+                        remote_cache=self.remote_cache,
+                        combine_module_calls=options.combine_module_calls,
+                        module_concurrency=options.jobs,
+                        job_queue=self.job_queue,
+                    ),
+                ],
+                log_sink=log_sink,
+                models=models,
+                verbose=options.verbose,
+                progress=progress,
+                on_event=on_event,
+                convergence=options.convergence,
+                stats=self.stats,
+                spec="start/" + ",".join(sorted(map(os.path.basename, in_paths)) + sorted(english_all)),
+            )
+
+            state = await pipeline.run(dict(in_paths=in_paths, english_all=english_all))
+
+        await asyncio.to_thread(models.publish)
+
+        return (state, log_sink.path)
+
+    async def compile(
+            self,
+            specs: dict[str, str],
+            options: BuildOptions = BuildOptions(),
+            on_event: Callable[[dict], None] = lambda e: None,
+        ) -> BuildResult:
+        """
+        Build specs, keyed by file name, into an in-memory executable.
+        """
+
+        if PackageLayout(options.layout) == PackageLayout.DIRECTORY:
+            raise ValueError("the directory layout cannot be returned in memory")
+
+        with TemporaryDirectory(prefix="vernac-out-") as out_dir:
+            out_path = os.path.join(out_dir, "program")
+            (state, log_path) = await self.build(
+                out_path,
+                options=options,
+                english_all=specs,
+                progress=Progress(disable=True),
+                on_event=on_event,
+                # the output path is temporary, so builds of the same specs share a store
+                target="specs:" + ",".join(sorted(specs)),
+            )
+
+            with open(out_path, "rb") as out_file:
+                artifact = out_file.read()
+
+        sources = {n: m["python"] for (n, m) in state["modules"].items()}
+        sources[state["main_name"]] = state["python"]
+        dependencies = set(state["dependencies"])
+
+        for module in state["modules"].values():
+            dependencies.update(module["dependencies"])
+
+        return BuildResult(
+            artifact=artifact,
+            sources=sources,
+            dependencies=sorted(dependencies),
+            log_path=log_path,
+        )
+
+async def compile(
+        specs: dict[str, str],
+        options: BuildOptions = BuildOptions(),
+    ) -> BuildResult:
+    """
+    Build specs, keyed by file name, into an in-memory executable.
+    """
+
+    return await Compiler().compile(specs, options)
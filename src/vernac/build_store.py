@@ -0,0 +1,57 @@
+import os
+import os.path
+import json
+import difflib
+import hashlib
+
+def get_target_key(target: str) -> str:
+    return hashlib.sha256(target.encode("utf-8")).hexdigest()
+
+def get_spec_diff(old_english: str, new_english: str) -> str:
+    lines = difflib.unified_diff(
+        old_english.splitlines(keepends=True),
+        new_english.splitlines(keepends=True),
+        fromfile="previous",
+        tofile="current",
+    )
+
+    return "".join(l if l.endswith("\n") else f"{l}\n" for l in lines)
+
+def get_warm_start(previous: dict[str, dict], name: str, english: str) -> dict:
+    """
+    Pipeline state that starts generation from the previous code for `name`.
+    """
+
+    if name not in previous:
+        return {}
+
+    return dict(
+        first_draft=previous[name]["python"],
+        spec_diff=get_spec_diff(previous[name]["english"], english),
+    )
+
+class BuildStore:
+    """
+    The accepted spec and code of each source in the last successful build of
+    one target, such as the absolute output path.
+    """
+
+    def __init__(self, root: str, target: str):
+        self.path = os.path.join(root, f"{get_target_key(target)}.json")
+
+    def load(self) -> dict[str, dict]:
+        try:
+            with open(self.path) as store_file:
+                return json.load(store_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self, sources: dict[str, dict]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        partial_path = f"{self.path}.{os.getpid()}.partial"
+
+        with open(partial_path, "w") as store_file:
+            json.dump(sources, store_file, indent=2)
+
+        os.replace(partial_path, self.path)
@@ -0,0 +1,166 @@
+import os
+import os.path
+import re
+import asyncio
+import argparse
+
+from vernac.remote_cache import (
+    DIGEST_HEADER,
+    get_digest,
+)
+from vernac.server import (
+    HTTPError,
+    read_request,
+    write_response,
+    write_json,
+)
+
+NAMESPACE_PATTERN = re.compile(r"[a-z_]+")
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+def read_entry(entry_path: str) -> tuple[bytes, str]:
+    with open(f"{entry_path}.sha256") as digest_file:
+        digest = digest_file.read()
+
+    with open(entry_path, "rb") as entry_file:
+        return (entry_file.read(), digest)
+
+def write_entry(entry_path: str, data: bytes, digest: str):
+    # the digest recorded at upload lets clients detect later corruption
+    for (path, contents) in [(entry_path, data), (f"{entry_path}.sha256", digest.encode())]:
+        partial_path = f"{path}.{os.getpid()}.{id(data)}.partial"
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(partial_path, "wb") as partial_file:
+            partial_file.write(contents)
+
+        os.replace(partial_path, path)
+
+class CacheServer:
+    """
+    Content-addressed blob store over HTTP, for sharing completions, module
+    builds and packaged programs between machines.
+
+    Entries are written once and verified against their SHA-256 on the way
+    in; clients verify them again on the way out.
+    """
+
+    def __init__(
+            self,
+            root: str,
+            read_only: bool = False,
+            max_entry_bytes: int = 512 * 1024 ** 2,
+        ):
+        self.root = root
+        self.read_only = read_only
+        self.max_entry_bytes = max_entry_bytes
+
+    def get_entry_path(self, namespace: str, key: str) -> str:
+        if not (NAMESPACE_PATTERN.fullmatch(namespace) and KEY_PATTERN.fullmatch(key)):
+            raise HTTPError(404, f"not a cache entry: {namespace}/{key}")
+
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            (method, path, headers, body) = await read_request(
+                reader,
+                max_body_bytes=self.max_entry_bytes,
+            )
+
+            await self.route(method, path, headers, body, writer)
+        except HTTPError as error:
+            await write_json(writer, error.status, dict(error=str(error)))
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(
+            self,
+            method: str,
+            path: str,
+            headers: dict[str, str],
+            body: bytes,
+            writer: asyncio.StreamWriter,
+        ):
+        match (method, path.strip("/").split("/")):
+            case ("GET", ["cache", namespace, key]):
+                entry_path = self.get_entry_path(namespace, key)
+
+                try:
+                    (data, digest) = await asyncio.to_thread(read_entry, entry_path)
+                except FileNotFoundError:
+                    raise HTTPError(404, f"no entry {namespace}/{key}")
+
+                await write_response(
+                    writer,
+                    200,
+                    data,
+                    "application/octet-stream",
+                    headers={DIGEST_HEADER: digest},
+                )
+
+            case ("PUT", ["cache", namespace, key]):
+                if self.read_only:
+                    raise HTTPError(405, "this cache is read-only")
+
+                digest = headers.get(DIGEST_HEADER.lower())
+
+                if digest != get_digest(body):
+                    raise HTTPError(400, "body does not match its digest")
+
+                await asyncio.to_thread(
+                    write_entry,
+                    self.get_entry_path(namespace, key),
+                    body,
+                    digest,
+                )
+
+                await write_json(writer, 200, dict(stored=f"{namespace}/{key}"))
+
+            case _:
+                raise HTTPError(404, f"not found: {path}")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8766) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
+
+async def main(host: str, port: int, root: str, read_only: bool = False):
+    server = await CacheServer(root, read_only=read_only).serve(host, port)
+
+    async with server:
+        await server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "root",
+        metavar="PATH",
+        help="directory to store cache entries in",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8766,
+        help="port to listen on",
+    )
+    parser.add_argument(
+        "--read-only",
+        action="store_true",
+        help="serve existing entries but refuse new ones",
+    )
+
+    return parser.parse_args()
+
+def script_main():
+    asyncio.run(main(**vars(parse_args())))
+
+if __name__ == "__main__":
+    script_main()
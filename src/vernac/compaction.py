@@ -0,0 +1,116 @@
+import re
+import ast
+
+from vernac.tokens import CHARS_PER_TOKEN
+
+ELIDED_MARKER = "...  # vernac: unchanged"
+ELIDED_PATTERN = re.compile(
+    r"^(?P<indent>[ \t]*)" + re.escape(ELIDED_MARKER) + r" (?P<name>[\w.]+)[ \t]*$",
+    re.MULTILINE,
+)
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    if len(text) <= max_chars:
+        return text
+
+    head = text[:max_chars // 2]
+    tail = text[-(max_chars // 2):]
+    omitted = len(text) - len(head) - len(tail)
+
+    return f"{head}\n... [{omitted} characters omitted] ...\n{tail}"
+
+def imported_vnprog_modules(python: str) -> set[str] | None:
+    try:
+        tree = ast.parse(python)
+    except SyntaxError:
+        return None
+
+    names = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.startswith("vnprog."):
+                    names.add(alias.name.split(".")[1])
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            if node.module == "vnprog":
+                names.update(a.name for a in node.names)
+            elif node.module.startswith("vnprog."):
+                names.add(node.module.split(".")[1])
+
+    return names
+
+def iter_functions(tree: ast.Module):
+    function_types = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+    for node in tree.body:
+        if isinstance(node, function_types):
+            yield (node.name, node)
+        elif isinstance(node, ast.ClassDef):
+            for child in node.body:
+                if isinstance(child, function_types):
+                    yield (f"{node.name}.{child.name}", child)
+
+def elide_draft(
+        python: str,
+        keep: set[str],
+        min_lines: int = 4,
+    ) -> tuple[str, dict[str, str]]:
+    """
+    Replace long function bodies not named in `keep` with marker lines.
+
+    Returns the elided source and the original bodies by qualified name, for
+    `restore_elided` to splice back into whatever the model writes.
+    """
+
+    try:
+        tree = ast.parse(python)
+    except SyntaxError:
+        return (python, {})
+
+    lines = python.splitlines(keepends=True)
+    replacements = []
+    bodies = {}
+
+    for (qualname, node) in iter_functions(tree):
+        body = node.body
+
+        # keep docstrings visible
+        if (
+            isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            body = body[1:]
+
+        if len(body) == 0 or node.name in keep or qualname in keep:
+            continue
+
+        first = body[0].lineno - 1
+        last = body[-1].end_lineno
+
+        if last - first < min_lines or body[0].lineno == node.lineno:
+            continue
+
+        indent = lines[first][:body[0].col_offset]
+        bodies[qualname] = "".join(lines[first:last])
+
+        replacements.append((first, last, f"{indent}{ELIDED_MARKER} {qualname}\n"))
+
+    for (first, last, marker) in reversed(replacements):
+        lines[first:last] = [marker]
+
+    return ("".join(lines), bodies)
+
+def restore_elided(python: str, bodies: dict[str, str]) -> str:
+    def replace(match: re.Match) -> str:
+        body = bodies.get(match.group("name"))
+
+        if body is None:
+            return match.group(0)
+        else:
+            return body.rstrip("\n")
+
+    return ELIDED_PATTERN.sub(replace, python)
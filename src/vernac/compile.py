@@ -1,35 +1,75 @@
+import sys
 import argparse
 import asyncio
 
-from vernac.pipeline import VernacPipeline
-from vernac.stages.all import (
-    ReadSourceStage,
-    MapModulesStage,
-    RunPipelinesStage,
+from vernac.llm import (
+    ModelRouter,
+    model_override_arg,
 )
+from vernac.hedging import LatencyPolicy
+from vernac.logs import LogFormat
+from vernac.api import (
+    BuildOptions,
+    Compiler,
+)
+from vernac.lockfile import LOCKFILE_NAME
+from vernac.convergence import ConvergenceError
+from vernac.remote_cache import (
+    CacheClient,
+    CacheMode,
+)
+from vernac.work_queue import SqliteJobQueue
+from vernac.stages.package import PackageLayout
 
 async def main(
         in_paths: list[str],
         out_path: str,
         injects_list: list[tuple[str, str]],
-        verbose: bool = False,
-        package_dir: str | None = None,
+        log_root: str = "logs",
+        models_config: str | None = None,
+        model_overrides: list[str] = [],
+        ttft_timeout: float = 60.0,
+        stall_timeout: float = 30.0,
+        retries: int = 2,
+        hedge: bool = False,
+        cache_dir: str | None = None,
+        prefetch: bool = True,
+        cache_url: str | None = None,
+        cache_mode: str = CacheMode.READ_WRITE.value,
+        queue_path: str | None = None,
+        **build_kwargs,
     ):
-    pipeline = VernacPipeline(
-        "start",
-        [
-            ReadSourceStage("Reading source"),
-            MapModulesStage("Mapping modules"),
-            RunPipelinesStage(
-                out_path=out_path,
-                injects=dict(injects_list),
-                package_dir=package_dir,
-            ),
-        ],
-        verbose=verbose,
-    )
-
-    await pipeline.run(dict(in_paths=in_paths))
+    if cache_url is None:
+        remote_cache = None
+    else:
+        remote_cache = CacheClient(cache_url, mode=CacheMode(cache_mode))
+
+    latency = LatencyPolicy(
+        ttft_timeout=ttft_timeout,
+        stall_timeout=stall_timeout,
+        retries=retries,
+        hedge=hedge,
+    )
+    models = ModelRouter.from_config(
+        models_config,
+        overrides=model_overrides,
+        latency=latency,
+        cache=remote_cache,
+    )
+    compiler = Compiler(
+        models=models,
+        cache_dir=cache_dir,
+        prefetch=prefetch,
+        remote_cache=remote_cache,
+        job_queue=None if queue_path is None else SqliteJobQueue(queue_path),
+    )
+    options = BuildOptions(
+        injects=dict(injects_list),
+        log_root=log_root,
+        **build_kwargs,
+    )
+
+    await compiler.build(out_path, options=options, in_paths=in_paths)
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -64,6 +104,220 @@ def parse_args():
         metavar="PATH",
         help="write package source here instead of temp dir",
     )
+    parser.add_argument(
+        "--layout",
+        choices=[l.value for l in PackageLayout],
+        default=PackageLayout.SHIV.value,
+        help="shiv pyz, pre-extracted directory, zipimport-only pyz, or thin pyz using a shared environment",
+    )
+    parser.add_argument(
+        "--env-root",
+        metavar="PATH",
+        help="keep shared dependency environments here (default: CACHE_DIR/envs)",
+    )
+    parser.add_argument(
+        "--python",
+        metavar="PATH",
+        help="target interpreter for the shebang and precompiled bytecode",
+    )
+    parser.add_argument(
+        "--compile-pyc",
+        action="store_true",
+        help="precompile dependency bytecode at build time",
+    )
+    parser.add_argument(
+        "--strip",
+        action="store_true",
+        help="remove tests and unneeded dist files from dependencies",
+    )
+    parser.add_argument(
+        "--measure",
+        action="store_true",
+        help="report artifact size and cold/warm startup time",
+    )
+    parser.add_argument(
+        "--max-prompt-tokens",
+        metavar="N",
+        type=int,
+        default=6000,
+        help="compact code generation prompts to fit this budget",
+    )
+    parser.add_argument(
+        "--log-root",
+        metavar="PATH",
+        default="logs",
+        help="write per-build logs under this directory",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=[f.value for f in LogFormat],
+        default=LogFormat.DIRECTORY.value,
+        help="one directory per build, or one compressed archive per build",
+    )
+    parser.add_argument(
+        "--log-keep",
+        metavar="N",
+        type=int,
+        help="keep only the logs of the last N builds",
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        metavar="N",
+        type=int,
+        help="delete the oldest build logs beyond this total size",
+    )
+    parser.add_argument(
+        "--models-config",
+        metavar="PATH",
+        help="TOML file defining backends and a model for each stage role",
+    )
+    parser.add_argument(
+        "--model",
+        metavar="ROLE=MODEL",
+        dest="model_overrides",
+        type=model_override_arg,
+        action="append",
+        default=[],
+        help="use MODEL (or BACKEND:MODEL) for ROLE, e.g. classify=gpt-3.5-turbo",
+    )
+    parser.add_argument(
+        "--ttft-timeout",
+        metavar="SECONDS",
+        type=float,
+        default=60.0,
+        help="retry completions whose first token takes longer than this",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        metavar="SECONDS",
+        type=float,
+        default=30.0,
+        help="retry completions that stop streaming for this long",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="N",
+        type=int,
+        default=2,
+        help="retries after a stalled completion",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="send a duplicate request when the first token is unusually slow",
+    )
+    parser.add_argument(
+        "--contract-first",
+        action="store_true",
+        help="agree on module interfaces first, then generate modules and main concurrently",
+    )
+    parser.add_argument(
+        "--max-iterations",
+        metavar="N",
+        type=int,
+        default=8,
+        help="give up on a source after N failed repair attempts (0 for no limit)",
+    )
+    parser.add_argument(
+        "--time-budget",
+        metavar="SECONDS",
+        type=float,
+        help="give up on a source that is still failing after this long",
+    )
+    parser.add_argument(
+        "--token-budget",
+        metavar="N",
+        type=int,
+        help="give up on a source that is still failing after N prompt tokens",
+    )
+    parser.add_argument(
+        "--combine-module-calls",
+        action="store_true",
+        help="generate each module's code, dependencies and documentation in one completion",
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        help="run at most N module pipelines at once, longest first by past builds",
+    )
+    parser.add_argument(
+        "--check-performance",
+        action="store_true",
+        help="time the program against performance budgets stated in the spec",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="profile the program on its tests and rewrite its hottest functions if that makes it faster",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        metavar="PATH",
+        help="keep reusable build data here (default: ~/.cache/vernac)",
+    )
+    parser.add_argument(
+        "--cache-url",
+        metavar="URL",
+        help="share completions, modules and programs through this cache server",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=[m.value for m in CacheMode],
+        default=CacheMode.READ_WRITE.value,
+        help="only read from the shared cache (ro), or also fill it (rw)",
+    )
+    parser.add_argument(
+        "--queue",
+        metavar="PATH",
+        dest="queue_path",
+        help="generate modules on workers (vernac-worker PATH) sharing this SQLite job queue",
+    )
+    parser.add_argument(
+        "--no-reuse",
+        dest="reuse",
+        action="store_false",
+        help="do not reuse or warm-start from modules built previously",
+    )
+    parser.add_argument(
+        "--reuse-similarity",
+        metavar="X",
+        type=float,
+        default=0.6,
+        help="warm-start modules from previous specs at least this similar (0-1)",
+    )
+
+    parser.add_argument(
+        "--no-warm-start",
+        dest="warm_start",
+        action="store_false",
+        help="do not start from the code of the last successful build of this output",
+    )
+
+    parser.add_argument(
+        "--lockfile",
+        metavar="PATH",
+        help=f"record accepted sources and pinned dependencies here (default: {LOCKFILE_NAME} next to the first spec)",
+    )
+    parser.add_argument(
+        "--locked",
+        action="store_true",
+        help="rebuild specs unchanged since the lockfile without generating or checking them",
+    )
+
+    parser.add_argument(
+        "--no-prefetch",
+        dest="prefetch",
+        action="store_false",
+        help="do not fetch dependencies named in generated code until packaging",
+    )
+
+    parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="run spec tests from the package sources in a preloaded, forking interpreter",
+    )
 
     args = parser.parse_args()
 
@@ -72,7 +326,12 @@ def parse_args():
 def script_main():
     main_kwargs = vars(parse_args())
 
-    asyncio.run(main(**main_kwargs))
+    try:
+        asyncio.run(main(**main_kwargs))
+    except ConvergenceError as error:
+        print(error.describe(), file=sys.stderr)
+
+        sys.exit(1)
 
 if __name__ == "__main__":
     script_main()
@@ -0,0 +1,174 @@
+import ast
+import time
+import hashlib
+
+from enum import Enum
+from dataclasses import (
+    dataclass,
+    field,
+)
+
+@dataclass
+class ConvergencePolicy:
+    max_iterations: int | None = 8
+    max_seconds: float | None = None
+    max_tokens: int | None = None
+    # loops without progress before escalating, or giving up
+    stagnation_limit: int = 2
+    candidates: int = 3
+
+class Escalation(Enum):
+    FRESH = "fresh"
+    STRONGER_MODEL = "stronger_model"
+    CANDIDATES = "candidates"
+
+ESCALATIONS = list(Escalation)
+
+def get_code_hash(python: str) -> str:
+    """
+    Hash code by its syntax tree where possible, so formatting and comments
+    do not make the same program look new.
+    """
+
+    try:
+        canonical = ast.dump(ast.parse(python))
+    except SyntaxError:
+        canonical = python
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def get_program_hash(state: dict) -> str:
+    # modules count too, since a loop may repair a module and keep main
+    modules = state.get("modules", {})
+    hashes = [get_code_hash(state.get("python", ""))]
+    hashes += [get_code_hash(modules[n].get("python", "")) for n in sorted(modules)]
+
+    return hashlib.sha256("\n".join(hashes).encode("utf-8")).hexdigest()
+
+def get_failures_hash(failures: list) -> str:
+    # the inputs identify which checks failed; the descriptions vary run to run
+    canonical = "\n".join(sorted(f.input for f in failures))
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ConvergenceError(Exception):
+    def __init__(self, pipeline: str, reason: str, report: dict):
+        super().__init__(f"{pipeline} did not converge: {reason}")
+
+        self.pipeline = pipeline
+        self.reason = reason
+        self.report = report
+
+    def describe(self) -> str:
+        lines = [
+            str(self),
+            f"  iterations: {len(self.report['iterations'])}",
+            f"  elapsed: {self.report['elapsed_seconds']:.1f}s",
+            f"  prompt tokens: {self.report['prompt_tokens']}",
+            f"  escalations tried: {', '.join(self.report['escalations']) or 'none'}",
+            "  last failures:",
+        ]
+
+        for failure in self.report["last_failures"]:
+            lines.append(f"    - {failure['input']} {failure['actual'].strip()}")
+
+        return "\n".join(lines)
+
+@dataclass
+class ConvergenceTracker:
+    """
+    Watch a pipeline's repair loop, escalating when it stops making progress
+    and raising `ConvergenceError` once it runs out of budget or strategies.
+    """
+
+    pipeline: str
+    policy: ConvergencePolicy
+    started_at: float = field(default_factory=time.monotonic)
+    prompt_tokens: int = 0
+    code_hashes: set[str] = field(default_factory=set)
+    program_hashes: set[str] = field(default_factory=set)
+    failure_hashes: set[str] = field(default_factory=set)
+    stagnant: int = 0
+    escalations: list[Escalation] = field(default_factory=list)
+    iterations: list[dict] = field(default_factory=list)
+
+    def get_report(self, state: dict) -> dict:
+        return dict(
+            elapsed_seconds=time.monotonic() - self.started_at,
+            prompt_tokens=self.prompt_tokens,
+            escalations=[e.value for e in self.escalations],
+            iterations=self.iterations,
+            last_failures=[f.__dict__ for f in state.get("test_failures", [])],
+        )
+
+    def fail(self, reason: str, state: dict):
+        raise ConvergenceError(self.pipeline, reason, self.get_report(state))
+
+    def escalate(self) -> dict | None:
+        """
+        Return state changes for the next strategy, or None when none are left.
+        """
+
+        if len(self.escalations) == len(ESCALATIONS):
+            return None
+
+        escalation = ESCALATIONS[len(self.escalations)]
+        self.escalations.append(escalation)
+        self.stagnant = 0
+
+        match escalation:
+            case Escalation.FRESH:
+                return dict(first_draft=None, spec_diff=None, test_failures=[])
+
+            case Escalation.STRONGER_MODEL:
+                return dict(escalated=True)
+
+            case Escalation.CANDIDATES:
+                return dict(candidates=self.policy.candidates)
+
+    def loop(self, state: dict) -> dict:
+        """
+        Record a failed iteration and return state changes for the next one.
+        """
+
+        policy = self.policy
+        program_hash = get_program_hash(state)
+        failures_hash = get_failures_hash(state.get("test_failures", []))
+        progress = not (
+            program_hash in self.program_hashes
+            or failures_hash in self.failure_hashes
+        )
+
+        self.code_hashes.add(get_code_hash(state.get("python", "")))
+        self.program_hashes.add(program_hash)
+        self.failure_hashes.add(failures_hash)
+        self.stagnant = 0 if progress else self.stagnant + 1
+        self.iterations.append(
+            dict(
+                program_hash=program_hash,
+                failures_hash=failures_hash,
+                progress=progress,
+                failures=len(state.get("test_failures", [])),
+            )
+        )
+
+        if policy.max_iterations is not None and len(self.iterations) >= policy.max_iterations:
+            self.fail(f"still failing after {len(self.iterations)} iterations", state)
+
+        if policy.max_seconds is not None and time.monotonic() - self.started_at > policy.max_seconds:
+            self.fail(f"over its {policy.max_seconds:.0f}s time budget", state)
+
+        if policy.max_tokens is not None and self.prompt_tokens > policy.max_tokens:
+            self.fail(f"over its {policy.max_tokens} prompt token budget", state)
+
+        changes = dict(tried_hashes=sorted(self.code_hashes))
+
+        if self.stagnant >= policy.stagnation_limit:
+            escalation = self.escalate()
+
+            if escalation is None:
+                self.fail("no progress after every escalation", state)
+
+            changes |= escalation
+
+        return changes
@@ -0,0 +1,456 @@
+import os
+import os.path
+import time
+import base64
+import socket
+import asyncio
+import argparse
+import itertools
+
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+)
+from dataclasses import (
+    asdict,
+    replace,
+)
+from tempfile import TemporaryDirectory
+
+from rich.progress import Progress
+
+from vernac.llm import (
+    ModelRouter,
+    model_override_arg,
+)
+from vernac.logs import (
+    LogFormat,
+    LogSink,
+)
+from vernac.pipeline import VernacPipeline
+from vernac.convergence import ConvergencePolicy
+from vernac.api import (
+    BuildOptions,
+    BuildResult,
+    Compiler,
+)
+from vernac.remote_cache import (
+    CacheClient,
+    CacheMode,
+)
+from vernac.work_queue import (
+    JobQueue,
+    QueuedJob,
+    SqliteJobQueue,
+)
+from vernac.stages.package import make_executable
+from vernac.stages.run_pipelines import build_module_stages
+
+# the parts of a module pipeline's state that the main pipeline uses
+MODULE_KEYS = ["vn_name", "english", "py_name", "python", "dependencies", "documentation", "contract"]
+
+# build options that mean the same on any worker; paths, interpreters and
+# lockfiles on the coordinator may not exist there
+WORKER_OPTIONS = {
+    "layout",
+    "compile_pyc",
+    "strip",
+    "measure",
+    "max_prompt_tokens",
+    "contract_first",
+    "check_performance",
+    "optimize",
+    "fork_server",
+    "combine_module_calls",
+    "jobs",
+    "max_iterations",
+    "time_budget",
+    "token_budget",
+    "reuse",
+    "reuse_similarity",
+    "warm_start",
+}
+
+def encode_bytes(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+def decode_bytes(data: str) -> bytes:
+    return base64.b64decode(data)
+
+async def run_logged(run: Callable[[LogSink], Awaitable[Any]]) -> tuple[Any, str]:
+    """
+    Run with a fresh JSONL log, returning the run's value and the log,
+    encoded for a job result.
+    """
+
+    with TemporaryDirectory(prefix="vernac-worker-") as log_root:
+        with LogSink(root=log_root, format=LogFormat.JSONL) as log_sink:
+            value = await run(log_sink)
+
+        with open(log_sink.path, "rb") as log_file:
+            return (value, encode_bytes(log_file.read()))
+
+class BuildWorker:
+    """
+    Take build and module jobs from a queue and run them with this machine's
+    compiler, models and caches, renewing each job's lease while it runs.
+    """
+
+    def __init__(
+            self,
+            queue: JobQueue,
+            compiler: Compiler,
+            name: str | None = None,
+            lease_seconds: float = 60.0,
+            poll_interval: float = 1.0,
+        ):
+        self.queue = queue
+        self.compiler = compiler
+        self.name = f"{socket.gethostname()}:{os.getpid()}" if name is None else name
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    async def run_build(self, payload: dict) -> dict:
+        with TemporaryDirectory(prefix="vernac-worker-") as log_root:
+            options = BuildOptions(
+                **payload["options"],
+                log_root=log_root,
+                log_format=LogFormat.JSONL.value,
+            )
+            result = await self.compiler.compile(payload["specs"], options)
+
+            with open(result.log_path, "rb") as log_file:
+                logs = encode_bytes(log_file.read())
+
+        return dict(
+            artifact=encode_bytes(result.artifact),
+            sources=result.sources,
+            dependencies=result.dependencies,
+            logs=logs,
+        )
+
+    async def run_module(self, payload: dict) -> dict:
+        settings = payload["settings"]
+        compiler = self.compiler
+
+        if payload["convergence"] is None:
+            convergence = None
+        else:
+            convergence = ConvergencePolicy(**payload["convergence"])
+
+        # the time budget ran from submission, not from when this job was claimed
+        if convergence is not None and payload.get("deadline") is not None:
+            convergence = replace(
+                convergence,
+                max_seconds=max(0.0, payload["deadline"] - time.time()),
+            )
+
+        # the build that submitted this module decides whether to share its completions
+        models = compiler.models.buffered()
+
+        async def run(log_sink: LogSink) -> dict:
+            module_stages = build_module_stages(
+                max_prompt_tokens=settings["max_prompt_tokens"],
+                contract_first=settings["contract_first"],
+                module_index=compiler.module_index if settings["reuse"] else None,
+                reuse_similarity=settings["reuse_similarity"],
+                prefetcher=compiler.prefetcher,
+                combine_calls=settings["combine_calls"],
+            )
+            pipeline = VernacPipeline(
+                payload["pipeline"],
+                module_stages,
+                log_sink=log_sink,
+                models=models,
+                progress=Progress(disable=True),
+                convergence=convergence,
+                stats=compiler.stats,
+                spec=payload["spec"],
+            )
+
+            return await pipeline.run(payload["state"])
+
+        (state, logs) = await run_logged(run)
+
+        return dict(
+            state={k: state[k] for k in MODULE_KEYS if k in state},
+            logs=logs,
+            completions=models.pending,
+        )
+
+    async def run_job(self, job: QueuedJob) -> dict:
+        match job.kind:
+            case "build":
+                return await self.run_build(job.payload)
+            case "module":
+                return await self.run_module(job.payload)
+            case _:
+                raise ValueError(f"unknown job kind: {job.kind}")
+
+    async def keep_lease(self, job: QueuedJob):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+
+            renewed = await asyncio.to_thread(
+                self.queue.renew,
+                job.id,
+                self.name,
+                self.lease_seconds,
+            )
+
+            # another worker has taken the job over; its result will count
+            if not renewed:
+                return
+
+    async def work_once(self) -> bool:
+        """
+        Run one job if one is waiting, returning whether there was one.
+        """
+
+        job = await asyncio.to_thread(self.queue.claim, self.name, self.lease_seconds)
+
+        if job is None:
+            return False
+
+        lease = asyncio.create_task(self.keep_lease(job))
+
+        try:
+            result = await self.run_job(job)
+            error = None
+        except Exception as job_error:
+            result = None
+            error = f"{type(job_error).__name__}: {job_error}"
+        finally:
+            lease.cancel()
+
+        await asyncio.to_thread(self.queue.finish, job.id, self.name, result, error)
+
+        return True
+
+    async def work(self, exit_when_idle: bool = False):
+        while True:
+            if not await self.work_once():
+                if exit_when_idle:
+                    return
+
+                await asyncio.sleep(self.poll_interval)
+
+class BuildCoordinator:
+    """
+    Run whole builds on workers, the way `Compiler.compile` runs them here,
+    so that a batch of targets spreads across machines.
+    """
+
+    def __init__(self, queue: JobQueue, log_root: str = "logs"):
+        self.queue = queue
+        self.log_root = log_root
+
+    async def compile(
+            self,
+            specs: dict[str, str],
+            options: BuildOptions = BuildOptions(),
+            priority: int = 0,
+        ) -> BuildResult:
+        payload = dict(
+            specs=specs,
+            options={k: v for (k, v) in asdict(options).items() if k in WORKER_OPTIONS},
+        )
+        job_id = await asyncio.to_thread(self.queue.submit, "build", payload, priority)
+        result = await self.queue.wait(job_id)
+        log_path = os.path.join(self.log_root, f"{job_id}.jsonl.gz")
+
+        os.makedirs(self.log_root, exist_ok=True)
+
+        with open(log_path, "wb") as log_file:
+            log_file.write(decode_bytes(result["logs"]))
+
+        return BuildResult(
+            artifact=decode_bytes(result["artifact"]),
+            sources=result["sources"],
+            dependencies=result["dependencies"],
+            log_path=log_path,
+        )
+
+async def main(
+        queue_path: str,
+        concurrency: int = 1,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        exit_when_idle: bool = False,
+        cache_dir: str | None = None,
+        models_config: str | None = None,
+        model_overrides: list[str] = [],
+        cache_url: str | None = None,
+        cache_mode: str = CacheMode.READ_WRITE.value,
+    ):
+    if cache_url is None:
+        remote_cache = None
+    else:
+        remote_cache = CacheClient(cache_url, mode=CacheMode(cache_mode))
+
+    models = ModelRouter.from_config(
+        models_config,
+        overrides=model_overrides,
+        cache=remote_cache,
+    )
+    compiler = Compiler(models=models, cache_dir=cache_dir, remote_cache=remote_cache)
+    queue = SqliteJobQueue(queue_path)
+    hostname = socket.gethostname()
+    numbers = itertools.count()
+    workers = [
+        BuildWorker(
+            queue,
+            compiler,
+            name=f"{hostname}:{os.getpid()}:{next(numbers)}",
+            lease_seconds=lease_seconds,
+            poll_interval=poll_interval,
+        )
+        for _ in range(concurrency)
+    ]
+
+    await asyncio.gather(*(w.work(exit_when_idle=exit_when_idle) for w in workers))
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "queue_path",
+        metavar="PATH",
+        help="SQLite job queue to take jobs from",
+    )
+    parser.add_argument(
+        "--concurrency",
+        metavar="N",
+        type=int,
+        default=1,
+        help="number of jobs to run at once",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        metavar="SECONDS",
+        type=float,
+        default=60.0,
+        help="hand a job to another worker if this one stops renewing it for this long",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="wait this long between checks of an empty queue",
+    )
+    parser.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="exit once the queue is empty instead of waiting for more jobs",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="PATH",
+        help="keep reusable build data here (default: ~/.cache/vernac)",
+    )
+    parser.add_argument(
+        "--cache-url",
+        metavar="URL",
+        help="share completions, modules and programs through this cache server",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=[m.value for m in CacheMode],
+        default=CacheMode.READ_WRITE.value,
+        help="only read from the shared cache (ro), or also fill it (rw)",
+    )
+    parser.add_argument(
+        "--models-config",
+        metavar="PATH",
+        help="TOML file defining backends and a model for each stage role",
+    )
+    parser.add_argument(
+        "--model",
+        metavar="ROLE=MODEL",
+        dest="model_overrides",
+        type=model_override_arg,
+        action="append",
+        default=[],
+        help="use MODEL (or BACKEND:MODEL) for ROLE",
+    )
+
+    return parser.parse_args()
+
+def script_main():
+    asyncio.run(main(**vars(parse_args())))
+
+async def batch_main(
+        queue_path: str,
+        targets: list[list[str]],
+        log_root: str = "logs",
+        priority: int = 0,
+    ):
+    coordinator = BuildCoordinator(SqliteJobQueue(queue_path), log_root=log_root)
+
+    async def build(out_path: str, in_paths: list[str]):
+        specs = {}
+
+        for in_path in in_paths:
+            with open(in_path) as in_file:
+                specs[os.path.basename(in_path)] = in_file.read()
+
+        result = await coordinator.compile(specs, priority=priority)
+
+        with open(out_path, "wb") as out_file:
+            out_file.write(result.artifact)
+
+        make_executable(out_path)
+
+        print(f"built {out_path} (log: {result.log_path})")
+
+    await asyncio.gather(*(build(t[0], t[1:]) for t in targets))
+
+def parse_batch_args():
+    parser = argparse.ArgumentParser(
+        description="build several programs at once on workers sharing a job queue",
+    )
+
+    parser.add_argument(
+        "queue_path",
+        metavar="PATH",
+        help="SQLite job queue that vernac-worker processes take jobs from",
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        metavar="OUT SPEC",
+        dest="targets",
+        nargs="+",
+        action="append",
+        required=True,
+        help="build the specs after OUT into an executable at OUT; repeat for each program",
+    )
+    parser.add_argument(
+        "--log-root",
+        metavar="PATH",
+        default="logs",
+        help="write each build's logs here",
+    )
+    parser.add_argument(
+        "--priority",
+        metavar="N",
+        type=int,
+        default=0,
+        help="run these builds before queued jobs of lower priority",
+    )
+
+    args = parser.parse_args()
+
+    for target in args.targets:
+        if len(target) < 2:
+            parser.error(f"target {target[0]} names no specs")
+
+    return args
+
+def batch_script_main():
+    asyncio.run(batch_main(**vars(parse_batch_args())))
+
+if __name__ == "__main__":
+    script_main()
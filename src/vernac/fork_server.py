@@ -0,0 +1,271 @@
+import os
+import sys
+import ast
+import json
+import time
+import socket
+import subprocess
+
+from tempfile import TemporaryDirectory
+from contextlib import nullcontext
+
+from vernac.sandbox import (
+    RunLimits,
+    RunResult,
+    StackSampler,
+    drain_output,
+    kill_group,
+)
+
+SERVER_SOURCE = r"""
+import os
+import sys
+import json
+import socket
+import signal
+import resource
+import importlib
+import traceback
+import faulthandler
+
+config = json.loads(sys.argv[1])
+sys.path[:0] = config["python_path"]
+server = socket.socket(fileno=config["fd"])
+
+# pay for dependency imports once, before any fork
+for name in config["preload"]:
+    try:
+        importlib.import_module(name)
+    except BaseException:
+        pass
+
+def run_child(request, stdin_fd, output_fd):
+    os.setsid()
+    os.dup2(stdin_fd, 0)
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+    os.chdir(request["cwd"])
+    os.environ.update(request["env"])
+
+    for (name, value) in request["rlimits"].items():
+        resource.setrlimit(getattr(resource, name), (value, value))
+
+    if request["samples"] is not None:
+        samples = open(request["samples"]["path"], "w")
+
+        faulthandler.dump_traceback_later(request["samples"]["interval"], repeat=True, file=samples)
+        faulthandler.register(signal.SIGUSR1, file=samples, all_threads=True)
+
+    sys.argv = request["argv"]
+    code = 0
+
+    try:
+        from vnprog.main import main
+
+        main()
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            code = error.code or 0
+        else:
+            print(error.code, file=sys.stderr)
+
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+
+        code = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(code)
+
+while True:
+    (message, fds, _, _) = socket.recv_fds(server, 1024 * 1024, 2)
+
+    if message == b"":
+        break
+
+    (stdin_fd, output_fd) = fds
+    request = json.loads(message)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+
+    if pid == 0:
+        server.close()
+        run_child(request, stdin_fd, output_fd)
+
+    os.close(stdin_fd)
+    os.close(output_fd)
+    server.send(json.dumps(dict(pid=pid)).encode())
+
+    (_, status) = os.waitpid(pid, 0)
+
+    server.send(json.dumps(dict(returncode=os.waitstatus_to_exitcode(status))).encode())
+"""
+
+def get_preload_modules(sources: list[str]) -> list[str]:
+    """
+    Top-level modules imported by the program, other than its own.
+    """
+
+    names = set()
+
+    for source in sources:
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            continue
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(a.name.split(".")[0] for a in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names.add(node.module.split(".")[0])
+
+    return sorted(names - {"vnprog", "__future__"})
+
+class ForkServer:
+    """
+    A warm interpreter that has imported a program's dependencies and forks
+    once per run of `vnprog.main:main`, instead of starting the packaged
+    program from scratch.
+    """
+
+    def __init__(
+            self,
+            python_path: list[str],
+            preload: list[str] = [],
+            python: str | None = None,
+        ):
+        self.python_path = python_path
+        self.preload = preload
+        # the interpreter the program is packaged for, not necessarily ours
+        self.python = sys.executable if python is None else python
+
+    def __enter__(self) -> "ForkServer":
+        (self._socket, server_socket) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        config = dict(
+            python_path=self.python_path,
+            preload=self.preload,
+            fd=server_socket.fileno(),
+        )
+
+        self._process = subprocess.Popen(
+            [self.python, "-c", SERVER_SOURCE, json.dumps(config)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            pass_fds=[server_socket.fileno()],
+        )
+
+        server_socket.close()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._socket.close()
+
+        try:
+            self._process.wait(timeout=8.0)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def receive(self, timeout: float | None = None) -> dict:
+        self._socket.settimeout(timeout)
+
+        message = self._socket.recv(4096)
+
+        if message == b"":
+            raise RuntimeError("fork server exited unexpectedly")
+
+        return json.loads(message)
+
+    def run(
+            self,
+            args: list[str],
+            limits: RunLimits = RunLimits(),
+            env: dict[str, str] = {},
+            stdin_path: str | None = None,
+        ) -> RunResult:
+        """
+        Run the program with `args`, sandboxed like `run_sandboxed`.
+        """
+
+        if limits.sample_interval is None:
+            sampler_context = nullcontext()
+        else:
+            sampler_context = StackSampler(limits.sample_interval)
+
+        with (
+            open(os.devnull if stdin_path is None else stdin_path, "rb") as stdin,
+            TemporaryDirectory(prefix="vernac-run-") as scratch_dir,
+            sampler_context as sampler,
+        ):
+            if sampler is None:
+                samples = None
+            else:
+                samples = dict(path=sampler.samples_path, interval=sampler.interval)
+
+            (read_fd, write_fd) = os.pipe()
+            request = dict(
+                argv=["program"] + args,
+                cwd=scratch_dir,
+                env={"HOME": scratch_dir} | env,
+                rlimits=limits.get_rlimits(),
+                samples=samples,
+            )
+
+            try:
+                socket.send_fds(
+                    self._socket,
+                    [json.dumps(request).encode()],
+                    [stdin.fileno(), write_fd],
+                )
+            finally:
+                os.close(write_fd)
+
+            pid = self.receive()["pid"]
+            deadline = time.monotonic() + limits.timeout
+
+            try:
+                (capture, timed_out, output_exceeded) = drain_output(
+                    read_fd,
+                    limits,
+                    deadline,
+                )
+            finally:
+                os.close(read_fd)
+
+            if not (timed_out or output_exceeded):
+                try:
+                    exit_status = self.receive(max(0.0, deadline - time.monotonic()))
+                except TimeoutError:
+                    timed_out = True
+
+            if timed_out and sampler is not None:
+                sampler.dump(pid)
+
+            if timed_out or output_exceeded:
+                kill_group(pid)
+
+                exit_status = self.receive()
+
+            if timed_out and sampler is not None:
+                hot_frames = sampler.summarize()
+            else:
+                hot_frames = None
+
+        return RunResult(
+            returncode=exit_status["returncode"],
+            output=capture.getvalue(),
+            timed_out=timed_out,
+            output_exceeded=output_exceeded,
+            timeout=limits.timeout,
+            hot_frames=hot_frames,
+        )
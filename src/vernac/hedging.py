@@ -0,0 +1,268 @@
+import time
+import queue
+import threading
+import statistics
+
+from typing import (
+    Callable,
+    Iterator,
+)
+from collections import (
+    defaultdict,
+    deque,
+)
+from dataclasses import dataclass
+
+from vernac.llm import ChatBackend
+
+class StallError(Exception):
+    pass
+
+@dataclass
+class LatencyPolicy:
+    ttft_timeout: float | None = 60.0
+    stall_timeout: float | None = 30.0
+    retries: int = 2
+    hedge: bool = False
+    hedge_percentile: float = 0.9
+    hedge_min_samples: int = 8
+    max_concurrent_hedges: int = 2
+    max_hedge_ratio: float = 0.1
+
+DONE = object()
+
+class Attempt:
+    """
+    One streaming request, pumped into a shared queue by a daemon thread.
+    """
+
+    def __init__(
+            self,
+            backend: ChatBackend,
+            messages: list[dict[str, str]],
+            model: str,
+            events: queue.Queue,
+            on_finish: Callable[[], None] = lambda: None,
+        ):
+        self.started_at = time.monotonic()
+        self.last_event_at: float | None = None
+        self.cancelled = threading.Event()
+        self._on_finish = on_finish
+        self._finished = False
+        self._finish_lock = threading.Lock()
+        self._stream: Iterator[str] | None = None
+        self._thread = threading.Thread(
+            target=self._pump,
+            args=(backend, messages, model, events),
+            daemon=True,
+        )
+
+        self._thread.start()
+
+    def _pump(self, backend, messages, model, events: queue.Queue):
+        try:
+            self._stream = backend.stream_chat(messages, model)
+
+            for token in self._stream:
+                if self.cancelled.is_set():
+                    return
+
+                events.put((self, token))
+
+            events.put((self, DONE))
+        except Exception as error:
+            events.put((self, error))
+        finally:
+            self.close_stream()
+            self.finish()
+
+    def finish(self):
+        with self._finish_lock:
+            if self._finished:
+                return
+
+            self._finished = True
+
+        self._on_finish()
+
+    def close_stream(self):
+        close = getattr(self._stream, "close", None)
+
+        if close is None:
+            return
+
+        try:
+            close()
+        except ValueError:
+            # still blocked on its next token; the pump closes it when that arrives
+            pass
+
+    def cancel(self):
+        self.cancelled.set()
+
+        # a hung attempt gives up its hedge slot now, not when its stream ends
+        self.finish()
+        self.close_stream()
+
+class GuardedBackend(ChatBackend):
+    """
+    Add time-to-first-token and stall deadlines, retries, and optional
+    hedging to another backend.
+
+    A hedge duplicates a request whose first token is later than the learned
+    percentile of recent TTFTs; whichever stream produces output first wins.
+    """
+
+    def __init__(self, inner: ChatBackend, policy: LatencyPolicy = LatencyPolicy()):
+        self.inner = inner
+        self.policy = policy
+        self.ttfts: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=128))
+        self.requests = 0
+        self.hedges = 0
+        self._hedge_slots = threading.BoundedSemaphore(policy.max_concurrent_hedges)
+        self._lock = threading.Lock()
+
+    def stream_chat(self, messages, model) -> Iterator[str]:
+        return self.inner.stream_chat(messages, model)
+
+    def hedge_delay(self, model: str) -> float | None:
+        samples = list(self.ttfts[model])
+
+        if not self.policy.hedge or len(samples) < self.policy.hedge_min_samples:
+            return None
+
+        cut = round(self.policy.hedge_percentile * 100)
+
+        return statistics.quantiles(samples, n=100)[cut - 1]
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.policy.max_hedge_ratio * self.requests:
+                return False
+
+            if not self._hedge_slots.acquire(blocking=False):
+                return False
+
+            self.hedges += 1
+
+            return True
+
+    def complete_chat(
+            self,
+            messages: list[dict[str, str]],
+            model: str,
+            on_token: Callable[[int], None] = lambda p: None,
+            on_partial: Callable[[str], None] = lambda c: None,
+        ) -> str:
+        for _ in range(self.policy.retries + 1):
+            completion = self.complete_once(messages, model, on_token, on_partial)
+
+            if completion is not None:
+                return completion
+
+        raise StallError(f"{model} stalled on {self.policy.retries + 1} attempts")
+
+    def complete_once(
+            self,
+            messages: list[dict[str, str]],
+            model: str,
+            on_token: Callable[[int], None],
+            on_partial: Callable[[str], None] = lambda c: None,
+        ) -> str | None:
+        policy = self.policy
+        events: queue.Queue = queue.Queue()
+        attempts = [Attempt(self.inner, messages, model, events)]
+        started_at = attempts[0].started_at
+        hedge_delay = self.hedge_delay(model)
+        winner: Attempt | None = None
+        completion = ""
+        i = 0
+
+        with self._lock:
+            self.requests += 1
+
+        def deadline() -> float:
+            if winner is not None:
+                if policy.stall_timeout is None:
+                    return float("inf")
+
+                return winner.last_event_at + policy.stall_timeout
+
+            deadlines = [float("inf")]
+
+            if policy.ttft_timeout is not None:
+                deadlines.append(started_at + policy.ttft_timeout)
+
+            if hedge_delay is not None:
+                deadlines.append(started_at + hedge_delay)
+
+            return min(deadlines)
+
+        try:
+            while True:
+                timeout = deadline() - time.monotonic()
+
+                try:
+                    (attempt, event) = events.get(timeout=max(0.0, timeout))
+                except queue.Empty:
+                    ttft_deadline = started_at + (policy.ttft_timeout or float("inf"))
+
+                    if (
+                        winner is None
+                        and hedge_delay is not None
+                        and time.monotonic() < ttft_deadline
+                    ):
+                        if self.try_hedge():
+                            attempts.append(
+                                Attempt(
+                                    self.inner,
+                                    messages,
+                                    model,
+                                    events,
+                                    on_finish=self._hedge_slots.release,
+                                )
+                            )
+
+                        hedge_delay = None
+
+                        continue
+
+                    # stalled before the first token or mid-stream
+                    return None
+
+                if attempt.cancelled.is_set():
+                    continue
+
+                attempt.last_event_at = time.monotonic()
+
+                if isinstance(event, Exception):
+                    attempt.cancel()
+
+                    if attempt is winner or all(a.cancelled.is_set() for a in attempts):
+                        raise event
+                    else:
+                        continue
+
+                if winner is None:
+                    winner = attempt
+
+                    self.ttfts[model].append(attempt.last_event_at - attempt.started_at)
+
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                elif attempt is not winner:
+                    continue
+
+                if event is DONE:
+                    return completion
+
+                completion += event
+
+                on_token(i)
+                on_partial(completion)
+
+                i += 1
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
@@ -0,0 +1,239 @@
+import sys
+import argparse
+
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from typing import (
+    Callable,
+    Iterator,
+    TYPE_CHECKING,
+)
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+if TYPE_CHECKING:
+    from vernac.hedging import LatencyPolicy
+    from vernac.remote_cache import CacheClient
+
+# default model for each role a stage can ask for
+DEFAULT_MODELS = {
+    "classify": "gpt-3.5-turbo",
+    "generate": "gpt-4",
+    "escalate": "gpt-4-turbo",
+    "dependencies": "gpt-4",
+    "document": "gpt-4",
+    "extract_tests": "gpt-4",
+    "judge_tests": "gpt-4",
+    "contract": "gpt-4",
+    "extract_budgets": "gpt-4",
+    "optimize": "gpt-4",
+}
+
+DEFAULT_BACKEND = "openai"
+
+class ChatBackend(ABC):
+    @abstractmethod
+    def stream_chat(
+            self,
+            messages: list[dict[str, str]],
+            model: str,
+        ) -> Iterator[str]:
+        ...
+
+    def complete_chat(
+            self,
+            messages: list[dict[str, str]],
+            model: str,
+            on_token: Callable[[int], None] = lambda p: None,
+            on_partial: Callable[[str], None] = lambda c: None,
+        ) -> str:
+        completion = ""
+
+        for (i, token) in enumerate(self.stream_chat(messages, model)):
+            completion += token
+
+            on_token(i)
+            on_partial(completion)
+
+        return completion
+
+def parse_model_override(override: str) -> tuple[str, str]:
+    """
+    Split a `ROLE=MODEL` override, rejecting unknown roles and empty models.
+    """
+
+    (role, equals, model) = override.partition("=")
+
+    if equals == "" or model == "":
+        raise ValueError(f"expected ROLE=MODEL, not {override!r}")
+    elif role not in DEFAULT_MODELS:
+        raise ValueError(f"unknown role {role!r}; choose from {', '.join(DEFAULT_MODELS)}")
+
+    return (role, model)
+
+def model_override_arg(override: str) -> str:
+    try:
+        parse_model_override(override)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+    return override
+
+def build_backend(config: dict) -> ChatBackend:
+    from vernac.openai import OpenAIBackend
+
+    config = dict(config)
+    kind = config.pop("type", "openai")
+
+    match kind:
+        case "openai":
+            return OpenAIBackend(**config)
+
+        case _:
+            raise ValueError(f"unknown backend type: {kind}")
+
+class ModelRouter:
+    """
+    Map each stage role to a backend and a model name.
+
+    Models are written as `model` for the default backend or `backend:model`
+    for a named one, such as a local OpenAI-compatible server.
+    """
+
+    def __init__(
+            self,
+            backends: dict[str, ChatBackend] | None = None,
+            models: dict[str, str] = {},
+            cache: "CacheClient | None" = None,
+        ):
+        if backends is None:
+            backends = {DEFAULT_BACKEND: build_backend({})}
+
+        self.backends = backends
+        self.models = DEFAULT_MODELS | models
+        self.cache = cache
+        # completions held back from the cache, if this router is buffered
+        self.pending: dict[str, str] | None = None
+
+    @classmethod
+    def from_config(
+            cls,
+            path: str | None = None,
+            overrides: list[str] = [],
+            latency: "LatencyPolicy | None" = None,
+            cache: "CacheClient | None" = None,
+        ) -> "ModelRouter":
+        from vernac.hedging import GuardedBackend
+
+        if path is None:
+            config = {}
+        else:
+            with open(path, "rb") as config_file:
+                config = tomllib.load(config_file)
+
+        backend_configs = {DEFAULT_BACKEND: {}} | config.get("backends", {})
+        backends = {n: build_backend(c) for n, c in backend_configs.items()}
+
+        if latency is not None:
+            backends = {n: GuardedBackend(b, latency) for n, b in backends.items()}
+
+        models = dict(config.get("models", {}))
+
+        for override in overrides:
+            (role, model) = parse_model_override(override)
+            models[role] = model
+
+        return cls(backends=backends, models=models, cache=cache)
+
+    def buffered(self) -> "ModelRouter":
+        """
+        A router sharing this one's backends and cache that holds new
+        completions back until `publish`, so that a build only shares
+        completions once it has passed its checks.
+        """
+
+        router = ModelRouter(backends=self.backends, models=self.models, cache=self.cache)
+        router.pending = {}
+
+        return router
+
+    def hold(self, completions: dict[str, str]):
+        if self.cache is None:
+            return
+        elif self.pending is None:
+            for (key, completion) in completions.items():
+                self.cache.put("completions", key, completion.encode("utf-8"))
+        else:
+            self.pending.update(completions)
+
+    def publish(self):
+        if self.cache is None or not self.pending:
+            return
+
+        (pending, self.pending) = (self.pending, {})
+
+        for (key, completion) in pending.items():
+            self.cache.put("completions", key, completion.encode("utf-8"))
+
+    def route(self, role: str) -> tuple[ChatBackend, str]:
+        spec = self.models.get(role, self.models["generate"])
+        (prefix, _, model) = spec.partition(":")
+
+        if model != "" and prefix in self.backends:
+            return (self.backends[prefix], model)
+        else:
+            return (self.backends[DEFAULT_BACKEND], spec)
+
+    def complete_chat(
+            self,
+            role: str,
+            messages: list[dict[str, str]],
+            on_token: Callable[[int], None] = lambda p: None,
+            on_partial: Callable[[str], None] = lambda c: None,
+            cache: bool = True,
+        ) -> str:
+        """
+        Complete a chat with the model for `role`, through the shared cache
+        unless `cache` is False.
+        """
+
+        (backend, model) = self.route(role)
+
+        if self.cache is None or not cache:
+            return backend.complete_chat(
+                messages,
+                model=model,
+                on_token=on_token,
+                on_partial=on_partial,
+            )
+
+        from vernac.remote_cache import get_cache_key
+
+        key = get_cache_key(self.models.get(role, self.models["generate"]), messages)
+
+        if self.pending is not None and key in self.pending:
+            completion = self.pending[key]
+        else:
+            cached = self.cache.get("completions", key)
+            completion = None if cached is None else cached.decode("utf-8")
+
+        if completion is not None:
+            on_partial(completion)
+
+            return completion
+
+        completion = backend.complete_chat(
+            messages,
+            model=model,
+            on_token=on_token,
+            on_partial=on_partial,
+        )
+
+        self.hold({key: completion})
+
+        return completion
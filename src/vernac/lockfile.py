@@ -0,0 +1,264 @@
+import os
+import os.path
+import re
+import sys
+import html
+import json
+import hashlib
+import subprocess
+
+from subprocess import (
+    check_output,
+    CalledProcessError,
+)
+from tempfile import TemporaryDirectory
+from urllib.parse import unquote
+
+import requests
+import tomli_w
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+LOCKFILE_NAME = "vernac.lock"
+LOCK_VERSION = 1
+DEFAULT_INDEX_URL = "https://pypi.org/simple"
+# PEP 691 JSON where the index offers it, else the PEP 503 HTML page
+SIMPLE_ACCEPT = "application/vnd.pypi.simple.v1+json, text/html;q=0.1"
+
+def get_spec_hash(english: str) -> str:
+    return hashlib.sha256(english.encode("utf-8")).hexdigest()
+
+def get_default_lock_path(in_paths: list[str]) -> str:
+    return os.path.join(os.path.dirname(in_paths[0]), LOCKFILE_NAME)
+
+def run_pip(args: list[str]) -> bytes:
+    try:
+        return check_output(
+            [sys.executable, "-m", "pip", *args, "--disable-pip-version-check"],
+            stderr=subprocess.PIPE,
+        )
+    except CalledProcessError as error:
+        print(error.stderr.decode("utf-8", errors="replace"))
+
+        raise
+
+def get_pip_indexes() -> list[str]:
+    """
+    The index URLs pip is configured with, primary first.
+    """
+
+    options = {}
+
+    for line in run_pip(["config", "list"]).decode("utf-8").splitlines():
+        (key, _, value) = line.partition("=")
+        (variant, _, option) = key.rpartition(".")
+
+        # environment variables override config files
+        if option in ("index-url", "extra-index-url") and (variant == ":env:" or option not in options):
+            options[option] = value.strip("'\"").split()
+
+    return options.get("index-url", [DEFAULT_INDEX_URL]) + options.get("extra-index-url", [])
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def is_release_file(filename: str, name: str, version: str) -> bool:
+    match = re.match(rf"^(.+?)-{re.escape(version)}(-.*\.whl|\.tar\.gz|\.zip)$", filename)
+
+    return match is not None and normalize_name(match[1]) == normalize_name(name)
+
+def get_release_hashes(index_url: str, name: str, version: str) -> list[str]:
+    """
+    The sha256 of every distribution of a release on a simple index, so
+    that a lock made here installs on any platform and Python.
+    """
+
+    # local indexes and find-links directories hold only what pip chose
+    if not index_url.startswith(("http://", "https://")):
+        return []
+
+    response = requests.get(
+        f"{index_url.rstrip('/')}/{normalize_name(name)}/",
+        headers={"Accept": SIMPLE_ACCEPT},
+        timeout=30,
+    )
+
+    if response.status_code == 404:
+        return []
+
+    response.raise_for_status()
+
+    if response.headers.get("content-type", "").startswith("application/vnd.pypi.simple.v1+json"):
+        files = [(f["filename"], f["hashes"].get("sha256")) for f in response.json()["files"]]
+    else:
+        files = []
+
+        for href in re.findall(r'href="([^"]+)"', response.text):
+            (url, _, fragment) = html.unescape(href).partition("#")
+            (algorithm, _, digest) = fragment.partition("=")
+
+            files.append((unquote(url.rpartition("/")[2]), digest if algorithm == "sha256" else None))
+
+    return sorted({
+        digest
+        for (filename, digest) in files
+        if digest is not None and is_release_file(filename, name, version)
+    })
+
+def resolve_packages(requirements: list[str]) -> list[dict]:
+    """
+    Resolve requirements to exact versions and archive hashes, without
+    installing anything.
+    """
+
+    if len(requirements) == 0:
+        return []
+
+    report = json.loads(
+        run_pip(
+            [
+                "install",
+                "--dry-run",
+                "--ignore-installed",
+                "--quiet",
+                "--report", "-",
+                *requirements,
+            ]
+        )
+    )
+    indexes = get_pip_indexes()
+    packages = []
+
+    for item in report["install"]:
+        name = item["metadata"]["name"]
+        version = item["metadata"]["version"]
+        hashes = item["download_info"].get("archive_info", {}).get("hashes", {})
+
+        if "sha256" not in hashes:
+            raise ValueError(f"no sha256 for {name}; cannot lock it")
+
+        # the archive pip chose suits only this machine
+        release_hashes = set().union(*(get_release_hashes(i, name, version) for i in indexes))
+
+        packages.append(
+            dict(
+                name=name,
+                version=version,
+                hashes=sorted(release_hashes | {hashes["sha256"]}),
+            )
+        )
+
+    return sorted(packages, key=lambda p: p["name"].lower())
+
+def get_pinned_requirements(packages: list[dict]) -> str:
+    return "".join(
+        f"{p['name']}=={p['version']}"
+        + "".join(f" --hash=sha256:{h}" for h in p["hashes"])
+        + "\n"
+        for p in packages
+    )
+
+def install_locked_packages(packages: list[dict], site_dir: str, wheelhouse: str):
+    """
+    Install exactly the locked packages, without dependency resolution.
+
+    The wheelhouse is tried first, so a warm one makes this work offline.
+    """
+
+    with TemporaryDirectory(prefix="vernac-lock-") as tmpdir:
+        requirements_path = os.path.join(tmpdir, "requirements.txt")
+
+        with open(requirements_path, "w") as requirements_file:
+            requirements_file.write(get_pinned_requirements(packages))
+
+        install_args = [
+            "install",
+            "--no-deps",
+            "--require-hashes",
+            "--no-compile",
+            "--no-index",
+            "--find-links", wheelhouse,
+            "--target", site_dir,
+            "--requirement", requirements_path,
+        ]
+
+        os.makedirs(wheelhouse, exist_ok=True)
+
+        try:
+            run_pip(install_args)
+        except CalledProcessError:
+            run_pip(
+                [
+                    "download",
+                    "--no-deps",
+                    "--require-hashes",
+                    "--dest", wheelhouse,
+                    "--requirement", requirements_path,
+                ]
+            )
+            run_pip(install_args)
+
+class Lockfile:
+    """
+    The accepted output of a build: per-spec source and docs, keyed by spec
+    hash, and the exact dependency set.
+
+    `packages` is None when the dependencies could not be resolved, in which
+    case a locked build resolves them afresh.
+    """
+
+    def __init__(
+            self,
+            sources: dict[str, dict] = {},
+            requirements: list[str] = [],
+            packages: list[dict] | None = [],
+        ):
+        self.sources = dict(sources)
+        self.requirements = list(requirements)
+        self.packages = None if packages is None else list(packages)
+
+    @classmethod
+    def load(cls, path: str) -> "Lockfile | None":
+        try:
+            with open(path, "rb") as lock_file:
+                data = tomllib.load(lock_file)
+        except FileNotFoundError:
+            return None
+
+        if data.get("version") != LOCK_VERSION:
+            raise ValueError(f"unsupported lockfile version in {path}")
+
+        return cls(
+            sources=data.get("sources", {}),
+            requirements=data.get("requirements", []),
+            packages=data.get("packages"),
+        )
+
+    def save(self, path: str):
+        data = {
+            "version": LOCK_VERSION,
+            "requirements": self.requirements,
+            "packages": self.packages,
+            "sources": self.sources,
+        }
+
+        if self.packages is None:
+            del data["packages"]
+
+        with open(path, "wb") as lock_file:
+            tomli_w.dump(data, lock_file, multiline_strings=True)
+
+    def get_source(self, name: str, english: str) -> dict | None:
+        """
+        The locked source for `name`, if its spec has not changed.
+        """
+
+        source = self.sources.get(name)
+
+        if source is None or source["spec_sha256"] != get_spec_hash(english):
+            return None
+
+        return source
@@ -0,0 +1,227 @@
+import os
+import os.path
+import io
+import re
+import json
+import gzip
+import time
+import queue
+import uuid
+import shutil
+import base64
+import tarfile
+import threading
+
+from enum import Enum
+from typing import Iterator
+from datetime import datetime
+
+class LogFormat(Enum):
+    DIRECTORY = "dir"
+    TAR = "tar.gz"
+    JSONL = "jsonl.gz"
+
+class DirectoryWriter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rel_path: str, contents: bytes):
+        log_path = os.path.join(self.path, rel_path)
+
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+        with open(log_path, "wb") as log_file:
+            log_file.write(contents)
+
+    def close(self):
+        pass
+
+class TarWriter:
+    def __init__(self, path: str):
+        self.name = os.path.basename(path).removesuffix(".tar.gz")
+        self.archive = tarfile.open(path, "w:gz")
+
+    def write(self, rel_path: str, contents: bytes):
+        info = tarfile.TarInfo(os.path.join(self.name, rel_path))
+        info.size = len(contents)
+        info.mtime = int(time.time())
+
+        self.archive.addfile(info, io.BytesIO(contents))
+
+    def close(self):
+        self.archive.close()
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rel_path: str, contents: bytes):
+        try:
+            record = dict(path=rel_path, text=contents.decode("utf-8"))
+        except UnicodeDecodeError:
+            record = dict(path=rel_path, base64=base64.b64encode(contents).decode("ascii"))
+
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+def read_jsonl_logs(data: bytes) -> Iterator[tuple[str, bytes]]:
+    """
+    Read back the entries of a log written in the JSONL format.
+    """
+
+    for line in gzip.decompress(data).decode("utf-8").splitlines():
+        record = json.loads(line)
+
+        if "text" in record:
+            yield (record["path"], record["text"].encode("utf-8"))
+        else:
+            yield (record["path"], base64.b64decode(record["base64"]))
+
+# the names LogSink gives its logs; nothing else under a log root is pruned
+LOG_NAME_PATTERN = re.compile(r"^\d{14}-[0-9a-f]{8}(\.tar\.gz|\.jsonl\.gz)?$")
+
+def get_entry_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(dir_path, file_name))
+            for (dir_path, _, file_names) in os.walk(path)
+            for file_name in file_names
+        )
+    else:
+        return os.path.getsize(path)
+
+def prune_logs(
+        root: str,
+        keep: int | None = None,
+        max_bytes: int | None = None,
+        protect: str | None = None,
+    ):
+    """
+    Delete the oldest build logs under `root` beyond the retention policy.
+    """
+
+    if not os.path.isdir(root):
+        return
+
+    # timestamp names sort oldest first
+    entries = [
+        os.path.join(root, n)
+        for n in sorted(os.listdir(root))
+        if LOG_NAME_PATTERN.match(n)
+    ]
+    doomed = []
+
+    if keep is not None and len(entries) > keep:
+        doomed = entries[:len(entries) - keep]
+        entries = entries[len(entries) - keep:]
+
+    if max_bytes is not None:
+        sizes = {e: get_entry_size(e) for e in entries}
+        total = sum(sizes.values())
+
+        for entry in entries:
+            if total <= max_bytes:
+                break
+
+            doomed.append(entry)
+
+            total -= sizes[entry]
+
+    for entry in doomed:
+        if entry == protect:
+            continue
+        elif os.path.isdir(entry):
+            shutil.rmtree(entry)
+        else:
+            os.remove(entry)
+
+class LogSink:
+    """
+    Collect build log artifacts and write them from a background thread.
+    """
+
+    def __init__(
+            self,
+            root: str = "logs",
+            format: LogFormat = LogFormat.DIRECTORY,
+            keep: int | None = None,
+            max_bytes: int | None = None,
+        ):
+        # builds that start in the same second still get their own log
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        name = f"{timestamp}-{uuid.uuid4().hex[:8]}"
+
+        self.root = root
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self._queue: queue.Queue[tuple[str, bytes] | None] = queue.Queue()
+        self._error: Exception | None = None
+
+        os.makedirs(root, exist_ok=True)
+
+        match format:
+            case LogFormat.DIRECTORY:
+                self.path = os.path.join(root, name)
+                self._writer = DirectoryWriter(self.path)
+
+            case LogFormat.TAR:
+                self.path = os.path.join(root, f"{name}.tar.gz")
+                self._writer = TarWriter(self.path)
+
+            case LogFormat.JSONL:
+                self.path = os.path.join(root, f"{name}.jsonl.gz")
+                self._writer = JsonlWriter(self.path)
+
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while (item := self._queue.get()) is not None:
+            if self._error is not None:
+                continue
+
+            try:
+                self._writer.write(*item)
+            except Exception as error:
+                self._error = error
+
+        self._writer.close()
+
+    def write(self, rel_path: str, contents: bytes):
+        self._queue.put((rel_path, contents))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+        prune_logs(
+            self.root,
+            keep=self.keep,
+            max_bytes=self.max_bytes,
+            protect=self.path,
+        )
+
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "LogSink":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class NullLogSink(LogSink):
+    """
+    Discard build logs, for pipelines run without anywhere to keep them.
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def write(self, rel_path: str, contents: bytes):
+        pass
+
+    def close(self):
+        pass
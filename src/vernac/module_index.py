@@ -0,0 +1,139 @@
+import os
+import os.path
+import re
+import json
+import time
+import hashlib
+import threading
+
+from collections import Counter
+
+import numpy as np
+
+def get_cache_dir(cache_dir: str | None = None) -> str:
+    if cache_dir is not None:
+        return cache_dir
+    elif "VERNAC_CACHE_DIR" in os.environ:
+        return os.environ["VERNAC_CACHE_DIR"]
+    else:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+
+        return os.path.join(xdg_cache, "vernac")
+
+def normalize_spec(english: str) -> str:
+    lines = (" ".join(l.split()) for l in english.strip().splitlines())
+
+    return "\n".join(l for l in lines if l != "")
+
+def get_spec_key(english: str, py_name: str) -> str:
+    digest = hashlib.sha256(f"{py_name}\n{normalize_spec(english)}".encode("utf-8"))
+
+    return digest.hexdigest()
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9_]+", text.lower())
+
+class ModuleIndex:
+    """
+    Successful module builds, searchable by spec similarity.
+
+    Entries are appended to a JSON lines file. Specs are compared by cosine
+    similarity of their TF-IDF vectors.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # tolerate a torn final line from an interrupted write
+                        continue
+
+                    self.entries[entry["key"]] = entry
+
+        self._reindex()
+
+    def _reindex(self):
+        self._keys = list(self.entries)
+        documents = [Counter(tokenize(self.entries[k]["english"])) for k in self._keys]
+        document_frequency = Counter(t for d in documents for t in d)
+        self._vocabulary = {t: i for (i, t) in enumerate(document_frequency)}
+        self._idf = np.zeros(len(self._vocabulary))
+
+        for (term, i) in self._vocabulary.items():
+            self._idf[i] = np.log((1 + len(documents)) / (1 + document_frequency[term])) + 1
+
+        self._matrix = np.stack(
+            [self._vectorize(d) for d in documents]
+            or [np.zeros(len(self._vocabulary))]
+        )
+
+    def _vectorize(self, counts: Counter) -> np.ndarray:
+        vector = np.zeros(len(self._vocabulary))
+
+        for (term, count) in counts.items():
+            i = self._vocabulary.get(term)
+
+            if i is not None:
+                vector[i] = count
+
+        vector *= self._idf
+        norm = np.linalg.norm(vector)
+
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, english: str, py_name: str) -> dict | None:
+        return self.entries.get(get_spec_key(english, py_name))
+
+    def search(self, english: str, limit: int = 1) -> list[tuple[float, dict]]:
+        with self._lock:
+            if len(self._keys) == 0:
+                return []
+
+            query = self._vectorize(Counter(tokenize(english)))
+            similarities = self._matrix @ query
+            best = np.argsort(-similarities)[:limit]
+
+            return [
+                (float(similarities[i]), self.entries[self._keys[i]])
+                for i in best
+            ]
+
+    def add(
+            self,
+            english: str,
+            py_name: str,
+            python: str,
+            documentation: str,
+            dependencies: list[str],
+        ):
+        key = get_spec_key(english, py_name)
+
+        if key in self.entries:
+            return
+
+        entry = dict(
+            key=key,
+            py_name=py_name,
+            english=english,
+            python=python,
+            documentation=documentation,
+            dependencies=list(dependencies),
+            created=time.time(),
+        )
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        with self._lock:
+            with open(self.path, "a") as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+
+            self.entries[key] = entry
+
+            self._reindex()
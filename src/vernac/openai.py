@@ -4,38 +4,65 @@ from typing import (
     cast,
     Callable,
     Iterable,
+    Iterator,
 )
 
 import openai
 
 from openai import ChatCompletion
 
+from vernac.llm import ChatBackend
+
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+class OpenAIBackend(ChatBackend):
+    """
+    OpenAI, or any server that speaks its chat completions API.
+    """
+
+    def __init__(
+            self,
+            api_base: str | None = None,
+            api_key: str | None = None,
+        ):
+        self.api_base = api_base
+        self.api_key = api_key
+
+    def stream_chat(
+            self,
+            messages: list[dict[str, str]],
+            model: str,
+        ) -> Iterator[str]:
+        endpoint = {}
+
+        if self.api_base is not None:
+            endpoint["api_base"] = self.api_base
+
+        if self.api_key is not None:
+            endpoint["api_key"] = self.api_key
+
+        responses = cast(
+            Iterable[ChatCompletion],
+            ChatCompletion.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                temperature=0.0,
+                **endpoint,
+            ),
+        )
+
+        for partial in responses:
+            delta = partial.choices[0].delta
+
+            try:
+                yield str(delta.content)
+            except AttributeError as error:
+                yield ""
+
 def complete_chat(
         messages: list[dict[str, str]],
         model="gpt-3.5-turbo",
         on_token: Callable[[int], None] = lambda p: None,
     ) -> str:
-    responses = cast(
-        Iterable[ChatCompletion],
-        ChatCompletion.create(
-            model=model,
-            messages=messages,
-            stream=True,
-            temperature=0.0,
-        ),
-    )
-    completion = ""
-
-    for (i, partial) in enumerate(responses):
-        delta = partial.choices[0].delta
-
-        try:
-            completion += str(delta.content)
-        except AttributeError as error:
-            pass
-
-        on_token(i)
-
-    return completion
+    return OpenAIBackend().complete_chat(messages, model=model, on_token=on_token)
@@ -1,17 +1,34 @@
 import os
+import json
+import time
 
-from datetime import datetime
+from typing import Callable
+from contextlib import nullcontext
 
 from rich import print as rich_print
 from rich.markup import escape
+from rich.text import Text
 from rich.progress import (
     Progress,
+    ProgressColumn,
     SpinnerColumn,
     TextColumn,
     BarColumn,
     TaskProgressColumn,
+    Task,
 )
 
+from vernac.llm import ModelRouter
+from vernac.logs import (
+    LogSink,
+    NullLogSink,
+)
+from vernac.stats import StatsStore
+from vernac.lockfile import get_spec_hash
+from vernac.convergence import (
+    ConvergencePolicy,
+    ConvergenceTracker,
+)
 from vernac.util import (
     str_to_filename,
     call_with_supported_args,
@@ -22,11 +39,27 @@ from vernac.stages.interface import (
     StageAction,
 )
 
+class EstimateColumn(ProgressColumn):
+    """
+    Time left in a stage, going by how long it took in past builds.
+    """
+
+    def render(self, task: Task) -> Text:
+        expected = task.fields.get("expected_seconds")
+
+        if expected is None or task.finished or task.elapsed is None:
+            return Text("")
+
+        remaining = max(expected - task.elapsed, 0)
+
+        return Text(f"~{remaining:.0f}s left", style="progress.remaining")
+
 progress = Progress(
     SpinnerColumn(),
     TextColumn("[progress.description]{task.description}"),
     BarColumn(),
     TaskProgressColumn(),
+    EstimateColumn(),
 )
 
 def print(*args, **kwargs):
@@ -46,60 +79,202 @@ class VernacPipeline:
     def __init__(
             self, name: str,
             stages: list[VernacStage],
-            logs_base_path: str | None = None,
+            log_sink: LogSink | None = None,
+            models: ModelRouter | None = None,
             verbose: bool = False,
+            progress: Progress = progress,
+            on_event: Callable[[dict], None] = lambda e: None,
+            convergence: ConvergencePolicy | None = None,
+            stats: StatsStore | None = None,
+            spec: str | None = None,
         ):
         self.name = name
         self.stages = stages
         self.verbose = verbose
-
-        if logs_base_path is None:
-            timestamp_dir_name = datetime.now().strftime("%Y%m%d%H%M%S")
-
-            self.logs_base_path = os.path.join("logs", timestamp_dir_name)
-        else:
-            self.logs_base_path = logs_base_path
+        # without a sink, logs are dropped rather than left in the working directory
+        self.log_sink = NullLogSink() if log_sink is None else log_sink
+        self.models = ModelRouter() if models is None else models
+        self.progress = progress
+        self.on_event = on_event
+        self.convergence = convergence
+        self.stats = stats
+        self.spec = name if spec is None else spec
 
     async def run(self, state: dict | None = None) -> dict:
         state = {} if state is None else state
         stage_index = 0
         stage_number = 0
+        loops = 0
+        passed = False
+        started_at = time.monotonic()
+
+        progress = self.progress
+
+        if self.convergence is None:
+            tracker = None
+        else:
+            tracker = ConvergenceTracker(self.name, self.convergence)
+
+        # nested and concurrent pipelines share the outermost live display
+        if progress.live.is_started:
+            display = nullcontext()
+        else:
+            display = progress
+
+        with display:
+            try:
+                while stage_index < len(self.stages):
+                    stage = self.stages[stage_index]
+                    stage_dir_name = leaf_log_dir_name(stage_number, stage.title)
+                    log_dir = os.path.join(self.name, stage_dir_name)
+                    (expected_seconds, expected_tokens) = self.estimate_stage(stage)
+
+                    if stage.title is None:
+                        task = None
+                    else:
+                        task = progress.add_task(
+                            stage.title,
+                            total=stage.steps,
+                            expected_seconds=expected_seconds,
+                        )
+
+                    if stage.title is not None:
+                        self.on_event(
+                            dict(
+                                type="stage_started",
+                                pipeline=self.name,
+                                stage=stage.title,
+                            )
+                        )
+
+                    context = StageContext(
+                        pipeline=self,
+                        log_dir=log_dir,
+                        verbose=self.verbose,
+                        progress=progress,
+                        progress_task=task,
+                        expected_tokens=expected_tokens,
+                    )
+                    stage_started_at = time.monotonic()
+                    called = call_with_supported_args(
+                        stage.run,
+                        dict(context=context) | state,
+                    )
+                    output = await called
+
+                    if task is not None:
+                        progress.update(task, completed=stage.steps)
+
+                    if stage.title is not None:
+                        self.on_event(
+                            dict(
+                                type="stage_finished",
+                                pipeline=self.name,
+                                stage=stage.title,
+                                action=output.action.name.lower(),
+                            )
+                        )
+
+                    stage_number += 1
+                    state |= output.state
 
-        with progress:
-            while stage_index < len(self.stages):
-                stage = self.stages[stage_index]
-                stage_dir_name = leaf_log_dir_name(stage_number, stage.title)
-                log_dir = os.path.join(self.logs_base_path, self.name, stage_dir_name)
-
-                if stage.title is None:
-                    task = None
-                else:
-                    task = progress.add_task(stage.title, total=stage.steps)
-
-                context = StageContext(
-                    pipeline=self,
-                    log_dir=log_dir,
-                    verbose=self.verbose,
-                    progress=progress,
-                    progress_task=task,
-                )
-                called = call_with_supported_args(
-                    stage.run,
-                    dict(context=context) | state,
-                )
-                output = await called
-
-                if task is not None:
-                    progress.update(task, completed=stage.steps)
-
-                match output.action:
-                    case StageAction.LOOP:
-                        stage_index = 0
-
-                    case StageAction.NEXT:
-                        stage_index += 1
-
-                stage_number += 1
-                state |= output.state
+                    self.record_stage(
+                        stage,
+                        context,
+                        state,
+                        time.monotonic() - stage_started_at,
+                        output.action,
+                    )
+
+                    if tracker is not None:
+                        tracker.prompt_tokens += sum(context.prompt_tokens.values())
+
+                    match output.action:
+                        case StageAction.LOOP:
+                            loops += 1
+
+                            if tracker is not None:
+                                try:
+                                    state |= tracker.loop(state)
+                                finally:
+                                    self.log_convergence(tracker, state)
+
+                            stage_index = 0
+
+                        case StageAction.NEXT:
+                            stage_index += 1
+
+                        case StageAction.DONE:
+                            break
+
+                passed = True
+            finally:
+                self.record_pipeline(state, time.monotonic() - started_at, loops, passed)
 
         return state
+
+    def get_spec_key(self, state: dict) -> str | None:
+        english = state.get("english")
+
+        return None if english is None else get_spec_hash(english)
+
+    def estimate_stage(self, stage: VernacStage) -> tuple[float | None, int | None]:
+        if self.stats is None or stage.title is None:
+            return (None, None)
+
+        return self.stats.estimate_stage(self.spec, stage.title)
+
+    def record_stage(
+            self,
+            stage: VernacStage,
+            context: StageContext,
+            state: dict,
+            seconds: float,
+            action: StageAction,
+        ):
+        if self.stats is None or stage.title is None:
+            return
+
+        self.stats.record_stage(
+            spec=self.spec,
+            spec_key=self.get_spec_key(state),
+            pipeline=self.name,
+            stage=stage.title,
+            seconds=seconds,
+            prompt_tokens=sum(context.prompt_tokens.values()),
+            completion_tokens=context.completion_tokens,
+            action=action.name.lower(),
+        )
+
+    def record_pipeline(self, state: dict, seconds: float, loops: int, passed: bool):
+        if self.stats is None:
+            return
+
+        # compare against earlier builds before this one joins them
+        usual = self.stats.find_regression(self.spec, seconds) if passed else None
+
+        if usual is not None:
+            regression = dict(spec=self.spec, seconds=seconds, usual_seconds=usual, loops=loops)
+
+            self.progress.console.print(
+                f"[yellow]warning:[/yellow] {escape(self.name)} took {seconds:.0f}s, "
+                f"against a usual {usual:.0f}s, after {loops} repair loops"
+            )
+            self.log_sink.write(
+                os.path.join(self.name, "regression.json"),
+                json.dumps(regression, indent=2).encode("utf-8"),
+            )
+
+        self.stats.record_pipeline(
+            spec=self.spec,
+            spec_key=self.get_spec_key(state),
+            pipeline=self.name,
+            seconds=seconds,
+            loops=loops,
+            passed=passed,
+        )
+
+    def log_convergence(self, tracker: ConvergenceTracker, state: dict):
+        report = json.dumps(tracker.get_report(state), indent=2)
+
+        self.log_sink.write(os.path.join(self.name, "convergence.json"), report.encode("utf-8"))
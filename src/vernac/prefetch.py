@@ -0,0 +1,118 @@
+import os
+import re
+import sys
+import queue
+import threading
+import subprocess
+
+DEPENDENCIES_PATTERN = re.compile(
+    r"^[ \t]*#[ \t]*DEPENDENCIES:(?P<names>[^\n]*)\n",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# only look for the header near the top of the completion
+MAX_HEADER_OFFSET = 4096
+
+def parse_dependencies_header(partial: str) -> list[str] | None:
+    """
+    Read the `# DEPENDENCIES: ...` line from a possibly incomplete completion.
+
+    Returns None until the whole line has streamed in.
+    """
+
+    match = DEPENDENCIES_PATTERN.search(partial, 0, MAX_HEADER_OFFSET)
+
+    if match is None:
+        return None
+
+    names = re.split(r"[,\s]+", match.group("names").strip())
+
+    return [
+        n for n in names
+        if n != ""
+        and n.lower() not in ("none", "n/a")
+        and n not in sys.stdlib_module_names
+        and not n.startswith("vnprog")
+    ]
+
+class DependencyPrefetcher:
+    """
+    Build wheels for requirements on a background thread, so that packaging
+    finds them in a local wheelhouse instead of waiting on downloads.
+    """
+
+    def __init__(self, wheelhouse: str):
+        self.wheelhouse = wheelhouse
+        self.requested: set[str] = set()
+        self.failed: set[str] = set()
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._done: dict[str, threading.Event] = {}
+        self._thread = threading.Thread(target=self._work, daemon=True)
+
+        self._thread.start()
+
+    def prefetch(self, requirements: list[str]):
+        with self._lock:
+            new = [r for r in requirements if r not in self.requested]
+
+            self.requested.update(new)
+            self.failed.difference_update(new)
+
+            for requirement in new:
+                self._done[requirement] = threading.Event()
+
+        # one requirement at a time, so a bad name cannot sink the others
+        for requirement in new:
+            self._queue.put(requirement)
+
+    def _work(self):
+        while True:
+            requirement = self._queue.get()
+
+            try:
+                os.makedirs(self.wheelhouse, exist_ok=True)
+                subprocess.run(
+                    [
+                        sys.executable, "-m", "pip", "wheel",
+                        "--disable-pip-version-check",
+                        "--quiet",
+                        "--wheel-dir", self.wheelhouse,
+                        "--find-links", self.wheelhouse,
+                        requirement,
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True,
+                )
+            except (OSError, subprocess.CalledProcessError):
+                # forget the request, so that a later build can try again
+                with self._lock:
+                    self.requested.discard(requirement)
+                    self.failed.add(requirement)
+            finally:
+                self._done[requirement].set()
+
+    def wait(self, requirements: list[str] | None = None):
+        """
+        Wait until the given requirements, or all requested so far, are
+        fetched or have failed.
+
+        Builds sharing a prefetcher pass their own requirements, so as not to
+        wait on each other's downloads.
+        """
+
+        with self._lock:
+            events = [
+                (r, e) for (r, e) in self._done.items()
+                if requirements is None or r in requirements
+            ]
+
+        for (_, event) in events:
+            event.wait()
+
+        # a finished requirement needs no event; later waits return at once
+        with self._lock:
+            for (requirement, event) in events:
+                if self._done.get(requirement) is event:
+                    del self._done[requirement]
@@ -0,0 +1,238 @@
+import os
+import re
+import ast
+import glob
+import pstats
+import textwrap
+
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+
+# loaded by the interpreter at startup when its directory is on PYTHONPATH
+PROFILER_SOURCE = """\
+import os
+
+if "VERNAC_PROFILE_DIR" in os.environ:
+    import atexit
+    import cProfile
+
+    _profile_dir = os.environ.pop("VERNAC_PROFILE_DIR")
+    _profiler = cProfile.Profile()
+
+    def _dump_profile():
+        _profiler.disable()
+        _profiler.dump_stats(os.path.join(_profile_dir, f"{os.getpid()}.prof"))
+
+    atexit.register(_dump_profile)
+    _profiler.enable()
+"""
+
+GENERATED_PATTERN = re.compile(r"vnprog[/\\](?P<py_name>\w+\.py)$")
+
+class Profiler:
+    """
+    Have Python programs profile themselves with cProfile, collecting the
+    stats of every run made in this context.
+    """
+
+    def __enter__(self) -> "Profiler":
+        self._dir = TemporaryDirectory(prefix="vernac-profile-")
+        self.profile_dir = os.path.join(self._dir.name, "profiles")
+
+        os.makedirs(self.profile_dir)
+
+        with open(os.path.join(self._dir.name, "sitecustomize.py"), "w") as profiler_file:
+            profiler_file.write(PROFILER_SOURCE)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._dir.cleanup()
+
+    def get_env(self) -> dict[str, str]:
+        python_path = [self._dir.name] + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+
+        return {
+            "PYTHONPATH": os.pathsep.join(p for p in python_path if p != ""),
+            "VERNAC_PROFILE_DIR": self.profile_dir,
+        }
+
+    def load(self) -> pstats.Stats | None:
+        paths = sorted(glob.glob(os.path.join(self.profile_dir, "*.prof")))
+
+        if len(paths) == 0:
+            return None
+
+        return pstats.Stats(*paths)
+
+@dataclass
+class FunctionSpan:
+    qualname: str
+    # first line, including decorators, and last line
+    start: int
+    end: int
+
+def get_function_spans(python: str) -> list[FunctionSpan]:
+    """
+    List every function and method in a source, outermost first.
+    """
+
+    spans = []
+
+    def visit(node: ast.AST, prefix: str):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                start = min([child.lineno] + [d.lineno for d in child.decorator_list])
+
+                spans.append(FunctionSpan(f"{prefix}{child.name}", start, child.end_lineno))
+                visit(child, f"{prefix}{child.name}.<locals>.")
+            elif isinstance(child, ast.ClassDef):
+                visit(child, f"{prefix}{child.name}.")
+            else:
+                visit(child, prefix)
+
+    visit(ast.parse(python), "")
+
+    return spans
+
+def find_enclosing(spans: list[FunctionSpan], line: int) -> FunctionSpan | None:
+    enclosing = [s for s in spans if s.start <= line <= s.end]
+
+    # spans are outermost first, so the last one is innermost
+    return enclosing[-1] if len(enclosing) > 0 else None
+
+@dataclass
+class Hotspot:
+    py_name: str
+    qualname: str
+    start: int
+    end: int
+    calls: int
+    # time in the function itself, plus library code that it calls directly
+    seconds: float
+    share: float
+
+    def describe(self) -> str:
+        return (
+            f"{self.py_name}, lines {self.start}-{self.end}, in {self.qualname}: "
+            f"{self.seconds:.3f}s ({self.share:.0%} of run time) over {self.calls} calls"
+        )
+
+def find_hotspots(
+        stats: pstats.Stats,
+        sources: dict[str, str],
+        top: int = 3,
+    ) -> list[Hotspot]:
+    """
+    Rank the generated functions, of `sources` keyed by file name, by the
+    time a profile spent in them.
+    """
+
+    spans = {}
+
+    for (py_name, python) in sources.items():
+        try:
+            spans[py_name] = get_function_spans(python)
+        except SyntaxError:
+            spans[py_name] = []
+
+    def locate(function: tuple[str, int, str]) -> tuple[str, FunctionSpan] | None:
+        (path, line, _) = function
+        match = GENERATED_PATTERN.search(path)
+
+        if match is None or match["py_name"] not in spans:
+            return None
+
+        # comprehensions and lambdas count toward the function around them
+        span = find_enclosing(spans[match["py_name"]], line)
+
+        return None if span is None else (match["py_name"], span)
+
+    hotspots: dict[tuple[str, str], Hotspot] = {}
+
+    def charge(py_name: str, span: FunctionSpan, seconds: float, calls: int = 0):
+        key = (py_name, span.qualname)
+
+        if key not in hotspots:
+            hotspots[key] = Hotspot(py_name, span.qualname, span.start, span.end, 0, 0.0, 0.0)
+
+        hotspots[key].seconds += seconds
+        hotspots[key].calls += calls
+
+    total_seconds = 0.0
+
+    for (function, (_, calls, own_seconds, _, callers)) in stats.stats.items():
+        total_seconds += own_seconds
+        located = locate(function)
+
+        if located is not None:
+            (py_name, span) = located
+            # calls into a comprehension are not calls into the function
+            is_function = function[2] == span.qualname.split(".")[-1]
+
+            charge(py_name, span, own_seconds, calls if is_function else 0)
+        else:
+            # time in library code is charged to the generated code calling it
+            for (caller, (_, _, _, caller_seconds)) in callers.items():
+                located = locate(caller)
+
+                if located is not None:
+                    charge(*located, caller_seconds)
+
+    for hotspot in hotspots.values():
+        hotspot.share = hotspot.seconds / total_seconds if total_seconds > 0 else 0.0
+
+    return sorted(hotspots.values(), key=lambda h: -h.seconds)[:top]
+
+def get_span_source(python: str, span: FunctionSpan) -> str:
+    return "".join(python.splitlines(keepends=True)[span.start - 1:span.end])
+
+def splice_functions(python: str, rewritten: str, qualnames: list[str]) -> str:
+    """
+    Replace the named functions in `python` with their versions in
+    `rewritten`, along with any imports those need.
+    """
+
+    old_spans = {s.qualname: s for s in get_function_spans(python)}
+    new_spans = {s.qualname: s for s in get_function_spans(rewritten)}
+    lines = python.splitlines(keepends=True)
+    replaced = [n for n in qualnames if n in old_spans and n in new_spans]
+    # a nested function is rewritten along with the function around it
+    replaced = [
+        n for n in replaced
+        if not any(n.startswith(f"{o}.<locals>.") for o in replaced)
+    ]
+
+    # splice from the bottom up so earlier line numbers stay valid
+    for qualname in sorted(replaced, key=lambda n: -old_spans[n].start):
+        old = old_spans[qualname]
+        first_line = lines[old.start - 1]
+        indent = first_line[:len(first_line) - len(first_line.lstrip())]
+        new_source = textwrap.dedent(get_span_source(rewritten, new_spans[qualname]))
+
+        if not new_source.endswith("\n"):
+            new_source += "\n"
+
+        lines[old.start - 1:old.end] = [textwrap.indent(new_source, indent)]
+
+    spliced = "".join(lines)
+    existing = [
+        n for n in ast.parse(spliced).body
+        if isinstance(n, (ast.Import, ast.ImportFrom))
+    ]
+    imports = [
+        f"{ast.unparse(n)}\n"
+        for n in ast.parse(rewritten).body
+        if isinstance(n, (ast.Import, ast.ImportFrom))
+        and ast.unparse(n) not in {ast.unparse(e) for e in existing}
+    ]
+
+    if len(imports) == 0:
+        return spliced
+
+    # after the existing imports, or at the very top if there are none
+    insert_at = max((n.end_lineno for n in existing), default=0)
+    lines = spliced.splitlines(keepends=True)
+    lines[insert_at:insert_at] = imports
+
+    return "".join(lines)
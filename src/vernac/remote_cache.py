@@ -0,0 +1,92 @@
+import json
+import hashlib
+
+from enum import Enum
+
+import requests
+
+# bump to invalidate every entry written by older versions
+CACHE_VERSION = 1
+
+DIGEST_HEADER = "X-Content-SHA256"
+
+class CacheMode(Enum):
+    READ_ONLY = "ro"
+    READ_WRITE = "rw"
+
+def get_cache_key(*parts) -> str:
+    """
+    Hash JSON-serializable inputs into a content key.
+    """
+
+    canonical = json.dumps([CACHE_VERSION, *parts], sort_keys=True)
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def get_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class CacheClient:
+    """
+    Client for a shared cache server, keyed by namespace and content hash.
+
+    Every failure, including a corrupt entry, reads as a miss, so a broken
+    or unreachable server only costs the work it would have saved.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            mode: CacheMode = CacheMode.READ_WRITE,
+            timeout: float = 10.0,
+        ):
+        self.url = url.rstrip("/")
+        self.mode = mode
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._session = requests.Session()
+
+    def get_url(self, namespace: str, key: str) -> str:
+        return f"{self.url}/cache/{namespace}/{key}"
+
+    def get(self, namespace: str, key: str) -> bytes | None:
+        try:
+            response = self._session.get(self.get_url(namespace, key), timeout=self.timeout)
+        except requests.RequestException:
+            response = None
+
+        if (
+            response is None
+            or response.status_code != 200
+            or response.headers.get(DIGEST_HEADER) != get_digest(response.content)
+        ):
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+
+        return response.content
+
+    def put(self, namespace: str, key: str, data: bytes):
+        if self.mode != CacheMode.READ_WRITE:
+            return
+
+        try:
+            self._session.put(
+                self.get_url(namespace, key),
+                data=data,
+                headers={DIGEST_HEADER: get_digest(data)},
+                timeout=self.timeout,
+            )
+        except requests.RequestException:
+            pass
+
+    def get_json(self, namespace: str, key: str) -> dict | None:
+        data = self.get(namespace, key)
+
+        return None if data is None else json.loads(data)
+
+    def put_json(self, namespace: str, key: str, contents: dict):
+        self.put(namespace, key, json.dumps(contents).encode("utf-8"))
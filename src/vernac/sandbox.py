@@ -0,0 +1,362 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import itertools
+import selectors
+import subprocess
+
+from collections import Counter
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from contextlib import nullcontext
+
+# run ahead of the program, in the child, since forking a threaded process
+# and running Python code before exec can deadlock
+LIMITS_SOURCE = """\
+import os
+import sys
+import json
+import resource
+
+for (name, value) in json.loads(sys.argv[1]).items():
+    resource.setrlimit(getattr(resource, name), (value, value))
+
+try:
+    os.execvp(sys.argv[2], sys.argv[2:])
+except OSError as error:
+    print(f"cannot run {sys.argv[2]}: {error}", file=sys.stderr)
+    sys.exit(127)
+"""
+
+@dataclass
+class RunLimits:
+    timeout: float = 16.0
+    max_output_bytes: int = 64 * 1024
+    kill_output_bytes: int = 1024 * 1024
+    cpu_seconds: int | None = 60
+    memory_bytes: int | None = 2 * 1024 ** 3
+    file_size_bytes: int | None = 64 * 1024 ** 2
+    # dump the program's stacks this often, to see where a slow run was stuck
+    sample_interval: float | None = None
+
+    def get_rlimits(self) -> dict[str, int]:
+        rlimits = {
+            "RLIMIT_CPU": self.cpu_seconds,
+            "RLIMIT_AS": self.memory_bytes,
+            "RLIMIT_FSIZE": self.file_size_bytes,
+        }
+
+        return {k: v for (k, v) in rlimits.items() if v is not None}
+
+    def wrap(self, args: list[str]) -> list[str]:
+        """
+        Prefix a command so that it sets these limits on itself, then runs.
+        """
+
+        rlimits = self.get_rlimits()
+
+        if len(rlimits) == 0:
+            return args
+
+        # isolated and without site, so injected sitecustomize runs only in the program
+        return [sys.executable, "-I", "-S", "-c", LIMITS_SOURCE, json.dumps(rlimits), *args]
+
+@dataclass
+class RunResult:
+    returncode: int | None
+    output: bytes
+    timed_out: bool = False
+    output_exceeded: bool = False
+    timeout: float | None = None
+    hot_frames: str | None = None
+
+    @property
+    def failed(self) -> bool:
+        return self.timed_out or self.output_exceeded or self.returncode != 0
+
+    @property
+    def text(self) -> str:
+        return self.output.decode("utf-8", errors="replace")
+
+    def describe(self) -> str:
+        if self.timed_out:
+            status = f"<timed out after {self.timeout:g} seconds>"
+        elif self.output_exceeded:
+            status = "<killed after writing too much output>"
+        elif self.returncode != 0:
+            status = f"<exit code {self.returncode}>"
+        else:
+            return self.text
+
+        return f"{self.text}\n{status}"
+
+class OutputCapture:
+    """
+    Keep the first and last bytes of a stream, dropping the middle.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.head_size = max_bytes // 2
+        self.tail_size = max_bytes - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, chunk: bytes):
+        self.total += len(chunk)
+        room = self.head_size - len(self.head)
+
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+
+        self.tail += chunk
+
+        if len(self.tail) > 2 * self.tail_size:
+            del self.tail[:-self.tail_size]
+
+    def getvalue(self) -> bytes:
+        tail = self.tail[len(self.tail) - self.tail_size:] if self.tail_size > 0 else b""
+        omitted = self.total - len(self.head) - len(tail)
+
+        if omitted > 0:
+            return bytes(self.head + f"\n... [{omitted} bytes omitted] ...\n".encode() + tail)
+        else:
+            return bytes(self.head + tail)
+
+# loaded by the interpreter at startup when its directory is on PYTHONPATH
+SAMPLER_SOURCE = """\
+import os
+import signal
+import faulthandler
+
+if "VERNAC_STACK_SAMPLES" in os.environ:
+    _samples = open(os.environ.pop("VERNAC_STACK_SAMPLES"), "w")
+
+    faulthandler.dump_traceback_later(
+        float(os.environ.pop("VERNAC_SAMPLE_INTERVAL")),
+        repeat=True,
+        file=_samples,
+    )
+    faulthandler.register(signal.SIGUSR1, file=_samples, all_threads=True)
+"""
+
+SAMPLES_FILE_NAME = "stack_samples.txt"
+
+THREAD_PATTERN = re.compile(r"^(Current thread|Thread) 0x[0-9a-f]+ .*:$|^Stack \(most recent call first\):$")
+FRAME_PATTERN = re.compile(r'^  File "(?P<path>.*)", line (?P<line>\d+) in (?P<name>.*)$')
+
+def parse_stack_samples(text: str) -> list[list[tuple[str, int, str]]]:
+    """
+    Read faulthandler dumps into stacks of (path, line, name), innermost first.
+    """
+
+    stacks = []
+
+    for line in text.splitlines():
+        if THREAD_PATTERN.match(line):
+            stacks.append([])
+        elif (match := FRAME_PATTERN.match(line)) and len(stacks) > 0:
+            stacks[-1].append((match["path"], int(match["line"]), match["name"]))
+
+    return [s for s in stacks if len(s) > 0]
+
+def describe_frame(frame: tuple[str, int, str]) -> str:
+    (path, line, name) = frame
+    (_, vnprog, rel_path) = path.rpartition("vnprog/")
+
+    return f"{rel_path if vnprog else path}, line {line}, in {name}"
+
+def summarize_stack_samples(text: str, top: int = 5, max_depth: int = 12) -> str | None:
+    """
+    Summarize where sampled stacks spent their time, favoring generated code.
+    """
+
+    stacks = parse_stack_samples(text)
+
+    if len(stacks) == 0:
+        return None
+
+    # blame the innermost generated frame, since library internals are not ours to fix
+    def blame(stack: list[tuple[str, int, str]]) -> tuple[str, int, str]:
+        return next((f for f in stack if "vnprog/" in f[0]), stack[0])
+
+    counts = Counter(blame(s) for s in stacks)
+    lines = [f"{len(stacks)} stack samples. Hottest lines:"]
+
+    for (frame, count) in counts.most_common(top):
+        lines.append(f"  {count / len(stacks):4.0%}  {describe_frame(frame)}")
+
+    lines.append("Last stack, most recent call first:")
+
+    # collapse recursion into one line per run of identical frames
+    for (frame, run) in itertools.islice(itertools.groupby(stacks[-1]), max_depth):
+        repeats = len(list(run))
+
+        lines.append(f"  {describe_frame(frame)}" + (f" (x{repeats})" if repeats > 1 else ""))
+
+    return "\n".join(lines)
+
+class StackSampler:
+    """
+    Have a Python program dump its stacks periodically, and once more on
+    request before it is killed.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+    def __enter__(self) -> "StackSampler":
+        self._dir = TemporaryDirectory(prefix="vernac-samples-")
+        self.samples_path = os.path.join(self._dir.name, SAMPLES_FILE_NAME)
+
+        with open(os.path.join(self._dir.name, "sitecustomize.py"), "w") as sampler_file:
+            sampler_file.write(SAMPLER_SOURCE)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._dir.cleanup()
+
+    def get_env(self) -> dict[str, str]:
+        python_path = [self._dir.name] + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+
+        return {
+            "PYTHONPATH": os.pathsep.join(p for p in python_path if p != ""),
+            "VERNAC_STACK_SAMPLES": self.samples_path,
+            "VERNAC_SAMPLE_INTERVAL": str(self.interval),
+        }
+
+    def dump(self, pid: int):
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            return
+
+        # give the handler a moment to write
+        time.sleep(0.2)
+
+    def summarize(self) -> str | None:
+        try:
+            with open(self.samples_path, errors="replace") as samples_file:
+                return summarize_stack_samples(samples_file.read())
+        except FileNotFoundError:
+            return None
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def drain_output(
+        fd: int,
+        limits: RunLimits,
+        deadline: float,
+    ) -> tuple[OutputCapture, bool, bool]:
+    """
+    Read a program's output until EOF, the deadline, or the output limit.
+
+    Returns the capture and whether the program timed out or wrote too much.
+    """
+
+    capture = OutputCapture(limits.max_output_bytes)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+
+        while True:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                return (capture, True, False)
+
+            if not selector.select(remaining):
+                continue
+
+            chunk = os.read(fd, 64 * 1024)
+
+            if chunk == b"":
+                return (capture, False, False)
+
+            capture.write(chunk)
+
+            if capture.total > limits.kill_output_bytes:
+                return (capture, False, True)
+
+def run_sandboxed(
+        args: list[str],
+        limits: RunLimits = RunLimits(),
+        env: dict[str, str] = {},
+        stdin_path: str | None = None,
+    ) -> RunResult:
+    """
+    Run a program in a scratch directory, which is also its `HOME`.
+
+    Output is streamed into a bounded head/tail buffer, and the program is
+    killed if it runs too long or writes more than `kill_output_bytes`.
+    """
+
+    if stdin_path is None:
+        stdin_context = open(os.devnull, "rb")
+    else:
+        stdin_context = open(stdin_path, "rb")
+
+    if limits.sample_interval is None:
+        sampler_context = nullcontext()
+    else:
+        sampler_context = StackSampler(limits.sample_interval)
+
+    with (
+        stdin_context as stdin,
+        TemporaryDirectory(prefix="vernac-run-") as scratch_dir,
+        sampler_context as sampler,
+    ):
+        sampler_env = {} if sampler is None else sampler.get_env()
+        process = subprocess.Popen(
+            limits.wrap(args),
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=scratch_dir,
+            env=os.environ | {"HOME": scratch_dir} | sampler_env | env,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + limits.timeout
+
+        with process:
+            (capture, timed_out, output_exceeded) = drain_output(
+                process.stdout.fileno(),
+                limits,
+                deadline,
+            )
+
+            if not (timed_out or output_exceeded):
+                try:
+                    process.wait(timeout=max(0.0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+
+            if timed_out and sampler is not None:
+                sampler.dump(process.pid)
+
+            kill_group(process.pid)
+
+            returncode = process.wait()
+
+        if timed_out and sampler is not None:
+            hot_frames = sampler.summarize()
+        else:
+            hot_frames = None
+
+    return RunResult(
+        returncode=returncode,
+        output=capture.getvalue(),
+        timed_out=timed_out,
+        output_exceeded=output_exceeded,
+        timeout=limits.timeout,
+        hot_frames=hot_frames,
+    )
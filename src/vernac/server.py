@@ -0,0 +1,453 @@
+import json
+import uuid
+import asyncio
+import argparse
+import itertools
+
+from dataclasses import (
+    dataclass,
+    field,
+    fields,
+    replace,
+)
+
+from vernac.llm import (
+    ModelRouter,
+    model_override_arg,
+)
+from vernac.remote_cache import (
+    CacheClient,
+    CacheMode,
+)
+from vernac.api import (
+    BuildOptions,
+    BuildResult,
+    Compiler,
+)
+
+# options that name paths or programs on the server, or that affect other
+# builds, are not for clients to choose
+CLIENT_OPTIONS = {
+    f.name for f in fields(BuildOptions)
+} - {
+    "injects",
+    "package_dir",
+    "lockfile",
+    "log_root",
+    "env_root",
+    "python",
+    "log_keep",
+    "log_max_bytes",
+}
+
+@dataclass
+class BuildJob:
+    id: str
+    specs: dict[str, str]
+    options: BuildOptions
+    priority: int = 0
+    status: str = "queued"
+    error: str | None = None
+    result: BuildResult | None = None
+    events: list[dict] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def add_event(self, event: dict):
+        self.events.append(event)
+        self.changed.set()
+
+        self.changed = asyncio.Event()
+
+    def describe(self) -> dict:
+        description = dict(id=self.id, status=self.status, priority=self.priority)
+
+        if self.error is not None:
+            description["error"] = self.error
+
+        if self.result is not None:
+            description["sources"] = self.result.sources
+            description["dependencies"] = self.result.dependencies
+            description["artifact_bytes"] = len(self.result.artifact)
+
+        return description
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+
+        self.status = status
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+class BuildServer:
+    """
+    Queue build jobs by priority and run them on a fixed number of workers
+    that share one compiler, and so one set of models and caches.
+    """
+
+    def __init__(
+            self,
+            compiler: Compiler,
+            workers: int = 2,
+            max_finished: int = 256,
+            max_body_bytes: int = 16 * 2**20,
+            log_keep: int | None = None,
+            log_max_bytes: int | None = None,
+        ):
+        self.compiler = compiler
+        self.workers = workers
+        self.max_finished = max_finished
+        self.max_body_bytes = max_body_bytes
+        self.log_keep = log_keep
+        self.log_max_bytes = log_max_bytes
+        self.jobs: dict[str, BuildJob] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._worker_tasks: list[asyncio.Task] = []
+
+    def submit(
+            self,
+            specs: dict[str, str],
+            options: BuildOptions = BuildOptions(),
+            priority: int = 0,
+        ) -> BuildJob:
+        job = BuildJob(id=uuid.uuid4().hex, specs=specs, options=options, priority=priority)
+        self.jobs[job.id] = job
+
+        # higher priority first, then first come, first served
+        self._queue.put_nowait((-priority, next(self._order), job))
+        job.add_event(dict(type="job_queued", id=job.id))
+
+        return job
+
+    def forget_finished(self):
+        finished = [j for j in self.jobs.values() if j.finished]
+
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job.id]
+
+    async def work(self):
+        while True:
+            (_, _, job) = await self._queue.get()
+            job.status = "running"
+
+            job.add_event(dict(type="job_started", id=job.id))
+
+            try:
+                job.result = await self.compiler.compile(
+                    job.specs,
+                    replace(
+                        job.options,
+                        log_keep=self.log_keep,
+                        log_max_bytes=self.log_max_bytes,
+                    ),
+                    on_event=job.add_event,
+                )
+                job.status = "succeeded"
+            except Exception as error:
+                job.status = "failed"
+                job.error = f"{type(error).__name__}: {error}"
+
+            job.add_event(dict(type="job_finished", id=job.id, status=job.status))
+            self.forget_finished()
+
+    def start(self):
+        self._worker_tasks = [
+            asyncio.create_task(self.work())
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+
+    def get_job(self, job_id: str) -> BuildJob:
+        if job_id not in self.jobs:
+            raise HTTPError(404, f"no such build: {job_id}")
+
+        return self.jobs[job_id]
+
+    def parse_build_request(self, body: bytes) -> tuple[dict[str, str], BuildOptions, int]:
+        try:
+            request = json.loads(body)
+            specs = request["specs"]
+            options = request.get("options", {})
+            priority = int(request.get("priority", 0))
+        except (ValueError, KeyError, TypeError) as error:
+            raise HTTPError(400, f"invalid build request: {error}")
+
+        unknown = set(options) - CLIENT_OPTIONS
+
+        if len(unknown) > 0:
+            raise HTTPError(400, f"unsupported options: {', '.join(sorted(unknown))}")
+
+        return (specs, BuildOptions(**options), priority)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            (method, path, _, body) = await read_request(reader, max_body_bytes=self.max_body_bytes)
+
+            await self.route(method, path, body, writer)
+        except HTTPError as error:
+            await write_json(writer, error.status, dict(error=str(error)))
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(
+            self,
+            method: str,
+            path: str,
+            body: bytes,
+            writer: asyncio.StreamWriter,
+        ):
+        parts = path.strip("/").split("/")
+
+        match (method, parts):
+            case ("POST", ["builds"]):
+                job = self.submit(*self.parse_build_request(body))
+
+                await write_json(writer, 202, job.describe())
+
+            case ("GET", ["builds", job_id]):
+                await write_json(writer, 200, self.get_job(job_id).describe())
+
+            case ("GET", ["builds", job_id, "events"]):
+                await self.stream_events(self.get_job(job_id), writer)
+
+            case ("GET", ["builds", job_id, "artifact"]):
+                job = self.get_job(job_id)
+
+                if job.result is None:
+                    raise HTTPError(409, f"build {job_id} is {job.status}")
+
+                await write_response(
+                    writer,
+                    200,
+                    job.result.artifact,
+                    "application/octet-stream",
+                )
+
+            case (_, ["builds", *_]):
+                raise HTTPError(405, f"{method} not allowed on {path}")
+
+            case _:
+                raise HTTPError(404, f"not found: {path}")
+
+    async def stream_events(self, job: BuildJob, writer: asyncio.StreamWriter):
+        """
+        Write the job's events as NDJSON, following it until it finishes.
+        """
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/x-ndjson\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+
+        sent = 0
+
+        while True:
+            changed = job.changed
+
+            for event in job.events[sent:]:
+                writer.write(json.dumps(event).encode("utf-8") + b"\n")
+
+            sent = len(job.events)
+
+            await writer.drain()
+
+            if job.finished:
+                return
+
+            await changed.wait()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        self.start()
+
+        return await asyncio.start_server(self.handle, host, port)
+
+async def read_request(
+        reader: asyncio.StreamReader,
+        max_body_bytes: int | None = None,
+    ) -> tuple[str, str, dict[str, str], bytes]:
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    (method, path, _) = request_line.split(" ", 2)
+    headers = {}
+
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+
+        if line == "":
+            break
+
+        (name, _, value) = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body_bytes = int(headers.get("content-length", 0))
+
+    if max_body_bytes is not None and body_bytes > max_body_bytes:
+        raise HTTPError(413, f"request body over {max_body_bytes} bytes")
+
+    body = await reader.readexactly(body_bytes)
+
+    return (method, path, headers, body)
+
+async def write_response(
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: bytes,
+        content_type: str,
+        headers: dict[str, str] = {},
+    ):
+    extra_headers = "".join(f"{k}: {v}\r\n" for (k, v) in headers.items())
+
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"{extra_headers}"
+        "Connection: close\r\n\r\n".encode("latin-1")
+        + body
+    )
+
+    await writer.drain()
+
+async def write_json(writer: asyncio.StreamWriter, status: int, contents: dict):
+    await write_response(
+        writer,
+        status,
+        json.dumps(contents).encode("utf-8"),
+        "application/json",
+    )
+
+async def main(
+        host: str,
+        port: int,
+        workers: int,
+        cache_dir: str | None = None,
+        models_config: str | None = None,
+        model_overrides: list[str] = [],
+        cache_url: str | None = None,
+        cache_mode: str = CacheMode.READ_WRITE.value,
+        max_body_bytes: int = 16 * 2**20,
+        log_keep: int | None = None,
+        log_max_bytes: int | None = None,
+    ):
+    if cache_url is None:
+        remote_cache = None
+    else:
+        remote_cache = CacheClient(cache_url, mode=CacheMode(cache_mode))
+
+    models = ModelRouter.from_config(
+        models_config,
+        overrides=model_overrides,
+        cache=remote_cache,
+    )
+    compiler = Compiler(models=models, cache_dir=cache_dir, remote_cache=remote_cache)
+    build_server = BuildServer(
+        compiler,
+        workers=workers,
+        max_body_bytes=max_body_bytes,
+        log_keep=log_keep,
+        log_max_bytes=log_max_bytes,
+    )
+    server = await build_server.serve(host, port)
+
+    async with server:
+        await server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="port to listen on",
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="N",
+        type=int,
+        default=2,
+        help="number of builds to run at once",
+    )
+    parser.add_argument(
+        "--max-body-bytes",
+        metavar="N",
+        type=int,
+        default=16 * 2**20,
+        help="refuse build requests larger than this",
+    )
+    parser.add_argument(
+        "--log-keep",
+        metavar="N",
+        type=int,
+        help="keep only the logs of the last N builds",
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        metavar="N",
+        type=int,
+        help="delete the oldest build logs beyond this total size",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="PATH",
+        help="keep reusable build data here (default: ~/.cache/vernac)",
+    )
+    parser.add_argument(
+        "--cache-url",
+        metavar="URL",
+        help="share completions, modules and programs through this cache server",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=[m.value for m in CacheMode],
+        default=CacheMode.READ_WRITE.value,
+        help="only read from the shared cache (ro), or also fill it (rw)",
+    )
+    parser.add_argument(
+        "--models-config",
+        metavar="PATH",
+        help="TOML file defining backends and a model for each stage role",
+    )
+    parser.add_argument(
+        "--model",
+        metavar="ROLE=MODEL",
+        dest="model_overrides",
+        type=model_override_arg,
+        action="append",
+        default=[],
+        help="use MODEL (or BACKEND:MODEL) for ROLE",
+    )
+
+    return parser.parse_args()
+
+def script_main():
+    asyncio.run(main(**vars(parse_args())))
+
+if __name__ == "__main__":
+    script_main()
@@ -7,6 +7,14 @@ from .guess_dependencies import GuessDependenciesStage
 from .package import PackageStage
 from .check_help import CheckHelpStage
 from .check_tests import CheckTestsStage
+from .check_performance import CheckPerformanceStage
+from .optimize_hotspots import OptimizeHotspotsStage
 from .map_modules import MapModulesStage
 from .document_module import DocumentModuleStage
+from .derive_contract import DeriveContractStage
+from .check_contract import CheckContractStage
+from .await_modules import AwaitModulesStage
+from .reuse_module import ReuseModuleStage
+from .generate_module import GenerateModuleStage
+from .repair_modules import RepairModulesStage
 from .run_pipelines import RunPipelinesStage
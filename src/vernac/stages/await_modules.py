@@ -0,0 +1,29 @@
+import asyncio
+
+from vernac.stages.interface import (
+    VernacStage,
+    StageAction,
+    StageOutput,
+)
+
+class AwaitModulesStage(VernacStage):
+    """
+    Wait for module pipelines that run alongside the main pipeline.
+    """
+
+    def __init__(self, module_tasks: dict[str, asyncio.Task]):
+        self.module_tasks = module_tasks
+        self.awaited = False
+
+    async def run(self, modules: dict[str, dict]) -> StageOutput:
+        # later passes must not undo repairs to the finished modules
+        if self.awaited:
+            return StageAction.NEXT.out()
+
+        self.awaited = True
+        finished = dict(modules)
+
+        for (name, task) in self.module_tasks.items():
+            finished[name] = modules[name] | await task
+
+        return StageAction.NEXT.out(modules=finished)
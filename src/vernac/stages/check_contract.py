@@ -0,0 +1,153 @@
+import ast
+
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+from vernac.stages.generate_code import TestFailure
+
+FunctionNode = ast.FunctionDef | ast.AsyncFunctionDef
+
+def get_parameters(node: FunctionNode) -> tuple[list[str], int]:
+    args = node.args
+    positional = [a.arg for a in args.posonlyargs + args.args]
+    required = len(positional) - len(args.defaults)
+
+    return (positional, required)
+
+def compare_functions(qualname: str, expected: FunctionNode, actual: ast.AST) -> list[str]:
+    if not isinstance(actual, FunctionNode):
+        return [f"`{qualname}` should be a function"]
+
+    (expected_params, expected_required) = get_parameters(expected)
+    (actual_params, actual_required) = get_parameters(actual)
+
+    if actual_params[:len(expected_params)] != expected_params:
+        return [
+            f"`{qualname}` takes ({', '.join(actual_params)}) "
+            f"but the contract says ({', '.join(expected_params)})"
+        ]
+    elif actual_required > expected_required:
+        return [f"`{qualname}` requires more arguments than the contract allows"]
+
+    missing_keywords = (
+        {a.arg for a in expected.args.kwonlyargs}
+        - {a.arg for a in actual.args.kwonlyargs}
+    )
+
+    if missing_keywords and actual.args.kwarg is None:
+        return [f"`{qualname}` is missing keyword arguments: {', '.join(sorted(missing_keywords))}"]
+
+    return []
+
+def get_definitions(body: list[ast.stmt]) -> dict[str, ast.AST]:
+    definitions = {}
+
+    for node in body:
+        match node:
+            case ast.FunctionDef() | ast.AsyncFunctionDef() | ast.ClassDef():
+                definitions[node.name] = node
+
+            case ast.Assign():
+                for target in node.targets:
+                    for name in ast.walk(target):
+                        if isinstance(name, ast.Name):
+                            definitions[name.id] = node
+
+            case ast.AnnAssign(target=ast.Name(id=name)):
+                definitions[name] = node
+
+            case ast.Import() | ast.ImportFrom():
+                for alias in node.names:
+                    definitions[(alias.asname or alias.name).split(".")[0]] = node
+
+    return definitions
+
+def find_contract_mismatches(contract: str, python: str) -> list[str]:
+    """
+    List the ways in which module source fails to implement a contract stub.
+    """
+
+    try:
+        actual_tree = ast.parse(python)
+    except SyntaxError as error:
+        return [f"module does not parse: {error}"]
+
+    try:
+        contract_tree = ast.parse(contract)
+    except SyntaxError as error:
+        return [f"contract does not parse: {error}"]
+
+    expected_defs = get_definitions(contract_tree.body)
+    actual_defs = get_definitions(actual_tree.body)
+    mismatches = []
+
+    for (name, expected) in expected_defs.items():
+        if isinstance(expected, (ast.Import, ast.ImportFrom)) or name.startswith("_"):
+            continue
+
+        actual = actual_defs.get(name)
+
+        if actual is None:
+            mismatches.append(f"`{name}` is not defined")
+        elif isinstance(expected, FunctionNode):
+            mismatches += compare_functions(name, expected, actual)
+        elif isinstance(expected, ast.ClassDef):
+            if not isinstance(actual, ast.ClassDef):
+                mismatches.append(f"`{name}` should be a class")
+
+                continue
+
+            actual_members = get_definitions(actual.body)
+
+            for (member_name, member) in get_definitions(expected.body).items():
+                qualname = f"{name}.{member_name}"
+                actual_member = actual_members.get(member_name)
+
+                if actual_member is None:
+                    # dataclass fields and the like may be declared differently
+                    if isinstance(member, FunctionNode):
+                        mismatches.append(f"`{qualname}` is not defined")
+                elif isinstance(member, FunctionNode):
+                    mismatches += compare_functions(qualname, member, actual_member)
+
+    return mismatches
+
+class CheckContractStage(VernacStage):
+    steps = 1
+
+    def __init__(self, title: str):
+        self.title = title
+
+    def run(
+            self,
+            context: StageContext,
+            python: str,
+            contract: str | None,
+        ) -> StageOutput:
+        # a module whose contract could not be derived is held to its tests alone
+        if contract is None:
+            mismatches = []
+        else:
+            mismatches = find_contract_mismatches(contract, python)
+
+        context.log_json("mismatches.json", mismatches)
+
+        if len(mismatches) == 0:
+            return StageOutput(
+                action=StageAction.NEXT,
+                state=dict(test_failures=[]),
+            )
+
+        failure = TestFailure(
+            input="Checked the module against its interface contract.",
+            expected="Every name in the contract is implemented with a compatible signature.",
+            actual="\n".join(f"- {m}" for m in mismatches),
+        )
+
+        return StageOutput(
+            action=StageAction.LOOP,
+            state=dict(test_failures=[failure], first_draft=python),
+        )
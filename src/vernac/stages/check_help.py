@@ -1,11 +1,9 @@
 import os.path
-import subprocess
 
-from subprocess import (
-    check_output,
-    CalledProcessError,
+from vernac.sandbox import (
+    RunLimits,
+    run_sandboxed,
 )
-
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -27,22 +25,22 @@ class CheckHelpStage(VernacStage):
             out_path: str,
             **kwargs,
         ) -> StageOutput:
-        try:
-            output = check_output(
-                [
-                    os.path.abspath(out_path),
-                    "--help",
-                ],
-                stderr=subprocess.STDOUT,
-                timeout=8.0,
-            )
-        except CalledProcessError as error:
-            context.log_bytes("output.txt", error.output)
+        result = run_sandboxed(
+            [
+                os.path.abspath(out_path),
+                "--help",
+            ],
+            limits=RunLimits(timeout=8.0, sample_interval=0.25),
+        )
+
+        context.log_bytes("output.txt", result.output)
 
+        if result.failed:
             failure = TestFailure(
                 input="Ran program with `--help`.",
                 expected="Standard help text",
-                actual=error.output,
+                actual=result.describe(),
+                hot_frames=result.hot_frames,
             )
 
             return StageOutput(
@@ -50,10 +48,7 @@ class CheckHelpStage(VernacStage):
                 state=dict(test_failures=[failure], first_draft=python),
             )
         else:
-            context.log_bytes("output.txt", output)
-
             return StageOutput(
                 action=StageAction.NEXT,
                 state=dict(test_failures=[]),
             )
-
@@ -0,0 +1,232 @@
+import os
+import os.path
+import json
+import math
+import time
+import random
+import string
+
+from tempfile import TemporaryDirectory
+
+from vernac.sandbox import (
+    RunLimits,
+    run_sandboxed,
+)
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+from vernac.stages.generate_code import TestFailure
+
+SYSTEM_PROMPT = """
+You are an expert programmer working on contract. The user, your client, will provide a description of program functionality. You will list any performance requirements stated in the spec, such as "processes 100000 lines in under 1s". Ignore requirements that are not about speed.
+
+For each requirement, write a single line of JSON in the following format:
+
+{"args": "{input}", "input": "lines", "stdin": false, "size": 100000, "seconds": 1.0}
+
+- "args" are the command line arguments, without the program name. Write `{input}` where the path of an input file goes and `{size}` where a count goes.
+- "input" is the kind of generated input file: "lines" (random text lines), "numbers" (one integer per line), or "none".
+- "stdin" is true if the input file should be piped to standard input instead.
+- "size" is the input size named in the requirement, and "seconds" is the time allowed.
+
+If the spec states no performance requirements, write nothing.
+"""
+
+# fractions of the budgeted size at which to time the program
+SIZE_FRACTIONS = [1 / 16, 1 / 8, 1 / 4, 1 / 2, 1]
+
+def generate_input(kind: str, size: int, rng: random.Random) -> bytes:
+    match kind:
+        case "lines":
+            alphabet = string.ascii_letters + string.digits + " "
+            lines = (
+                "".join(rng.choices(alphabet, k=rng.randint(8, 64)))
+                for _ in range(size)
+            )
+
+        case "numbers":
+            lines = (str(rng.randint(-10 ** 9, 10 ** 9)) for _ in range(size))
+
+        case _:
+            return b""
+
+    return "".join(f"{line}\n" for line in lines).encode("utf-8")
+
+def fit_growth_exponent(
+        sizes: list[int],
+        seconds: list[float],
+        baseline: float = 0.0,
+    ) -> float | None:
+    """
+    Fit `seconds - baseline ~ size ** k` by least squares in log-log space.
+    """
+
+    points = [
+        (math.log(n), math.log(t - baseline))
+        for (n, t) in zip(sizes, seconds)
+        if n > 0 and t > baseline
+    ]
+
+    if len(points) < 2:
+        return None
+
+    mean_x = sum(x for (x, _) in points) / len(points)
+    mean_y = sum(y for (_, y) in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for (x, _) in points)
+
+    if variance == 0:
+        return None
+
+    covariance = sum((x - mean_x) * (y - mean_y) for (x, y) in points)
+
+    return covariance / variance
+
+def extract_budgets(context: StageContext, english: str) -> list[dict]:
+    chat_messages = [
+        {"role": "system", "content": SYSTEM_PROMPT.strip()},
+        {"role": "user", "content": f"# Program Spec\n\n{english}"},
+    ]
+
+    context.log_prompt("prompt.json", chat_messages)
+
+    def on_token(i: int):
+        context.update_progress(completed=context.get_token_progress(i, scale=20))
+
+    chat_completion = context.complete_chat(
+        "extract_budgets",
+        chat_messages,
+        on_token=on_token,
+    )
+
+    context.log_text("completion.txt", chat_completion)
+
+    budgets = [json.loads(v) for v in chat_completion.splitlines() if v.strip()]
+
+    context.log_json("budgets.json", budgets)
+
+    return budgets
+
+def time_program(
+        program_path: str,
+        budget: dict,
+        size: int,
+        input_dir: str,
+        timeout: float,
+    ) -> tuple[float, str | None]:
+    input_path = os.path.join(input_dir, f"input_{size}.txt")
+
+    with open(input_path, "wb") as input_file:
+        input_file.write(generate_input(budget.get("input", "none"), size, random.Random(size)))
+
+    args = [
+        a.replace("{input}", input_path).replace("{size}", str(size))
+        for a in budget["args"].split()
+    ]
+    start = time.perf_counter()
+    result = run_sandboxed(
+        [program_path] + args,
+        limits=RunLimits(timeout=timeout, sample_interval=timeout / 32),
+        stdin_path=input_path if budget.get("stdin") else None,
+    )
+    elapsed = time.perf_counter() - start
+
+    if result.hot_frames is not None:
+        return (elapsed, f"{result.describe()}\n\n{result.hot_frames}")
+    elif result.failed:
+        return (elapsed, result.describe())
+    else:
+        return (elapsed, None)
+
+def check_budget(
+        context: StageContext,
+        program_path: str,
+        budget: dict,
+    ) -> TestFailure | None:
+    budget_size = int(budget["size"])
+    budget_seconds = float(budget["seconds"])
+    sizes = sorted({max(1, round(budget_size * f)) for f in SIZE_FRACTIONS})
+    timeout = max(4 * budget_seconds, 8.0)
+    timings = []
+    problem = None
+
+    with TemporaryDirectory(prefix="vernac-perf-") as input_dir:
+        (baseline, _) = time_program(program_path, budget, 0, input_dir, timeout)
+
+        for size in sizes:
+            if problem is not None:
+                break
+
+            (elapsed, problem) = time_program(program_path, budget, size, input_dir, timeout)
+
+            timings.append((size, elapsed))
+
+    context.log_json(
+        f"timings_{budget_size}.json",
+        dict(budget=budget, baseline=baseline, timings=timings),
+    )
+
+    exponent = fit_growth_exponent(
+        [n for (n, _) in timings],
+        [t for (_, t) in timings],
+        baseline=baseline,
+    )
+    final_seconds = timings[-1][1] if len(timings) == len(sizes) else None
+
+    if problem is None and final_seconds is not None and final_seconds <= budget_seconds:
+        return None
+
+    report = "\n".join(f"- size {n}: {t:.3f}s" for (n, t) in timings)
+    report += f"\n- startup with empty input: {baseline:.3f}s"
+
+    if exponent is not None:
+        report += f"\n- running time grows roughly like n^{exponent:.2f}"
+
+    if problem is None:
+        actual = f"Too slow.\n\n{report}\n\nUse a faster algorithm or data structure."
+    else:
+        actual = f"The last run did not finish cleanly.\n\n{report}\n\n{problem}"
+
+    return TestFailure(
+        input=f"Ran program with `{budget['args']}` on generated inputs of increasing size.",
+        expected=f"Size {budget_size} finishes in under {budget_seconds:g}s.",
+        actual=actual,
+    )
+
+class CheckPerformanceStage(VernacStage):
+    steps = 100
+
+    def __init__(self, title: str):
+        self.title = title
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            python: str,
+            out_path: str,
+            **kwargs,
+        ) -> StageOutput:
+        program_path = os.path.abspath(out_path)
+        budgets = extract_budgets(context, english)
+        test_failures = []
+
+        for budget in budgets:
+            failure = check_budget(context, program_path, budget)
+
+            if failure is not None:
+                test_failures.append(failure)
+
+            context.advance_progress(80 / len(budgets))
+
+        context.log_json(
+            "failures.json",
+            [f.__dict__ for f in test_failures],
+        )
+
+        return StageOutput(
+            action=StageAction.NEXT if len(test_failures) == 0 else StageAction.LOOP,
+            state=dict(test_failures=test_failures, first_draft=python),
+        )
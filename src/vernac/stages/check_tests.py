@@ -1,14 +1,18 @@
 import os
-import subprocess
 import json
 
-from subprocess import (
-    check_output,
-    CalledProcessError,
-)
+from contextlib import nullcontext
 
-from vernac.util import normalize_progress
-from vernac.openai import complete_chat
+from vernac.util import strip_markdown_fence
+from vernac.sandbox import (
+    RunLimits,
+    RunResult,
+    run_sandboxed,
+)
+from vernac.fork_server import (
+    ForkServer,
+    get_preload_modules,
+)
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -36,15 +40,15 @@ Do not list the name of the program itself, only the arguments. If no tests are
         {"role": "user", "content": user_prompt.strip()},
     ]
 
-    context.log_json("prompt.json", chat_messages)
+    context.log_prompt("prompt.json", chat_messages)
 
     # run the prompt and extract tests
     def on_token(i: int):
-        context.update_progress(completed=normalize_progress(i))
+        context.update_progress(completed=context.get_token_progress(i))
 
-    chat_completion = complete_chat(
+    chat_completion = context.complete_chat(
+        "extract_tests",
         chat_messages,
-        model="gpt-4",
         on_token=on_token,
     )
 
@@ -82,15 +86,15 @@ If the test output is correct, write nothing.
         {"role": "user", "content": user_prompt.strip()},
     ]
 
-    context.log_json("eval_prompt.json", chat_messages)
+    context.log_prompt("eval_prompt.json", chat_messages)
 
     # run the prompt and extract tests
     def on_token(i: int):
-        context.update_progress(completed=normalize_progress(i))
+        context.update_progress(completed=context.get_token_progress(i))
 
-    chat_completion = complete_chat(
+    chat_completion = context.complete_chat(
+        "judge_tests",
         chat_messages,
-        model="gpt-4",
         on_token=on_token,
     )
 
@@ -101,49 +105,172 @@ If the test output is correct, write nothing.
     else:
         return chat_completion
 
-def check_suggested_test(
+BATCH_SYSTEM_PROMPT = """
+You are an expert programmer working on contract. The user, your client, will provide a description of program functionality along with output from several numbered tests. You will decide whether the output of each test is correct.
+
+Respond with only a JSON array holding one verdict per test, in this format:
+
+[{"test": 1, "correct": true, "problem": null}, {"test": 2, "correct": false, "problem": "prints 9 lines instead of 10"}]
+
+If a test's output is incorrect, "problem" is a one-line description of the problem.
+"""
+
+def parse_verdicts(completion: str, count: int) -> dict[int, str | None]:
+    """
+    Read a batched judgment, mapping each test with a valid verdict to its
+    problem, or to None if its output was correct.
+    """
+
+    try:
+        verdicts = json.loads(strip_markdown_fence(completion))
+    except json.JSONDecodeError:
+        return {}
+
+    if not isinstance(verdicts, list):
+        return {}
+
+    parsed = {}
+    seen = set()
+
+    for verdict in verdicts:
+        match verdict:
+            case {"test": int(test), "correct": True} if 1 <= test <= count:
+                problem = None
+            case {"test": int(test), "correct": False, "problem": str(problem)} if (
+                1 <= test <= count and problem.strip() != ""
+            ):
+                pass
+            case _:
+                continue
+
+        # a test judged twice was judged unreliably
+        if test in seen:
+            parsed.pop(test, None)
+        else:
+            parsed[test] = problem
+
+        seen.add(test)
+
+    return parsed
+
+def judge_test_outputs(
         context: StageContext,
         english: str,
+        runs: list[tuple[list[str], str, str]],
+    ) -> list[str | None]:
+    """
+    Judge every `(program_args, expectation, output)` run in one completion,
+    asking again one test at a time only where the verdict was unusable.
+    """
+
+    tests = "\n\n".join(
+        f"## Test {i}\n\n"
+        f'Expectation: "{expectation}"\n\n'
+        f"Output:\n\n```$ ./program {' '.join(program_args)}\n{output}```"
+        for (i, (program_args, expectation, output)) in enumerate(runs, start=1)
+    )
+    user_prompt = f"# Program Spec\n\n{english}\n\n# Tests\n\n{tests}"
+    chat_messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT.strip()},
+        {"role": "user", "content": user_prompt.strip()},
+    ]
+
+    context.log_prompt("judge_prompt.json", chat_messages)
+
+    def on_token(i: int):
+        context.update_progress(completed=context.get_token_progress(i))
+
+    chat_completion = context.complete_chat(
+        "judge_tests",
+        chat_messages,
+        on_token=on_token,
+    )
+
+    context.log_text("judge_completion.txt", chat_completion)
+
+    verdicts = parse_verdicts(chat_completion, len(runs))
+    problems = []
+
+    context.log_json("unjudged.json", [i for i in range(1, len(runs) + 1) if i not in verdicts])
+
+    for (i, (program_args, expectation, output)) in enumerate(runs, start=1):
+        if i in verdicts:
+            problems.append(verdicts[i])
+        else:
+            problems.append(
+                evaluate_test_output(
+                    context,
+                    english=english,
+                    program_args=program_args,
+                    output=output,
+                    expectation=expectation,
+                )
+            )
+
+    return problems
+
+def run_suggested_test(
+        context: StageContext,
         program_path: str,
         program_args: list[str],
-        expectation: str,
-    ) -> TestFailure | None:
-    try:
-        output = check_output(
-            [program_path] + program_args,
-            stderr=subprocess.STDOUT,
-            timeout=16.0,
-        )
-    except CalledProcessError as error:
-        context.log_bytes("output.txt", error.output)
-
-        description = error.output.decode("utf-8") + f"\n<exit code {error.returncode}>"
+        fork_server: ForkServer | None = None,
+    ) -> RunResult:
+    limits = RunLimits(timeout=16.0, sample_interval=0.5)
 
-        return TestFailure(
-            input=f"Ran program with `{' '.join(program_args)}`.",
-            expected=expectation,
-            actual=description,
-        )
+    if fork_server is None:
+        result = run_sandboxed([program_path] + program_args, limits=limits)
     else:
-        context.log_bytes("output.txt", output)
-
-        description = evaluate_test_output(
-            context,
-            english=english,
-            program_args=program_args,
-            output=output.decode("utf-8"),
-            expectation=expectation,
-        )
+        result = fork_server.run(program_args, limits=limits)
+
+    context.log_bytes("output.txt", result.output)
 
-        if description is None:
-            return None
+    return result
+
+def check_suggested_tests(
+        context: StageContext,
+        english: str,
+        program_path: str,
+        suggested_tests: list[dict],
+        fork_server: ForkServer | None = None,
+    ) -> list[TestFailure]:
+    failures = []
+    runs = []
+
+    for suggested_test in suggested_tests:
+        program_args = suggested_test["args"].split()
+        expectation = suggested_test["description"]
+        result = run_suggested_test(context, program_path, program_args, fork_server)
+
+        # a crash or a timeout needs no judge
+        if result.failed:
+            failures.append(
+                TestFailure(
+                    input=f"Ran program with `{' '.join(program_args)}`.",
+                    expected=expectation,
+                    actual=result.describe(),
+                    hot_frames=result.hot_frames,
+                )
+            )
         else:
-            return TestFailure(
-                input=f"Ran program with `{' '.join(program_args)}`.",
-                expected=expectation,
-                actual=description,
+            runs.append((program_args, expectation, result.text))
+
+    if len(runs) == 0:
+        return failures
+
+    problems = judge_test_outputs(context, english, runs)
+
+    for ((program_args, expectation, _), problem) in zip(runs, problems):
+        if problem is not None:
+            failures.append(
+                TestFailure(
+                    input=f"Ran program with `{' '.join(program_args)}`.",
+                    expected=expectation,
+                    actual=problem,
+                )
             )
 
+    return failures
+
 class CheckTestsStage(VernacStage):
     steps = 100
 
@@ -157,24 +284,35 @@ class CheckTestsStage(VernacStage):
             python: str,
             out_path: str,
             test_failures: list[TestFailure] = [],
+            modules: dict[str, dict] = {},
+            python_path: list[str] | None = None,
+            target_python: str | None = None,
             **kwargs,
         ) -> StageOutput:
         program_path = os.path.abspath(out_path)
         suggested_tests = extract_suggested_tests(context, english)
         test_failures = list(test_failures)
 
-        for suggested_test in suggested_tests:
-            failure = check_suggested_test(
+        # run tests from the package sources in a warm interpreter when we can
+        if python_path is None or len(suggested_tests) == 0:
+            fork_server_context = nullcontext()
+        else:
+            sources = [python] + [m["python"] for m in modules.values()]
+            fork_server_context = ForkServer(
+                python_path,
+                get_preload_modules(sources),
+                python=target_python,
+            )
+
+        with fork_server_context as fork_server:
+            test_failures += check_suggested_tests(
                 context,
                 english=english,
                 program_path=program_path,
-                program_args=suggested_test["args"].split(),
-                expectation=suggested_test["description"],
+                suggested_tests=suggested_tests,
+                fork_server=fork_server,
             )
 
-            if failure is not None:
-                test_failures.append(failure)
-
         context.log_json(
             "failures.json",
             [f.__dict__ for f in test_failures],
@@ -182,5 +320,9 @@ class CheckTestsStage(VernacStage):
 
         return StageOutput(
             action=StageAction.NEXT if len(test_failures) == 0 else StageAction.LOOP,
-            state=dict(test_failures=test_failures, first_draft=python),
+            state=dict(
+                test_failures=test_failures,
+                first_draft=python,
+                suggested_tests=suggested_tests,
+            ),
         )
@@ -0,0 +1,136 @@
+import ast
+
+from vernac.util import (
+    replace_ext,
+    strip_markdown_fence,
+)
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+
+SYSTEM_PROMPT = """
+You are an expert programmer working on contract. The user, your client, will provide the description of a module that has not been written yet. Respond with a binding interface contract for that module, written as a Python 3 stub.
+
+The stub should declare every public class, method, function and constant that other code needs, with type hints and one-line docstrings. Write `...` as the body of every function and method. Include the imports needed by the type hints.
+
+Respond only with the stub inside a Markdown code block. Do not add commentary.
+"""
+
+USER_PROMPT_TEMPLATE = """
+Filename: `{py_name}`
+
+{description}
+"""
+
+def format_contract_documentation(contract: str) -> str:
+    return (
+        "## Module interface\n\n"
+        "The module implements exactly this interface:\n\n"
+        f"```python\n{contract}```\n"
+    )
+
+def format_description_documentation(english: str) -> str:
+    return (
+        "## Module interface\n\n"
+        "No interface contract was agreed; the module implements this description:\n\n"
+        f"{english.strip()}\n"
+    )
+
+def get_contract_stub(python: str) -> str:
+    """
+    Derive a contract from code that already exists, keeping its imports,
+    classes, constants and signatures but not its function bodies.
+    """
+
+    tree = ast.parse(python)
+    declarations = (
+        ast.Import,
+        ast.ImportFrom,
+        ast.FunctionDef,
+        ast.AsyncFunctionDef,
+        ast.ClassDef,
+        ast.Assign,
+        ast.AnnAssign,
+    )
+
+    class StubBodies(ast.NodeTransformer):
+        def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
+            docstring = ast.get_docstring(node, clean=False)
+            node.body = [ast.Expr(ast.Constant(...))]
+
+            if docstring is not None:
+                node.body.insert(0, ast.Expr(ast.Constant(docstring)))
+
+            return node
+
+        visit_AsyncFunctionDef = visit_FunctionDef
+
+    tree.body = [n for n in tree.body if isinstance(n, declarations)]
+
+    return ast.unparse(StubBodies().visit(tree)) + "\n"
+
+class DeriveContractStage(VernacStage):
+    steps = 100
+
+    def __init__(self, title: str):
+        self.title = title
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            vn_name: str,
+        ) -> StageOutput:
+        py_name = replace_ext(vn_name, "py").replace("-", "_")
+
+        user_prompt = USER_PROMPT_TEMPLATE.format(
+            py_name=py_name,
+            description=english,
+        )
+
+        chat_messages = [
+            {"role": "system", "content": SYSTEM_PROMPT.strip()},
+            {"role": "user", "content": user_prompt.strip()},
+        ]
+
+        context.log_prompt("prompt.json", chat_messages)
+
+        def on_token(i: int):
+            context.update_progress(completed=context.get_token_progress(i))
+
+        # a cached completion would repeat the same broken stub, so retry uncached
+        for attempt in range(2):
+            log_dir = "" if attempt == 0 else f"retry_{attempt}/"
+            chat_completion = context.complete_chat(
+                "contract",
+                chat_messages,
+                on_token=on_token,
+                cache=attempt == 0,
+            )
+
+            context.log_text(f"{log_dir}completion.txt", chat_completion)
+
+            contract = strip_markdown_fence(chat_completion)
+
+            context.log_text(f"{log_dir}contract.py", contract)
+
+            try:
+                ast.parse(contract)
+            except SyntaxError:
+                continue
+
+            return StageAction.NEXT.out(
+                py_name=py_name,
+                contract=contract,
+                documentation=format_contract_documentation(contract),
+            )
+
+        # build this module without a contract rather than against a broken one
+        return StageAction.NEXT.out(
+            py_name=py_name,
+            contract=None,
+            documentation=format_description_documentation(english),
+        )
@@ -1,8 +1,4 @@
-from vernac.openai import complete_chat
-from vernac.util import (
-    normalize_progress,
-    replace_ext,
-)
+from vernac.util import replace_ext
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -32,6 +28,9 @@ Filename: `{py_name}`
 {source}
 """
 
+def get_py_name(vn_name: str) -> str:
+    return replace_ext(vn_name, "py").replace("-", "_")
+
 class DocumentModuleStage(VernacStage):
     steps = 100
 
@@ -45,7 +44,7 @@ class DocumentModuleStage(VernacStage):
             python: str,
             vn_name: str,
         ) -> StageOutput:
-        py_name = replace_ext(vn_name, "py").replace("-", "_")
+        py_name = get_py_name(vn_name)
 
         user_prompt = USER_PROMPT_TEMPLATE.format(
             py_name=py_name,
@@ -58,15 +57,15 @@ class DocumentModuleStage(VernacStage):
             {"role": "user", "content": user_prompt},
         ]
 
-        context.log_json("prompt.json", chat_messages)
+        context.log_prompt("prompt.json", chat_messages)
 
         # run the prompt and make some code
         def on_token(i: int):
-            context.update_progress(completed=normalize_progress(i))
+            context.update_progress(completed=context.get_token_progress(i))
 
-        chat_completion = complete_chat(
+        chat_completion = context.complete_chat(
+            "document",
             chat_messages,
-            model="gpt-4",
             on_token=on_token,
         )
 
@@ -1,10 +1,22 @@
+import re
+
+from typing import Callable
 from dataclasses import dataclass
 
-from vernac.openai import complete_chat
-from vernac.util import (
-    normalize_progress,
-    strip_markdown_fence,
+from vernac.tokens import count_tokens
+from vernac.convergence import get_code_hash
+from vernac.prefetch import (
+    DependencyPrefetcher,
+    parse_dependencies_header,
+)
+from vernac.compaction import (
+    ELIDED_MARKER,
+    truncate_middle,
+    imported_vnprog_modules,
+    elide_draft,
+    restore_elided,
 )
+from vernac.util import strip_markdown_fence
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -18,6 +30,7 @@ class TestFailure:
     input: str
     expected: str
     actual: str
+    hot_frames: str | None = None
 
 def get_main_prompts(english: str) -> tuple[str, str]:
     system_prompt = (
@@ -37,6 +50,14 @@ def get_main_prompts(english: str) -> tuple[str, str]:
 
     return (system_prompt, user_prompt)
 
+def get_contract_section(contract: str) -> str:
+    return (
+        "\n\n# Interface contract\n\n"
+        "Other code is being written against this interface at the same time. "
+        "Implement exactly these names and signatures.\n\n"
+        f"```python\n{contract}```\n"
+    )
+
 def get_module_prompts(english: str) -> tuple[str, str]:
     system_prompt = (
         "You are an expert programmer working on contract. "
@@ -50,6 +71,79 @@ def get_module_prompts(english: str) -> tuple[str, str]:
 
     return (system_prompt, user_prompt)
 
+# cap on each failure's output even when the prompt fits the budget
+MAX_FAILURE_TOKENS = 1024
+
+def get_module_section(module: dict) -> str:
+    return (
+        f"\n\n# Module: `{module['py_name']}`\n\n"
+        "This module has already been written. It can be imported from the `vnprog` package.\n\n"
+        f"{module['documentation']}\n\n"
+    )
+
+def get_draft_section(first_draft: str, elided: bool) -> str:
+    section = (
+        "# First draft\n\n"
+        f"```\n{first_draft}```\n"
+    )
+
+    if elided:
+        section += (
+            "\nSome function bodies in the first draft are replaced by "
+            f"`{ELIDED_MARKER} <name>` lines. "
+            "Copy those lines verbatim unless that function must change.\n"
+        )
+
+    return section
+
+def get_spec_diff_section(spec_diff: str) -> str:
+    if spec_diff == "":
+        change = "The spec has not changed since the first draft was accepted."
+    else:
+        change = (
+            "The first draft was accepted for a previous version of the spec, "
+            "which has since changed as follows:\n\n"
+            f"```diff\n{spec_diff}```"
+        )
+
+    return (
+        "\n\n# Spec changes\n\n"
+        f"{change}\n\n"
+        "Edit the first draft only as needed to implement the current spec. "
+        "Keep all other code exactly as it is.\n"
+    )
+
+def get_candidate_section(rejected: list[str]) -> str:
+    section = (
+        "\n\n# Previous attempts\n\n"
+        "Earlier attempts produced the code below, which was already tried and failed. "
+        "Take a different approach.\n"
+    )
+
+    for (i, python) in enumerate(rejected):
+        section += (
+            f"\n## Attempt {i + 1}\n\n"
+            f"```python\n{truncate_middle(python, MAX_FAILURE_TOKENS)}\n```\n"
+        )
+
+    return section
+
+def get_failure_section(i: int, failure: TestFailure, max_tokens: int) -> str:
+    section = (
+        f"\n# First draft test {i + 1}\n\n"
+        f"Input: {failure.input}\n\n"
+        f"Expected Output: {failure.expected}\n\n"
+        f"Actual Output: {truncate_middle(str(failure.actual), max_tokens)}\n"
+    )
+
+    if failure.hot_frames is not None:
+        section += (
+            "\nWhere the program was spending its time when it was stopped:\n\n"
+            f"```\n{truncate_middle(failure.hot_frames, max_tokens)}\n```\n"
+        )
+
+    return section
+
 class GenerateCodeStage(VernacStage):
     steps = 100
 
@@ -59,87 +153,278 @@ class GenerateCodeStage(VernacStage):
             source_type: SourceType,
             inject_first: str | None = None,
             verbose: bool = False,
+            max_prompt_tokens: int | None = None,
+            prefetcher: DependencyPrefetcher | None = None,
         ):
         self.title = title
         self.source_type = source_type
         self.inject_first = inject_first
         self.verbose = verbose
+        self.max_prompt_tokens = max_prompt_tokens
+        self.prefetcher = prefetcher
 
-    def run(
+    def compact_prompt(
             self,
-            context: StageContext,
-            english: str,
-            modules: dict[str, dict] = {},
-            first_draft: str | None = None,
-            test_failures: list[TestFailure] = [],
-        ) -> StageOutput:
-        # skip codegen if we're injecting
-        if self.inject_first is not None:
-            output = StageOutput(
-                action=StageAction.NEXT,
-                state=dict(python=self.inject_first),
-            )
+            base_prompt: str,
+            system_prompt: str,
+            modules: dict[str, dict],
+            first_draft: str | None,
+            test_failures: list[TestFailure],
+            spec_diff: str | None = None,
+        ) -> tuple[str, dict[str, str], list[str]]:
+        """
+        Assemble the user prompt, compacting it until it fits the budget.
 
-            self.inject_first = None
+        Returns the prompt, any elided draft bodies, and the compactions used.
+        """
 
-            return output
+        included = dict(modules)
+        draft = first_draft
+        elided_bodies: dict[str, str] = {}
+        failure_tokens = MAX_FAILURE_TOKENS
+        applied: list[str] = []
 
-        # prepare prompt
+        def assemble() -> str:
+            user_prompt = base_prompt
+
+            for module in included.values():
+                user_prompt += get_module_section(module)
+
+            if draft is not None:
+                user_prompt += get_draft_section(draft, len(elided_bodies) > 0)
+
+            for (i, failure) in enumerate(test_failures):
+                user_prompt += get_failure_section(i, failure, failure_tokens)
+
+            return user_prompt
+
+        def over_budget(user_prompt: str) -> bool:
+            if self.max_prompt_tokens is None:
+                return False
+
+            tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+
+            return tokens > self.max_prompt_tokens
+
+        user_prompt = assemble()
+
+        # include only the modules that the draft actually imports
+        if over_budget(user_prompt) and first_draft is not None:
+            imported = imported_vnprog_modules(first_draft)
+
+            if imported is not None:
+                included = {
+                    n: m for n, m in modules.items()
+                    if m["py_name"].removesuffix(".py") in imported
+                }
+                user_prompt = assemble()
+
+                applied.append("unimported_modules")
+
+        # shorten failure output
+        if over_budget(user_prompt) and len(test_failures) > 0:
+            failure_tokens = MAX_FAILURE_TOKENS // 4
+            user_prompt = assemble()
+
+            applied.append("failure_output")
+
+        # elide draft functions that the failures do not mention
+        if over_budget(user_prompt) and first_draft is not None:
+            failure_text = "\n".join(str(f.actual) for f in test_failures)
+            keep = set(re.findall(r"\w+", failure_text + (spec_diff or ""))) | {"main"}
+            (draft, elided_bodies) = elide_draft(first_draft, keep=keep)
+            user_prompt = assemble()
+
+            applied.append("draft_regions")
+
+        return (user_prompt, elided_bodies, applied)
+
+    def get_prompts(self, english: str) -> tuple[str, str]:
         match self.source_type:
             case SourceType.MAIN:
-                (system_prompt, user_prompt) = get_main_prompts(english)
+                return get_main_prompts(english)
 
             case SourceType.MODULE:
-                (system_prompt, user_prompt) = get_module_prompts(english)
+                return get_module_prompts(english)
 
-        for (name, module) in modules.items():
-            user_prompt += (
-                f"\n\n# Module: `{module['py_name']}`\n\n"
-                "This module has already been written. It can be imported from the `vnprog` package.\n\n"
-                f"{module['documentation']}\n\n"
-            )
+    def complete_code(
+            self,
+            context: StageContext,
+            english: str,
+            modules: dict[str, dict],
+            first_draft: str | None,
+            test_failures: list[TestFailure],
+            contract: str | None,
+            spec_diff: str | None,
+            escalated: bool = False,
+            rejected: list[str] = [],
+        ) -> tuple[str, dict[str, str]]:
+        """
+        Prompt for code, streaming progress and prefetching dependencies.
 
-        if first_draft is not None:
-            user_prompt += (
-                "# First draft\n\n"
-                f"```\n{first_draft}```\n"
-            )
+        Returns the completion and any draft bodies elided from the prompt.
+        """
 
-        for (i, failure) in enumerate(test_failures):
-            user_prompt += (
-                f"\n# First draft test {i + 1}\n\n"
-                f"Input: {failure.input}\n\n"
-                f"Expected Output: {failure.expected}\n\n"
-                f"Actual Output: {str(failure.actual)}\n"
-            )
+        # each candidate logs its own prompt, so all count toward the budget
+        log_dir = "" if len(rejected) == 0 else f"candidate_{len(rejected) + 1}/"
+
+        # prepare prompt
+        (system_prompt, base_prompt) = self.get_prompts(english)
+
+        if contract is not None:
+            base_prompt += get_contract_section(contract)
+
+        if spec_diff is not None and first_draft is not None:
+            base_prompt += get_spec_diff_section(spec_diff)
+
+        if len(rejected) > 0:
+            base_prompt += get_candidate_section(rejected)
+
+        (user_prompt, elided_bodies, compactions) = self.compact_prompt(
+            base_prompt=base_prompt,
+            system_prompt=system_prompt,
+            modules=modules,
+            first_draft=first_draft,
+            test_failures=test_failures,
+            spec_diff=spec_diff,
+        )
 
         chat_messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
 
-        context.log_json("prompt.json", chat_messages)
+        context.log_prompt(f"{log_dir}prompt.json", chat_messages)
+
+        if len(compactions) > 0:
+            context.log_json(f"{log_dir}compactions.json", compactions)
 
         # run the prompt and make some code
         def on_token(i: int):
-            context.update_progress(completed=normalize_progress(i))
+            context.update_progress(completed=context.get_token_progress(i))
+
+        prefetched = None
+
+        # start fetching dependencies while the rest of the code streams in
+        def on_partial(partial: str):
+            nonlocal prefetched
+
+            if self.prefetcher is None or prefetched is not None:
+                return
+
+            prefetched = parse_dependencies_header(partial)
+
+            if prefetched is not None:
+                self.prefetcher.prefetch(prefetched)
 
-        chat_completion = complete_chat(
+        chat_completion = context.complete_chat(
+            "escalate" if escalated else "generate",
             chat_messages,
-            model="gpt-4",
             on_token=on_token,
+            on_partial=on_partial,
+            # a cached completion would repeat the code just rejected
+            cache=len(rejected) == 0,
         )
 
-        context.log_text("completion.txt", chat_completion)
+        if prefetched is not None:
+            context.log_json(f"{log_dir}prefetched.json", prefetched)
+
+        context.log_text(f"{log_dir}completion.txt", chat_completion)
+
+        return (chat_completion, elided_bodies)
+
+    def complete_untried(
+            self,
+            context: StageContext,
+            get_code: Callable[[str, dict[str, str]], str],
+            candidates: int = 1,
+            tried_hashes: list[str] = [],
+            **prompt_args,
+        ) -> tuple[str, dict[str, str]]:
+        """
+        Complete code up to `candidates` times, until its code, as extracted
+        by `get_code`, is not one the repair loop already tried.
+        """
+
+        rejected = []
+
+        for candidate in range(candidates):
+            (chat_completion, elided_bodies) = self.complete_code(
+                context,
+                rejected=rejected,
+                **prompt_args,
+            )
+            python = get_code(chat_completion, elided_bodies)
+
+            if get_code_hash(python) not in tried_hashes:
+                break
+
+            rejected.append(python)
+
+        if candidates > 1:
+            context.log_json("candidates.json", dict(generated=candidate + 1))
+
+        return (chat_completion, elided_bodies)
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            modules: dict[str, dict] = {},
+            first_draft: str | None = None,
+            test_failures: list[TestFailure] = [],
+            contract: str | None = None,
+            spec_diff: str | None = None,
+            escalated: bool = False,
+            candidates: int = 1,
+            tried_hashes: list[str] = [],
+            keep_first_draft: bool = False,
+        ) -> StageOutput:
+        # keep the draft when only its modules needed repair
+        if keep_first_draft and first_draft is not None:
+            return StageAction.NEXT.out(
+                python=first_draft,
+                spec_diff=None,
+                keep_first_draft=False,
+            )
+
+        # skip codegen if we're injecting
+        if self.inject_first is not None:
+            output = StageOutput(
+                action=StageAction.NEXT,
+                state=dict(python=self.inject_first),
+            )
+
+            self.inject_first = None
 
-        python = strip_markdown_fence(chat_completion)
+            return output
+
+        def get_code(chat_completion: str, elided_bodies: dict[str, str]) -> str:
+            return restore_elided(strip_markdown_fence(chat_completion), elided_bodies)
+
+        # when the repair loop stalls, skip candidates that were already tried
+        (chat_completion, elided_bodies) = self.complete_untried(
+            context,
+            get_code,
+            candidates=candidates,
+            tried_hashes=tried_hashes,
+            english=english,
+            modules=modules,
+            first_draft=first_draft,
+            test_failures=test_failures,
+            contract=contract,
+            spec_diff=spec_diff,
+            escalated=escalated,
+        )
+        python = get_code(chat_completion, elided_bodies)
 
         if self.verbose:
             print(python)
 
         context.log_text("code.py", python)
 
+        # the spec diff only describes the accepted draft, not later ones
         return StageOutput(
             action=StageAction.NEXT,
-            state=dict(python=python),
+            state=dict(python=python, spec_diff=None),
         )
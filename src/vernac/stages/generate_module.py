@@ -0,0 +1,282 @@
+import re
+import ast
+
+from vernac.compaction import restore_elided
+from vernac.util import strip_markdown_fence
+from vernac.stages.interface import (
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+from vernac.stages.map_modules import SourceType
+from vernac.stages.generate_code import (
+    GenerateCodeStage,
+    TestFailure,
+)
+from vernac.stages.guess_dependencies import clean_dependencies
+from vernac.stages.document_module import get_py_name
+from vernac.prefetch import DependencyPrefetcher
+
+SECTION_NAMES = ["code", "dependencies", "documentation"]
+SECTION_PATTERN = re.compile(r"^=== (CODE|DEPENDENCIES|DOCUMENTATION) ===[ \t]*$", re.MULTILINE)
+REQUIREMENT_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._\-\[\], <>=!~]*")
+
+SECTIONS_FORMAT = """\
+Respond with {count}, each starting with its header line exactly as shown:
+
+{headers}
+"""
+
+SECTION_FORMATS = dict(
+    code=(
+        "=== CODE ===\n"
+        "<the module source code inside a Markdown code block. "
+        "start it with one comment listing any dependencies to be `pip install`ed: "
+        "`# DEPENDENCIES: ...`>"
+    ),
+    dependencies=(
+        "=== DEPENDENCIES ===\n"
+        "<Python packages that must be installed to run the module, one per line. "
+        "ignore the standard library. write nothing if none are required.>"
+    ),
+    documentation=(
+        "=== DOCUMENTATION ===\n"
+        "## Module interface\n\n"
+        "<specific method signatures, classes, and other details necessary to use the module. "
+        "be concise.>\n\n"
+        "## Module notes\n\n"
+        "<key concepts for using the module effectively. "
+        "copy any important text from the description.>"
+    ),
+)
+
+def get_sections_format(names: list[str]) -> str:
+    return SECTIONS_FORMAT.format(
+        count="these three sections" if len(names) == 3 else "only these sections",
+        headers="\n\n".join(SECTION_FORMATS[n] for n in names),
+    )
+
+def get_combined_module_prompts(english: str) -> tuple[str, str]:
+    system_prompt = (
+        "You are an expert programmer working on contract. "
+        "The user, your client, will provide a description of one specific module. "
+        "Implement that module in Python 3, list its dependencies, and document its interface.\n\n"
+        f"{get_sections_format(SECTION_NAMES)}\n"
+        "Do not add commentary."
+    )
+
+    return (system_prompt, english)
+
+def parse_sections(completion: str) -> dict[str, str]:
+    """
+    Split a completion into its delimited sections, keyed by lowercase name.
+    """
+
+    parts = SECTION_PATTERN.split(completion)
+    sections = {}
+
+    # parts alternate between header names and their bodies
+    for (name, body) in zip(parts[1::2], parts[2::2]):
+        sections[name.lower()] = body.strip()
+
+    if "code" in sections:
+        sections["code"] = strip_markdown_fence(sections["code"])
+
+    return sections
+
+def validate_sections(sections: dict[str, str]) -> dict[str, str]:
+    """
+    Check each expected section, returning a problem for each invalid one.
+    """
+
+    problems = {}
+
+    if "code" not in sections:
+        problems["code"] = "missing"
+    else:
+        try:
+            ast.parse(sections["code"])
+        except SyntaxError as error:
+            problems["code"] = f"does not parse: {error}"
+
+    if "dependencies" not in sections:
+        problems["dependencies"] = "missing"
+    else:
+        for line in sections["dependencies"].splitlines():
+            if line.strip() != "" and not REQUIREMENT_PATTERN.fullmatch(line.strip()):
+                problems["dependencies"] = f"not a requirement: {line.strip()!r}"
+
+                break
+
+    if "documentation" not in sections:
+        problems["documentation"] = "missing"
+    elif "## Module interface" not in sections["documentation"]:
+        problems["documentation"] = "no interface section"
+
+    return problems
+
+class GenerateModuleStage(GenerateCodeStage):
+    """
+    Generate a module's code, dependencies and documentation in one
+    completion, rather than in three sequential ones.
+    """
+
+    def __init__(
+            self,
+            title: str,
+            inject_first: str | None = None,
+            verbose: bool = False,
+            max_prompt_tokens: int | None = None,
+            prefetcher: DependencyPrefetcher | None = None,
+            max_retries: int = 2,
+        ):
+        super().__init__(
+            title,
+            source_type=SourceType.MODULE,
+            inject_first=inject_first,
+            verbose=verbose,
+            max_prompt_tokens=max_prompt_tokens,
+            prefetcher=prefetcher,
+        )
+
+        self.max_retries = max_retries
+
+    def get_prompts(self, english: str) -> tuple[str, str]:
+        return get_combined_module_prompts(english)
+
+    def complete_sections(
+            self,
+            context: StageContext,
+            english: str,
+            sections: dict[str, str],
+            names: list[str],
+            attempt: int,
+        ) -> dict[str, str]:
+        """
+        Ask again for only the named sections, given the code if it is valid.
+        """
+
+        system_prompt = (
+            "You are an expert programmer working on contract. "
+            "The user, your client, will provide a description of one specific module"
+            f"{'' if 'code' in names else ' and its source code'}.\n\n"
+            f"{get_sections_format(names)}\n"
+            "Do not add commentary."
+        )
+        user_prompt = english
+
+        if "code" not in names:
+            user_prompt += f"\n\n# Module source\n\n```python\n{sections['code']}\n```\n"
+
+        chat_messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+        context.log_prompt(f"retry_{attempt}_prompt.json", chat_messages)
+
+        def on_token(i: int):
+            context.update_progress(completed=context.get_token_progress(i))
+
+        chat_completion = context.complete_chat(
+            "generate",
+            chat_messages,
+            on_token=on_token,
+        )
+
+        context.log_text(f"retry_{attempt}_completion.txt", chat_completion)
+
+        retried = parse_sections(chat_completion)
+
+        return {n: s for (n, s) in retried.items() if n in names}
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            vn_name: str,
+            modules: dict[str, dict] = {},
+            first_draft: str | None = None,
+            test_failures: list[TestFailure] = [],
+            contract: str | None = None,
+            spec_diff: str | None = None,
+            escalated: bool = False,
+            candidates: int = 1,
+            tried_hashes: list[str] = [],
+        ) -> StageOutput:
+        def get_sections(chat_completion: str, elided_bodies: dict[str, str]) -> dict[str, str]:
+            sections = parse_sections(chat_completion)
+
+            # a bare code block still counts as the code section
+            if len(sections) == 0:
+                sections = dict(code=strip_markdown_fence(chat_completion))
+
+            if "code" in sections:
+                sections["code"] = restore_elided(sections["code"], elided_bodies)
+
+            return sections
+
+        if self.inject_first is not None:
+            # injected code is kept as is; only its other sections are asked for
+            sections = dict(code=self.inject_first)
+            retryable = ["dependencies", "documentation"]
+
+            self.inject_first = None
+        else:
+            # when the repair loop stalls, skip candidates that were already tried
+            (chat_completion, elided_bodies) = self.complete_untried(
+                context,
+                lambda c, e: get_sections(c, e).get("code", ""),
+                candidates=candidates,
+                tried_hashes=tried_hashes,
+                english=english,
+                modules=modules,
+                first_draft=first_draft,
+                test_failures=test_failures,
+                contract=contract,
+                spec_diff=spec_diff,
+                escalated=escalated,
+            )
+
+            sections = get_sections(chat_completion, elided_bodies)
+            retryable = SECTION_NAMES
+
+        problems = validate_sections(sections)
+        attempt = 0
+
+        while attempt < self.max_retries:
+            names = [n for n in retryable if n in problems]
+
+            if len(names) == 0:
+                break
+
+            context.log_json(f"retry_{attempt}_problems.json", problems)
+
+            sections |= self.complete_sections(context, english, sections, names, attempt)
+            problems = validate_sections(sections)
+            attempt += 1
+
+        context.log_json("problems.json", problems)
+
+        # leave anything still invalid to the checks that follow
+        python = sections.get("code", "")
+
+        if self.verbose:
+            print(python)
+
+        context.log_text("code.py", python)
+
+        dependencies = clean_dependencies(
+            l for l in sections.get("dependencies", "").splitlines()
+            if l.strip().lower() not in ("none", "n/a")
+        )
+
+        context.log_json("dependencies.json", dependencies)
+
+        return StageAction.NEXT.out(
+            python=python,
+            dependencies=dependencies,
+            py_name=get_py_name(vn_name),
+            documentation=sections.get("documentation", ""),
+            spec_diff=None,
+        )
@@ -1,7 +1,7 @@
 import sys
 
-from vernac.openai import complete_chat
-from vernac.util import normalize_progress
+from typing import Iterable
+
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -9,11 +9,17 @@ from vernac.stages.interface import (
     StageOutput,
 )
 
+def clean_dependencies(lines: Iterable[str]) -> list[str]:
+    dependencies = set(l.strip() for l in lines if l.strip() != "") - sys.stdlib_module_names
+
+    return [d for d in dependencies if not d.startswith("vnprog")]
+
 class GuessDependenciesStage(VernacStage):
     steps = 100
 
     def __init__(self, title: str):
         self.title = title
+        self._guessed: dict[str, list[str]] = {}
 
     def run(
             self,
@@ -21,6 +27,10 @@ class GuessDependenciesStage(VernacStage):
             python: str,
             **kwargs,
         ) -> StageOutput:
+        # code kept from the previous pass needs no second guess
+        if python in self._guessed:
+            return StageAction.NEXT.out(python=python, dependencies=self._guessed[python])
+
         system_prompt = (
             "You are an expert programmer working on contract. "
             "The user, your client, will share a Python program. "
@@ -39,24 +49,25 @@ class GuessDependenciesStage(VernacStage):
             {"role": "user", "content": user_prompt},
         ]
 
-        context.log_json("prompt.json", chat_messages)
+        context.log_prompt("prompt.json", chat_messages)
 
         def on_token(i: int):
-            context.update_progress(completed=normalize_progress(i))
+            context.update_progress(completed=context.get_token_progress(i))
 
-        chat_completion = complete_chat(
+        chat_completion = context.complete_chat(
+            "dependencies",
             chat_messages,
-            model="gpt-4",
             on_token=on_token,
         )
 
         context.log_text("completion.txt", chat_completion)
 
-        dependencies = set(chat_completion.splitlines()) - sys.stdlib_module_names
-        dependencies = [d for d in dependencies if not d.startswith("vnprog")]
+        dependencies = clean_dependencies(chat_completion.splitlines())
 
         context.log_json("dependencies.json", dependencies)
 
+        self._guessed[python] = dependencies
+
         return StageOutput(
             action=StageAction.NEXT,
             state=dict(python=python, dependencies=dependencies),
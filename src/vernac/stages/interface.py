@@ -4,6 +4,7 @@ import json
 
 from typing import (
     Any,
+    Callable,
     TYPE_CHECKING,
 )
 from enum import (
@@ -17,6 +18,9 @@ from rich.progress import (
     TaskID,
 )
 
+from vernac.tokens import count_chat_tokens
+from vernac.util import normalize_progress
+
 if TYPE_CHECKING:
     from vernac.pipeline import VernacPipeline
 
@@ -34,24 +38,19 @@ class StageContext:
             verbose: bool,
             progress: Progress,
             progress_task: TaskID,
+            expected_tokens: int | None = None,
         ):
         self.pipeline = pipeline
         self.log_dir = log_dir
         self.verbose = verbose
         self._progress = progress
         self._progress_task = progress_task
-
-    def get_log_path(self, rel_path: str) -> str:
-        log_path = os.path.join(self.log_dir, rel_path)
-        (log_dir, _) = os.path.split(log_path)
-
-        os.makedirs(log_dir, exist_ok=True)
-
-        return log_path
+        self.expected_tokens = expected_tokens
+        self.prompt_tokens: dict[str, int] = {}
+        self.completion_tokens = 0
 
     def log_bytes(self, rel_path: str, contents: bytes):
-        with open(self.get_log_path(rel_path), "wb") as log_file:
-            log_file.write(contents)
+        self.pipeline.log_sink.write(os.path.join(self.log_dir, rel_path), contents)
 
     def log_text(self, rel_path: str, contents: str):
         self.log_bytes(rel_path, contents.encode("utf-8"))
@@ -59,6 +58,48 @@ class StageContext:
     def log_json(self, rel_path: str, contents: Any, indent=2, **kwargs):
         self.log_text(rel_path, json.dumps(contents, indent=indent, **kwargs))
 
+    def log_prompt(self, rel_path: str, chat_messages: list[dict[str, str]]):
+        self.prompt_tokens[rel_path] = count_chat_tokens(chat_messages)
+
+        self.log_json(rel_path, chat_messages)
+        self.log_json("prompt_tokens.json", self.prompt_tokens)
+
+    def complete_chat(
+            self,
+            role: str,
+            chat_messages: list[dict[str, str]],
+            on_token: Callable[[int], None] = lambda p: None,
+            on_partial: Callable[[str], None] = lambda c: None,
+            cache: bool = True,
+        ) -> str:
+        def count_token(i: int):
+            self.completion_tokens += 1
+
+            on_token(i)
+
+        return self.pipeline.models.complete_chat(
+            role,
+            chat_messages,
+            on_token=count_token,
+            on_partial=on_partial,
+            cache=cache,
+        )
+
+    def get_token_progress(self, i: int, scale: float = 100) -> float:
+        """
+        Progress through a completion after `i` tokens, measured against the
+        tokens this stage completed in past builds when they are known.
+        """
+
+        if self.expected_tokens is None:
+            return normalize_progress(i, scale=scale)
+
+        # a stage may make several completions; its history covers them all
+        return scale * min(0.99, self.completion_tokens / self.expected_tokens)
+
+    def print(self, *args, **kwargs):
+        self._progress.console.print(*args, **kwargs)
+
     def advance_progress(self, advance: float = 1):
         self._progress.update(self._progress_task, advance=advance)
 
@@ -68,6 +109,7 @@ class StageContext:
 class StageAction(Enum):
     NEXT = auto()
     LOOP = auto()
+    DONE = auto()
 
     @classmethod
     def out(cls, **state: Any) -> "StageOutput":
@@ -3,11 +3,8 @@ from enum import (
     auto,
 )
 
-from vernac.util import (
-    str_to_filename,
-    normalize_progress,
-)
-from vernac.openai import complete_chat
+from vernac.util import str_to_filename
+from vernac.lockfile import Lockfile
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -42,15 +39,15 @@ Only write MAIN or MODULE. Do not write any other text.
     ]
     simple_filename = str_to_filename(filename)
 
-    context.log_json(f"prompt_{simple_filename}.json", chat_messages)
+    context.log_prompt(f"prompt_{simple_filename}.json", chat_messages)
 
     # run the prompt and extract tests
     def on_token(i: int):
-        context.update_progress(completed=normalize_progress(i))
+        context.update_progress(completed=context.get_token_progress(i))
 
-    chat_completion = complete_chat(
+    chat_completion = context.complete_chat(
+        "classify",
         chat_messages,
-        model="gpt-3.5-turbo",
         on_token=on_token,
     )
 
@@ -61,15 +58,25 @@ Only write MAIN or MODULE. Do not write any other text.
 class MapModulesStage(VernacStage):
     steps = 1
 
-    def __init__(self, title: str):
+    def __init__(self, title: str, lock: Lockfile | None = None):
         self.title = title
+        self.lock = lock
+
+    def classify(self, context: StageContext, filename: str, english: str) -> SourceType:
+        if self.lock is not None:
+            source = self.lock.get_source(filename, english)
+
+            if source is not None:
+                return SourceType[source["kind"].upper()]
+
+        return classify_source_type(context, filename, english)
 
     def run(self, context: StageContext, english_all: dict[str, str]) -> StageOutput:
         if len(english_all) == 1:
             english_types = {fn: SourceType.MAIN for fn in english_all}
         else:
             english_types = {
-                fn: classify_source_type(context, fn, e)
+                fn: self.classify(context, fn, e)
                 for fn, e in english_all.items()
             }
 
@@ -0,0 +1,313 @@
+import os
+import os.path
+import re
+import time
+
+from tempfile import TemporaryDirectory
+
+from vernac.util import strip_markdown_fence
+from vernac.sandbox import (
+    RunLimits,
+    run_sandboxed,
+)
+from vernac.profiling import (
+    Profiler,
+    Hotspot,
+    find_hotspots,
+    get_function_spans,
+    get_span_source,
+    splice_functions,
+)
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+from vernac.stages.package import PackageStage
+from vernac.stages.check_tests import check_suggested_tests
+from vernac.stages.repair_modules import get_interface
+
+FILE_PATTERN = re.compile(r"^=== (\w+\.py) ===[ \t]*$", re.MULTILINE)
+
+SYSTEM_PROMPT = """
+You are an expert programmer working on contract. The user, your client, will provide the source of a working Python program along with the functions where a profile of its tests says it spends its time. Make those functions faster without changing what they do.
+
+Rewrite only the listed functions, keeping their names and signatures. Put a method inside its class, and include any new imports it needs. For each file with a rewritten function, write its name as a header line, then the code in a Markdown code block:
+
+=== main.py ===
+```python
+<imports and rewritten functions>
+```
+
+Do not add commentary.
+"""
+
+def get_sources(python: str, modules: dict[str, dict]) -> dict[str, str]:
+    sources = {m["py_name"]: m["python"] for m in modules.values()}
+    sources["main.py"] = python
+
+    return sources
+
+def parse_rewrites(completion: str) -> dict[str, str]:
+    parts = FILE_PATTERN.split(completion)
+
+    # parts alternate between file names and their bodies
+    return {
+        py_name: strip_markdown_fence(body.strip())
+        for (py_name, body) in zip(parts[1::2], parts[2::2])
+    }
+
+def time_tests(program_path: str, test_args: list[list[str]], repeats: int = 3) -> float | None:
+    """
+    Time a program across test invocations, taking the best of a few runs of
+    each, or None if any run fails.
+    """
+
+    total = 0.0
+
+    for args in test_args:
+        best = None
+
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = run_sandboxed([program_path] + args, limits=RunLimits(timeout=16.0))
+            elapsed = time.perf_counter() - start
+
+            if result.failed:
+                return None
+
+            best = elapsed if best is None else min(best, elapsed)
+
+        total += best
+
+    return total
+
+class OptimizeHotspotsStage(VernacStage):
+    """
+    Profile the program on its tests and ask for faster versions of its
+    hottest functions, keeping them only if the tests still pass and the
+    program is measurably faster.
+    """
+
+    steps = 100
+
+    def __init__(
+            self,
+            title: str,
+            package: PackageStage,
+            top: int = 3,
+            min_seconds: float = 0.05,
+            min_speedup: float = 1.1,
+        ):
+        self.title = title
+        self.package = package
+        self.top = top
+        self.min_seconds = min_seconds
+        self.min_speedup = min_speedup
+
+    def profile(
+            self,
+            program_path: str,
+            test_args: list[list[str]],
+            sources: dict[str, str],
+        ) -> list[Hotspot]:
+        with Profiler() as profiler:
+            for args in test_args:
+                run_sandboxed(
+                    [program_path] + args,
+                    limits=RunLimits(timeout=16.0),
+                    env=profiler.get_env(),
+                )
+
+            stats = profiler.load()
+
+        if stats is None:
+            return []
+
+        return find_hotspots(stats, sources, top=self.top)
+
+    def request_rewrites(
+            self,
+            context: StageContext,
+            english: str,
+            sources: dict[str, str],
+            hotspots: list[Hotspot],
+        ) -> dict[str, str]:
+        hot_list = "\n".join(f"- {h.describe()}" for h in hotspots)
+        hot_sources = []
+
+        for hotspot in hotspots:
+            span = next(
+                s for s in get_function_spans(sources[hotspot.py_name])
+                if s.qualname == hotspot.qualname
+            )
+
+            hot_sources.append(
+                f"## `{hotspot.qualname}` in {hotspot.py_name}\n\n"
+                f"```python\n{get_span_source(sources[hotspot.py_name], span)}```"
+            )
+
+        program = "\n\n".join(
+            f"## {py_name}\n\n```python\n{python}\n```"
+            for (py_name, python) in sources.items()
+        )
+        user_prompt = (
+            f"# Program spec\n\n{english}\n\n"
+            f"# Program source\n\n{program}\n\n"
+            f"# Profile\n\n{hot_list}\n\n"
+            "# Functions to rewrite\n\n" + "\n\n".join(hot_sources)
+        )
+        chat_messages = [
+            {"role": "system", "content": SYSTEM_PROMPT.strip()},
+            {"role": "user", "content": user_prompt},
+        ]
+
+        context.log_prompt("prompt.json", chat_messages)
+
+        def on_token(i: int):
+            context.update_progress(completed=20 + context.get_token_progress(i, scale=30))
+
+        chat_completion = context.complete_chat(
+            "optimize",
+            chat_messages,
+            on_token=on_token,
+        )
+
+        context.log_text("completion.txt", chat_completion)
+
+        return parse_rewrites(chat_completion)
+
+    def splice_rewrites(
+            self,
+            sources: dict[str, str],
+            rewrites: dict[str, str],
+            hotspots: list[Hotspot],
+        ) -> dict[str, str] | None:
+        """
+        Apply rewritten functions to the sources, or return None if the
+        result does not parse or would change what a file exports.
+        """
+
+        spliced = dict(sources)
+
+        for (py_name, rewritten) in rewrites.items():
+            if py_name not in sources:
+                continue
+
+            qualnames = [h.qualname for h in hotspots if h.py_name == py_name]
+
+            try:
+                spliced[py_name] = splice_functions(sources[py_name], rewritten, qualnames)
+            except SyntaxError:
+                return None
+
+            # callers elsewhere rely on these exact names and signatures
+            if get_interface(spliced[py_name]) != get_interface(sources[py_name]):
+                return None
+
+        return spliced
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            python: str,
+            dependencies: list[str],
+            modules: dict[str, dict],
+            out_path: str,
+            suggested_tests: list[dict] = [],
+        ) -> StageOutput:
+        program_path = os.path.abspath(out_path)
+        test_args = [t["args"].split() for t in suggested_tests]
+        sources = get_sources(python, modules)
+        hotspots = self.profile(program_path, test_args, sources)
+
+        context.log_json("hotspots.json", [h.__dict__ for h in hotspots])
+        context.update_progress(completed=20)
+
+        # nothing the generated code does is worth a rewrite
+        if len(hotspots) == 0 or hotspots[0].seconds < self.min_seconds:
+            return StageAction.NEXT.out()
+
+        rewrites = self.request_rewrites(context, english, sources, hotspots)
+        candidate = self.splice_rewrites(sources, rewrites, hotspots)
+
+        if candidate is None or candidate == sources:
+            context.log_json("timings.json", dict(accepted=False, reason="no usable rewrite"))
+
+            return StageAction.NEXT.out()
+
+        for (py_name, source) in candidate.items():
+            if source != sources[py_name]:
+                context.log_text(f"optimized/{py_name}", source)
+
+        candidate_modules = {
+            n: m | dict(python=candidate[m["py_name"]])
+            for (n, m) in modules.items()
+        }
+        baseline_seconds = time_tests(program_path, test_args)
+
+        context.update_progress(completed=60)
+
+        with TemporaryDirectory(prefix="vernac-optimize-") as trial_dir:
+            trial_path = os.path.join(trial_dir, "program")
+
+            self.package.package_trial(
+                context,
+                trial_path,
+                python=candidate["main.py"],
+                dependencies=dependencies,
+                modules=candidate_modules,
+            )
+
+            failures = check_suggested_tests(
+                context,
+                english=english,
+                program_path=trial_path,
+                suggested_tests=suggested_tests,
+            )
+
+            if len(failures) == 0:
+                candidate_seconds = time_tests(trial_path, test_args)
+            else:
+                candidate_seconds = None
+
+        accepted = (
+            baseline_seconds is not None
+            and candidate_seconds is not None
+            and baseline_seconds >= self.min_speedup * candidate_seconds
+        )
+
+        context.log_json(
+            "timings.json",
+            dict(
+                accepted=accepted,
+                baseline_seconds=baseline_seconds,
+                candidate_seconds=candidate_seconds,
+                failures=[f.__dict__ for f in failures],
+            ),
+        )
+
+        if not accepted:
+            return StageAction.NEXT.out()
+
+        context.print(
+            f"optimized {', '.join(h.qualname for h in hotspots)}: "
+            f"{baseline_seconds:.3f}s -> {candidate_seconds:.3f}s"
+        )
+
+        # rebuild the real program from the faster sources
+        packaged = self.package.run(
+            context,
+            python=candidate["main.py"],
+            dependencies=dependencies,
+            modules=candidate_modules,
+        )
+
+        return StageAction.NEXT.out(
+            python=candidate["main.py"],
+            first_draft=candidate["main.py"],
+            modules=candidate_modules,
+            **packaged.state,
+        )
@@ -1,9 +1,25 @@
 import os
 import os.path
 import sys
+import copy
+import json
+import stat
+import hashlib
+import marshal
+import zipfile
 import subprocess
+import time
+import shutil
+import platform
+import statistics
+import importlib.util
 
+from enum import Enum
 from typing import BinaryIO
+from dataclasses import (
+    dataclass,
+    replace,
+)
 from subprocess import (
     check_output,
     CalledProcessError,
@@ -14,6 +30,14 @@ from contextlib import nullcontext
 
 import tomli_w
 
+from vernac.util import replace_ext
+from vernac.module_index import get_cache_dir
+from vernac.lockfile import install_locked_packages
+from vernac.prefetch import DependencyPrefetcher
+from vernac.remote_cache import (
+    CacheClient,
+    get_cache_key,
+)
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -46,6 +70,9 @@ def package_in_dir(py_files: dict[str, str], dir_path: str, deps: list[str]):
 
     os.makedirs(to_dir("src/vnprog"), exist_ok=True)
 
+    with open(to_dir("src/vnprog/__init__.py"), "wt") as file:
+        pass
+
     for (filename, python) in py_files.items():
         py_path = to_dir("src/vnprog", filename)
 
@@ -55,19 +82,63 @@ def package_in_dir(py_files: dict[str, str], dir_path: str, deps: list[str]):
     with open(to_dir("pyproject.toml"), "wb") as file:
         generate_pyproject(file, deps)
 
-def shiv_package(dir_path: str, out_path: str):
+class PackageLayout(Enum):
+    SHIV = "shiv"
+    DIRECTORY = "directory"
+    ZIPIMPORT = "zipimport"
+    SHARED = "shared"
+
+@dataclass
+class PackageOptions:
+    layout: PackageLayout = PackageLayout.SHIV
+    python: str | None = None
+    compile_pyc: bool = False
+    strip: bool = False
+    measure: bool = False
+    env_root: str | None = None
+
+    @property
+    def shared_env_root(self) -> str:
+        if self.env_root is None:
+            return os.path.join(get_cache_dir(), "envs")
+
+        return os.path.abspath(self.env_root)
+
+    @property
+    def interpreter(self) -> str:
+        return "/usr/bin/env python3" if self.python is None else self.python
+
+    @property
+    def target_python(self) -> str:
+        return sys.executable if self.python is None else self.python
+
+def shiv_package(
+        dir_path: str | None,
+        out_path: str,
+        interpreter: str = "/usr/bin/env python3",
+        site_packages: str | None = None,
+        find_links: str | None = None,
+    ):
     # crudely guess the shiv bin location
     python_dir = os.path.dirname(sys.executable)
     shiv_path = os.path.join(python_dir, "shiv")
 
+    if site_packages is None:
+        source_args = ["-c", "main", dir_path]
+    else:
+        source_args = ["-e", "vnprog.main:main", "--site-packages", site_packages]
+
+    if find_links is not None:
+        source_args += ["--find-links", find_links]
+
     # run shiv to package
     try:
         check_output(
             [
                 shiv_path,
                 "-o", out_path,
-                "-c", "main",
-                dir_path,
+                "-p", interpreter,
+                *source_args,
             ],
             stderr=subprocess.STDOUT,
         )
@@ -76,6 +147,369 @@ def shiv_package(dir_path: str, out_path: str):
 
         raise
 
+def install_requirements(
+        requirements: list[str],
+        site_dir: str,
+        find_links: str | None = None,
+    ):
+    if find_links is None:
+        find_links_args = []
+    else:
+        find_links_args = ["--find-links", find_links]
+
+    try:
+        check_output(
+            [
+                sys.executable, "-m", "pip", "install",
+                "--disable-pip-version-check",
+                "--no-compile",
+                *find_links_args,
+                "--target", site_dir,
+                *requirements,
+            ],
+            stderr=subprocess.STDOUT,
+        )
+    except CalledProcessError as error:
+        print(error.output)
+
+        raise
+
+def install_site_packages(dir_path: str, site_dir: str, find_links: str | None = None):
+    install_requirements([dir_path], site_dir, find_links=find_links)
+
+STRIPPED_DIST_FILES = {"RECORD", "INSTALLER", "REQUESTED", "direct_url.json"}
+
+def strip_site_packages(site_dir: str):
+    shutil.rmtree(os.path.join(site_dir, "bin"), ignore_errors=True)
+
+    for (dir_path, dir_names, file_names) in os.walk(site_dir):
+        for dir_name in list(dir_names):
+            if dir_name in ("tests", "__pycache__"):
+                shutil.rmtree(os.path.join(dir_path, dir_name))
+                dir_names.remove(dir_name)
+
+        if dir_path.endswith(".dist-info"):
+            for file_name in STRIPPED_DIST_FILES.intersection(file_names):
+                os.remove(os.path.join(dir_path, file_name))
+
+def compile_site_packages(site_dir: str, python: str, legacy: bool = False):
+    # compile with the target interpreter so the magic number matches
+    check_output(
+        [
+            python, "-m", "compileall",
+            "-q",
+            "-j", "0",
+            "--invalidation-mode", "unchecked-hash",
+            *(["-b"] if legacy else []),
+            site_dir,
+        ],
+        stderr=subprocess.STDOUT,
+    )
+
+def is_pure_python(site_dir: str) -> bool:
+    for (_, _, file_names) in os.walk(site_dir):
+        for file_name in file_names:
+            if file_name.endswith((".so", ".pyd", ".dylib")):
+                return False
+
+    return True
+
+DIRECTORY_LAUNCHER = """\
+#!{interpreter}
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), {lib_name!r}))
+
+from vnprog.main import main
+
+main()
+"""
+
+def get_directory_lib_path(out_path: str) -> str:
+    return f"{out_path}-lib"
+
+def directory_package(site_dir: str, out_path: str, interpreter: str):
+    lib_path = get_directory_lib_path(out_path)
+
+    shutil.rmtree(lib_path, ignore_errors=True)
+    shutil.copytree(site_dir, lib_path)
+
+    launcher = DIRECTORY_LAUNCHER.format(
+        interpreter=interpreter,
+        lib_name=os.path.basename(lib_path),
+    )
+
+    with open(out_path, "wt") as out_file:
+        out_file.write(launcher)
+
+    make_executable(out_path)
+
+def zipimport_package(site_dir: str, out_path: str, interpreter: str):
+    archive_files = {"__main__.py": ZIPAPP_MAIN.encode("utf-8")}
+
+    for (dir_path, _, file_names) in os.walk(site_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            name = os.path.relpath(path, site_dir).replace(os.sep, "/")
+
+            with open(path, "rb") as file:
+                archive_files[name] = file.read()
+
+    write_zipapp(archive_files, out_path, interpreter)
+
+ENV_ROOT_VARIABLE = "VERNAC_ENV_ROOT"
+
+SHARED_MAIN = """\
+import os
+import sys
+
+env_root = os.environ.get({variable!r}, {env_root!r})
+env_path = os.path.join(env_root, {env_key!r})
+
+if not os.path.isdir(env_path):
+    sys.exit(f"missing shared environment {env_key} in {{env_root}}; copy it there or set {variable}")
+
+sys.path.insert(1, env_path)
+
+import vnprog.main
+
+vnprog.main.main()
+"""
+
+def get_shared_env_key(
+        requirements: list[str],
+        locked_packages: list[dict] | None,
+        options: PackageOptions,
+    ) -> str:
+    """
+    Key a dependency environment by what goes into it and what will run it.
+    """
+
+    if locked_packages is None:
+        contents = sorted(set(requirements))
+    else:
+        contents = [f"{p['name']}=={p['version']}" for p in locked_packages]
+
+    key_data = dict(
+        contents=contents,
+        python=sys.version if options.python is None else options.python,
+        platform=[sys.platform, platform.machine()],
+        compile_pyc=options.compile_pyc,
+        strip=options.strip,
+    )
+    key_json = json.dumps(key_data, sort_keys=True)
+
+    return hashlib.sha256(key_json.encode("utf-8")).hexdigest()[:16]
+
+def build_shared_env(
+        env_path: str,
+        requirements: list[str],
+        options: PackageOptions,
+        locked_packages: list[dict] | None = None,
+        wheelhouse: str | None = None,
+        find_links: str | None = None,
+    ):
+    """
+    Install dependencies into `env_path`, unless an identical environment
+    is already there.
+    """
+
+    if os.path.isdir(env_path):
+        return
+
+    os.makedirs(os.path.dirname(env_path), exist_ok=True)
+
+    with TemporaryDirectory(prefix=".partial-", dir=os.path.dirname(env_path)) as partial_dir:
+        site_dir = os.path.join(partial_dir, "env")
+
+        if locked_packages is None:
+            install_requirements(requirements, site_dir, find_links=find_links)
+        else:
+            install_locked_packages(locked_packages, site_dir, wheelhouse)
+
+        if options.strip:
+            strip_site_packages(site_dir)
+
+        if options.compile_pyc:
+            compile_site_packages(site_dir, python=options.target_python)
+
+        with open(os.path.join(site_dir, "vernac-env.json"), "w") as manifest_file:
+            json.dump(dict(requirements=requirements, packages=locked_packages), manifest_file, indent=2)
+
+        # another build may have finished the same environment meanwhile
+        try:
+            os.rename(site_dir, env_path)
+        except OSError:
+            if not os.path.isdir(env_path):
+                raise
+
+def compile_pyc(source: str, filename: str) -> bytes | None:
+    source_bytes = source.encode("utf-8")
+
+    try:
+        code = compile(source_bytes, filename, "exec", dont_inherit=True)
+    except SyntaxError:
+        # leave it to the interpreter to report at runtime
+        return None
+
+    # unchecked hash-based pyc, so zipimport never falls back to the source
+    flags = 0b01
+
+    return (
+        importlib.util.MAGIC_NUMBER
+        + flags.to_bytes(4, "little")
+        + importlib.util.source_hash(source_bytes)
+        + marshal.dumps(code)
+    )
+
+def compile_target_pycs(
+        sources: dict[str, str],
+        archive_path: str,
+        python: str,
+    ) -> dict[str, bytes]:
+    """
+    Compile archive sources with the target interpreter, returning legacy
+    pycs by archive name.
+
+    Returns none if the target cannot run here, since pycs with the wrong
+    magic number would only be ignored.
+    """
+
+    with TemporaryDirectory(prefix="vernac-pyc-") as tmpdir:
+        for (name, source) in sources.items():
+            path = os.path.join(tmpdir, name)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path, "w") as source_file:
+                source_file.write(source)
+
+        try:
+            # sources that do not parse are skipped, as in compile_pyc
+            subprocess.run(
+                [
+                    python, "-m", "compileall",
+                    "-q",
+                    "-b",
+                    "--invalidation-mode", "unchecked-hash",
+                    "-d", archive_path,
+                    tmpdir,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            return {}
+
+        pycs = {}
+
+        for name in sources:
+            pyc_path = os.path.join(tmpdir, replace_ext(name, "pyc"))
+
+            if os.path.exists(pyc_path):
+                with open(pyc_path, "rb") as pyc_file:
+                    pycs[replace_ext(name, "pyc")] = pyc_file.read()
+
+        return pycs
+
+ZIPAPP_MAIN = """\
+import vnprog.main
+
+vnprog.main.main()
+"""
+
+def make_executable(path: str):
+    mode = os.stat(path).st_mode
+
+    os.chmod(path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def write_zipapp(archive_files: dict[str, bytes], out_path: str, interpreter: str):
+    with open(out_path, "wb") as out_file:
+        out_file.write(f"#!{interpreter}\n".encode("utf-8"))
+
+        with zipfile.ZipFile(out_file, "w", zipfile.ZIP_DEFLATED) as archive:
+            for (name, contents) in archive_files.items():
+                archive.writestr(name, contents)
+
+    make_executable(out_path)
+
+def zipapp_package(
+        py_files: dict[str, str],
+        out_path: str,
+        interpreter: str = "/usr/bin/env python3",
+        main_source: str = ZIPAPP_MAIN,
+        python: str | None = None,
+    ):
+    """
+    Write a zipapp of `py_files` with pycs for `python`, the target
+    interpreter, or for this one if it is None.
+    """
+
+    archive_path = os.path.abspath(out_path)
+    sources = {"__main__.py": main_source, "vnprog/__init__.py": ""}
+    archive_files = {}
+
+    for (filename, python_source) in py_files.items():
+        sources[f"vnprog/{filename}"] = python_source
+
+    for (name, python_source) in sources.items():
+        archive_files[name] = python_source.encode("utf-8")
+
+    if python is None:
+        for (name, python_source) in sources.items():
+            pyc = compile_pyc(python_source, os.path.join(archive_path, name))
+
+            if pyc is not None:
+                archive_files[replace_ext(name, "pyc")] = pyc
+    else:
+        archive_files |= compile_target_pycs(sources, archive_path, python)
+
+    write_zipapp(archive_files, out_path, interpreter)
+
+def get_tree_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(dir_path, file_name))
+        for (dir_path, _, file_names) in os.walk(path)
+        for file_name in file_names
+    )
+
+def time_run(args: list[str], env: dict[str, str]) -> float:
+    start = time.perf_counter()
+
+    subprocess.run(
+        args,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=60.0,
+    )
+
+    return time.perf_counter() - start
+
+def measure_program(
+        out_path: str,
+        extra_paths: list[str] = [],
+        args: list[str] = ["--help"],
+        warm_runs: int = 5,
+    ) -> dict:
+    program_args = [os.path.abspath(out_path)] + args
+
+    # a fresh shiv root makes the first run pay full extraction
+    with TemporaryDirectory(prefix="vernac-measure-") as shiv_root:
+        env = os.environ | {"SHIV_ROOT": shiv_root}
+        cold = time_run(program_args, env)
+        warm = [time_run(program_args, env) for _ in range(warm_runs)]
+
+    return dict(
+        size_bytes=sum(get_tree_size(p) for p in [out_path] + extra_paths),
+        cold_start_seconds=cold,
+        warm_start_seconds=statistics.median(warm),
+    )
+
 class PackageStage(VernacStage):
     steps = 2
 
@@ -84,10 +518,261 @@ class PackageStage(VernacStage):
             title: str,
             out_path: str,
             package_dir: str | None = None,
+            options: PackageOptions = PackageOptions(),
+            locked_packages: list[dict] | None = None,
+            wheelhouse: str | None = None,
+            prefetcher: DependencyPrefetcher | None = None,
+            keep_sources: bool = False,
+            remote_cache: CacheClient | None = None,
         ):
         self.title = title
         self.out_path = out_path
         self.package_dir = package_dir
+        self.options = options
+        self.locked_packages = locked_packages
+        self.wheelhouse = wheelhouse
+        self.prefetcher = prefetcher
+        self.keep_sources = keep_sources
+        self.remote_cache = remote_cache
+        self._work_dir: TemporaryDirectory | None = None
+
+    @property
+    def find_links(self) -> str | None:
+        return None if self.prefetcher is None else self.prefetcher.wheelhouse
+
+    def package_site(self, context: StageContext, dir_path: str) -> list[str]:
+        options = self.options
+        site_dir = os.path.join(dir_path, "site-packages")
+
+        # the package dir may hold a previous pass's install
+        shutil.rmtree(site_dir, ignore_errors=True)
+
+        if self.locked_packages is None:
+            install_site_packages(dir_path, site_dir, find_links=self.find_links)
+        else:
+            install_locked_packages(self.locked_packages, site_dir, self.wheelhouse)
+            shutil.copytree(
+                os.path.join(dir_path, "src/vnprog"),
+                os.path.join(site_dir, "vnprog"),
+            )
+
+        if options.strip:
+            strip_site_packages(site_dir)
+
+        layout = options.layout
+
+        if layout == PackageLayout.ZIPIMPORT and not is_pure_python(site_dir):
+            context.print(
+                "Dependencies include extension modules; "
+                "falling back to the shiv layout."
+            )
+
+            layout = PackageLayout.SHIV
+
+        if options.compile_pyc:
+            compile_site_packages(
+                site_dir,
+                python=options.target_python,
+                legacy=layout == PackageLayout.ZIPIMPORT,
+            )
+
+        match layout:
+            case PackageLayout.SHIV:
+                shiv_package(
+                    dir_path=None,
+                    out_path=self.out_path,
+                    interpreter=options.interpreter,
+                    site_packages=site_dir,
+                )
+
+                return []
+
+            case PackageLayout.DIRECTORY:
+                directory_package(site_dir, self.out_path, options.interpreter)
+
+                return [get_directory_lib_path(self.out_path)]
+
+            case PackageLayout.ZIPIMPORT:
+                zipimport_package(site_dir, self.out_path, options.interpreter)
+
+                return []
+
+    def package_shared(
+            self,
+            context: StageContext,
+            py_files: dict[str, str],
+            all_deps: list[str],
+        ) -> str:
+        """
+        Write a thin pyz holding only `vnprog`, pointing at a shared
+        environment with its dependencies.
+        """
+
+        options = self.options
+        env_key = get_shared_env_key(all_deps, self.locked_packages, options)
+        env_path = os.path.join(options.shared_env_root, env_key)
+
+        build_shared_env(
+            env_path,
+            requirements=sorted(set(all_deps)),
+            options=options,
+            locked_packages=self.locked_packages,
+            wheelhouse=self.wheelhouse,
+            find_links=self.find_links,
+        )
+
+        context.log_json("shared_env.json", dict(key=env_key, path=env_path))
+
+        main_source = SHARED_MAIN.format(
+            variable=ENV_ROOT_VARIABLE,
+            env_root=options.shared_env_root,
+            env_key=env_key,
+        )
+
+        zipapp_package(
+            py_files=py_files,
+            out_path=self.out_path,
+            interpreter=options.interpreter,
+            main_source=main_source,
+            python=options.python,
+        )
+
+        return env_path
+
+    def build_artifact(
+            self,
+            context: StageContext,
+            py_files: dict[str, str],
+            all_deps: list[str],
+        ) -> tuple[list[str], list[str] | None]:
+        options = self.options
+
+        if self.package_dir is not None:
+            tmpdir_context = nullcontext(
+                os.path.abspath(self.package_dir),
+            )
+        elif self.keep_sources:
+            # later stages run the program from this dir, so it must outlive the stage
+            if self._work_dir is None:
+                self._work_dir = TemporaryDirectory(prefix="vernac-")
+
+            tmpdir_context = nullcontext(self._work_dir.name)
+        else:
+            tmpdir_context = TemporaryDirectory(prefix="vernac-")
+
+        with tmpdir_context as tmpdir:
+            package_in_dir(
+                py_files=py_files,
+                dir_path=tmpdir,
+                deps=all_deps,
+            )
+
+            context.advance_progress()
+
+            # wheels prefetched during generation are usually done by now
+            if self.prefetcher is not None and len(all_deps) > 0:
+                self.prefetcher.wait(all_deps)
+
+                context.log_json(
+                    "prefetch.json",
+                    dict(
+                        requested=sorted(self.prefetcher.requested & set(all_deps)),
+                        failed=sorted(self.prefetcher.failed & set(all_deps)),
+                    ),
+                )
+
+            env_path = None
+
+            # without third-party deps, skip setuptools and shiv entirely
+            if len(all_deps) == 0 and options.layout != PackageLayout.DIRECTORY:
+                zipapp_package(
+                    py_files=py_files,
+                    out_path=self.out_path,
+                    interpreter=options.interpreter,
+                    python=options.python,
+                )
+
+                extra_paths = []
+            elif (
+                options.layout == PackageLayout.SHIV
+                and not (options.compile_pyc or options.strip)
+                and self.locked_packages is None
+                and not self.keep_sources
+            ):
+                shiv_package(
+                    dir_path=tmpdir,
+                    out_path=self.out_path,
+                    interpreter=options.interpreter,
+                    find_links=self.find_links,
+                )
+
+                extra_paths = []
+            elif options.layout == PackageLayout.SHARED:
+                env_path = self.package_shared(context, py_files, all_deps)
+                extra_paths = []
+            else:
+                extra_paths = self.package_site(context, tmpdir)
+
+            site_dir = os.path.join(tmpdir, "site-packages")
+
+            if not self.keep_sources:
+                python_path = None
+            elif os.path.isdir(site_dir):
+                python_path = [site_dir]
+            else:
+                python_path = [os.path.join(tmpdir, "src")]
+
+                if env_path is not None:
+                    python_path.append(env_path)
+
+        return (extra_paths, python_path)
+
+    def get_artifact_key(self, py_files: dict[str, str], all_deps: list[str]) -> str | None:
+        # these must produce files besides the program itself
+        if (
+            self.remote_cache is None
+            or self.options.layout in (PackageLayout.DIRECTORY, PackageLayout.SHARED)
+            or self.package_dir is not None
+            or self.keep_sources
+        ):
+            return None
+
+        return get_cache_key(
+            py_files,
+            sorted(all_deps),
+            self.options.layout.value,
+            self.options.interpreter,
+            self.options.compile_pyc,
+            self.options.strip,
+            self.locked_packages,
+            # built wheels and bytecode depend on the building interpreter
+            sys.version,
+            sys.platform,
+            platform.machine(),
+        )
+
+    def package_trial(
+            self,
+            context: StageContext,
+            out_path: str,
+            python: str,
+            dependencies: list[str],
+            modules: dict[str, dict],
+        ):
+        """
+        Package other sources to `out_path` as this stage would, for trying
+        out a change without touching the real program.
+        """
+
+        trial = copy.copy(self)
+        trial.out_path = out_path
+        trial.package_dir = None
+        trial.keep_sources = False
+        trial.remote_cache = None
+        trial.options = replace(self.options, measure=False)
+        trial._work_dir = None
+
+        trial.run(context, python, dependencies, modules)
 
     def run(
             self,
@@ -96,6 +781,7 @@ class PackageStage(VernacStage):
             dependencies: list[str],
             modules: dict[str, dict],
         ) -> StageOutput:
+        options = self.options
         py_files = {"main.py": python}
 
         for module in modules.values():
@@ -104,28 +790,48 @@ class PackageStage(VernacStage):
         module_deps = chain.from_iterable(
             m["dependencies"] for m in modules.values()
         )
+        all_deps = dependencies + list(module_deps)
 
-        if self.package_dir is None:
-            tmpdir_context = TemporaryDirectory(prefix="vernac-")
+        artifact_key = self.get_artifact_key(py_files, all_deps)
+
+        if artifact_key is None:
+            artifact = None
         else:
-            tmpdir_context = nullcontext(
-                os.path.abspath(self.package_dir),
-            )
+            artifact = self.remote_cache.get("artifacts", artifact_key)
 
-        with tmpdir_context as tmpdir:
-            package_in_dir(
-                py_files=py_files,
-                dir_path=tmpdir,
-                deps=dependencies + list(module_deps),
-            )
+        if artifact is None:
+            (extra_paths, python_path) = self.build_artifact(context, py_files, all_deps)
+
+            if artifact_key is not None:
+                with open(self.out_path, "rb") as out_file:
+                    self.remote_cache.put("artifacts", artifact_key, out_file.read())
+        else:
+            with open(self.out_path, "wb") as out_file:
+                out_file.write(artifact)
 
+            make_executable(self.out_path)
             context.advance_progress()
 
-            shiv_package(dir_path=tmpdir, out_path=self.out_path)
+            (extra_paths, python_path) = ([], None)
 
         context.advance_progress()
 
+        if options.measure:
+            measurements = measure_program(self.out_path, extra_paths)
+
+            context.log_json("measurements.json", measurements)
+            context.print(
+                f"{os.path.basename(self.out_path)}: "
+                f"{measurements['size_bytes'] / 1024:.1f} KiB, "
+                f"cold start {measurements['cold_start_seconds']:.3f}s, "
+                f"warm start {measurements['warm_start_seconds']:.3f}s"
+            )
+
         return StageOutput(
             action=StageAction.NEXT,
-            state=dict(out_path=self.out_path),
+            state=dict(
+                out_path=self.out_path,
+                python_path=python_path,
+                target_python=options.target_python,
+            ),
         )
@@ -23,8 +23,18 @@ class ReadSourceStage(VernacStage):
 
         return (in_name, src)
 
-    def run(self, context: StageContext, in_paths: list[str]) -> StageOutput:
-        english_all = dict(self.read_source(context, p) for p in in_paths)
+    def run(
+            self,
+            context: StageContext,
+            in_paths: list[str] = [],
+            english_all: dict[str, str] = {},
+        ) -> StageOutput:
+        english_all = dict(english_all)
+
+        for (in_name, src) in english_all.items():
+            context.log_text(os.path.join("sources", in_name), src)
+
+        english_all |= dict(self.read_source(context, p) for p in in_paths)
 
         return StageOutput(
             action=StageAction.NEXT,
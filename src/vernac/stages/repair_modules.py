@@ -0,0 +1,152 @@
+import re
+import ast
+import asyncio
+
+from typing import (
+    Awaitable,
+    Callable,
+)
+
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+from vernac.stages.generate_code import TestFailure
+
+FRAME_PATTERN = re.compile(r'File "(?P<path>[^"]*?)vnprog[/\\](?P<py_name>\w+\.py)", line \d+')
+
+def attribute_failure(failure: TestFailure, modules: dict[str, dict]) -> str | None:
+    """
+    Name the module whose code raised a failure's traceback, if any.
+    """
+
+    frames = FRAME_PATTERN.findall(str(failure.actual))
+
+    if len(frames) == 0:
+        return None
+
+    # the innermost generated frame is the likeliest culprit
+    (_, py_name) = frames[-1]
+
+    for (name, module) in modules.items():
+        if module.get("py_name") == py_name:
+            return name
+
+    return None
+
+def get_interface(python: str) -> list[str] | None:
+    """
+    Describe the public names and signatures that a module exports.
+    """
+
+    try:
+        tree = ast.parse(python)
+    except SyntaxError:
+        return None
+
+    def describe(node: ast.AST, prefix: str = "") -> list[str]:
+        match node:
+            case ast.FunctionDef() | ast.AsyncFunctionDef() if not node.name.startswith("_"):
+                return [f"def {prefix}{node.name}({ast.unparse(node.args)})"]
+
+            case ast.ClassDef() if not node.name.startswith("_"):
+                members = [
+                    d
+                    for child in node.body
+                    for d in describe(child, f"{node.name}.")
+                ]
+
+                return [f"class {prefix}{node.name}"] + members
+
+            case ast.Assign() if prefix == "":
+                return [
+                    n.id
+                    for t in node.targets
+                    for n in ast.walk(t)
+                    if isinstance(n, ast.Name) and not n.id.startswith("_")
+                ]
+
+            case ast.AnnAssign(target=ast.Name(id=name)) if not name.startswith("_"):
+                return [f"{prefix}{name}"]
+
+            case _:
+                return []
+
+    return sorted(d for node in tree.body for d in describe(node))
+
+class RepairModulesStage(VernacStage):
+    """
+    Send failures whose tracebacks end in a module back to that module's
+    pipeline, and keep main as it is unless a module's interface changed.
+    """
+
+    steps = 1
+
+    def __init__(
+            self,
+            title: str,
+            repair: Callable[[str, dict], Awaitable[dict]],
+            frozen: set[str] = set(),
+        ):
+        self.title = title
+        self.repair = repair
+        self.frozen = frozen
+
+    async def run(
+            self,
+            context: StageContext,
+            modules: dict[str, dict] = {},
+            test_failures: list[TestFailure] = [],
+            first_draft: str | None = None,
+        ) -> StageOutput:
+        attributed: dict[str, list[TestFailure]] = {}
+        remaining = []
+
+        for failure in test_failures:
+            name = attribute_failure(failure, modules)
+
+            # injected modules are the user's to fix; main must work around them
+            if name is None or name in self.frozen:
+                remaining.append(failure)
+            else:
+                attributed.setdefault(name, []).append(failure)
+
+        context.log_json("attribution.json", {n: len(f) for (n, f) in attributed.items()})
+
+        if len(attributed) == 0:
+            return StageAction.NEXT.out()
+
+        repaired = await asyncio.gather(
+            *(
+                self.repair(
+                    name,
+                    modules[name] | dict(
+                        first_draft=modules[name]["python"],
+                        test_failures=failures,
+                    ),
+                )
+                for (name, failures) in attributed.items()
+            )
+        )
+        repaired = dict(zip(attributed, repaired))
+        changed_interfaces = [
+            n for (n, m) in repaired.items()
+            if get_interface(m["python"]) != get_interface(modules[n]["python"])
+        ]
+
+        context.log_json("changed_interfaces.json", changed_interfaces)
+
+        # main only needs another pass if it failed too, or must follow a module
+        keep_main = (
+            first_draft is not None
+            and len(remaining) == 0
+            and len(changed_interfaces) == 0
+        )
+
+        return StageAction.NEXT.out(
+            modules=modules | {n: modules[n] | m for (n, m) in repaired.items()},
+            test_failures=remaining,
+            keep_first_draft=keep_main,
+        )
@@ -0,0 +1,75 @@
+from vernac.util import replace_ext
+from vernac.module_index import ModuleIndex
+from vernac.stages.interface import (
+    VernacStage,
+    StageContext,
+    StageAction,
+    StageOutput,
+)
+
+class ReuseModuleStage(VernacStage):
+    """
+    Reuse a previous build of the same module spec, or warm-start code
+    generation from the most similar one.
+    """
+
+    steps = 1
+
+    def __init__(
+            self,
+            title: str,
+            index: ModuleIndex,
+            min_similarity: float = 0.6,
+            reuse_exact: bool = True,
+        ):
+        self.title = title
+        self.index = index
+        self.min_similarity = min_similarity
+        self.reuse_exact = reuse_exact
+        self.searched = False
+
+    def run(
+            self,
+            context: StageContext,
+            english: str,
+            vn_name: str,
+            first_draft: str | None = None,
+        ) -> StageOutput:
+        # only the first pass starts from the index
+        if self.searched:
+            return StageAction.NEXT.out()
+
+        self.searched = True
+        py_name = replace_ext(vn_name, "py").replace("-", "_")
+        exact = self.index.lookup(english, py_name)
+
+        if exact is not None and self.reuse_exact:
+            context.log_json("reused.json", dict(key=exact["key"]))
+
+            return StageOutput(
+                action=StageAction.DONE,
+                state=dict(
+                    py_name=py_name,
+                    python=exact["python"],
+                    documentation=exact["documentation"],
+                    dependencies=exact["dependencies"],
+                ),
+            )
+
+        # a warm start from this target's previous build beats a similar spec
+        if first_draft is not None:
+            return StageAction.NEXT.out()
+
+        matches = self.index.search(english)
+
+        context.log_json(
+            "matches.json",
+            [dict(similarity=s, key=e["key"], py_name=e["py_name"]) for (s, e) in matches],
+        )
+
+        if len(matches) > 0 and matches[0][0] >= self.min_similarity:
+            (_, entry) = matches[0]
+
+            return StageAction.NEXT.out(first_draft=entry["python"])
+        else:
+            return StageAction.NEXT.out()
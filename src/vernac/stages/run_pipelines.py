@@ -1,6 +1,22 @@
-from typing import Iterable
+import math
+import time
+import base64
+import asyncio
+import itertools
+
+from typing import (
+    Awaitable,
+    Callable,
+    Iterable,
+)
+from dataclasses import asdict
+from contextlib import nullcontext
+
+from rich.markup import escape
 
 from vernac.pipeline import VernacPipeline
+from vernac.logs import read_jsonl_logs
+from vernac.work_queue import JobQueue
 from vernac.stages.interface import (
     VernacStage,
     StageContext,
@@ -13,20 +29,54 @@ from vernac.stages.all import (
     PackageStage,
     CheckHelpStage,
     CheckTestsStage,
+    CheckPerformanceStage,
+    OptimizeHotspotsStage,
     DocumentModuleStage,
+    DeriveContractStage,
+    CheckContractStage,
+    AwaitModulesStage,
+    ReuseModuleStage,
+    GenerateModuleStage,
+    RepairModulesStage,
+)
+from vernac.module_index import ModuleIndex
+from vernac.prefetch import DependencyPrefetcher
+from vernac.build_store import (
+    BuildStore,
+    get_warm_start,
+)
+from vernac.lockfile import (
+    Lockfile,
+    get_spec_hash,
+    resolve_packages,
+)
+from vernac.remote_cache import (
+    CacheClient,
+    get_cache_key,
 )
 from vernac.stages.map_modules import SourceType
+from vernac.stages.package import PackageOptions
+from vernac.stages.document_module import get_py_name
+from vernac.stages.derive_contract import (
+    get_contract_stub,
+    format_contract_documentation,
+)
+
+def read_inject(inject_path: str | None) -> str | None:
+    if inject_path is None:
+        return None
+
+    with open(inject_path) as inject_file:
+        return inject_file.read()
 
 def build_common_stages(
         source_type: SourceType,
         verbose: bool = False,
         inject_first_path: str | None = None,
+        max_prompt_tokens: int | None = None,
+        prefetcher: DependencyPrefetcher | None = None,
     ) -> list[VernacStage]:
-    if inject_first_path is None:
-        inject_first = None
-    else:
-        with open(inject_first_path) as inject_first_file:
-            inject_first = inject_first_file.read()
+    inject_first = read_inject(inject_first_path)
 
     return [
         GenerateCodeStage(
@@ -34,6 +84,8 @@ def build_common_stages(
             source_type=source_type,
             inject_first=inject_first,
             verbose=verbose,
+            max_prompt_tokens=max_prompt_tokens,
+            prefetcher=prefetcher,
         ),
         GuessDependenciesStage("Guessing dependencies"),
     ]
@@ -41,15 +93,53 @@ def build_common_stages(
 def build_module_stages(
         verbose: bool = False,
         inject_first_path: str | None = None,
+        max_prompt_tokens: int | None = None,
+        contract_first: bool = False,
+        module_index: ModuleIndex | None = None,
+        reuse_similarity: float = 0.6,
+        prefetcher: DependencyPrefetcher | None = None,
+        combine_calls: bool = False,
     ) -> list[VernacStage]:
-    stages = build_common_stages(
-        source_type=SourceType.MODULE,
-        verbose=verbose,
-        inject_first_path=inject_first_path,
-    )
-    stages += [
-        DocumentModuleStage("Documenting module"),
-    ]
+    stages = []
+
+    if module_index is not None and inject_first_path is None:
+        stages += [
+            ReuseModuleStage(
+                "Searching previous modules",
+                index=module_index,
+                min_similarity=reuse_similarity,
+                # generated code must still be checked against a fresh contract
+                reuse_exact=not contract_first,
+            ),
+        ]
+
+    if combine_calls:
+        stages += [
+            GenerateModuleStage(
+                "Generating module",
+                inject_first=read_inject(inject_first_path),
+                verbose=verbose,
+                max_prompt_tokens=max_prompt_tokens,
+                prefetcher=prefetcher,
+            ),
+        ]
+    else:
+        stages += build_common_stages(
+            source_type=SourceType.MODULE,
+            verbose=verbose,
+            inject_first_path=inject_first_path,
+            max_prompt_tokens=max_prompt_tokens,
+            prefetcher=prefetcher,
+        )
+
+    if contract_first:
+        stages += [
+            CheckContractStage("Checking contract"),
+        ]
+    elif not combine_calls:
+        stages += [
+            DocumentModuleStage("Documenting module"),
+        ]
 
     return stages
 
@@ -58,20 +148,94 @@ def build_main_stages(
         verbose: bool = False,
         inject_first_path: str | None = None,
         package_dir: str | None = None,
+        package_options: PackageOptions = PackageOptions(),
+        max_prompt_tokens: int | None = None,
+        module_tasks: dict[str, asyncio.Task] | None = None,
+        check_performance: bool = False,
+        optimize: bool = False,
+        prefetcher: DependencyPrefetcher | None = None,
+        fork_server: bool = False,
+        remote_cache: CacheClient | None = None,
+        repair_module: Callable[[str, dict], Awaitable[dict]] | None = None,
+        frozen_modules: set[str] = set(),
     ) -> list[VernacStage]:
-    stages = build_common_stages(
+    stages = []
+
+    if repair_module is not None:
+        stages += [
+            RepairModulesStage(
+                "Repairing modules",
+                repair=repair_module,
+                frozen=frozen_modules,
+            ),
+        ]
+
+    stages += build_common_stages(
         source_type=SourceType.MAIN,
         verbose=verbose,
         inject_first_path=inject_first_path,
+        max_prompt_tokens=max_prompt_tokens,
+        prefetcher=prefetcher,
+    )
+
+    if module_tasks is not None:
+        stages += [
+            AwaitModulesStage(module_tasks),
+        ]
+
+    package_stage = PackageStage(
+        "Packaging",
+        package_dir=package_dir,
+        out_path=out_path,
+        options=package_options,
+        prefetcher=prefetcher,
+        keep_sources=fork_server,
+        remote_cache=remote_cache,
     )
+    stages += [
+        package_stage,
+        CheckHelpStage("Checking --help"),
+        CheckTestsStage("Checking test output"),
+    ]
+
+    if optimize:
+        stages += [
+            OptimizeHotspotsStage("Optimizing hot spots", package=package_stage),
+        ]
+
+    if check_performance:
+        stages += [
+            CheckPerformanceStage("Checking performance"),
+        ]
+
+    return stages
+
+def build_locked_main_stages(
+        out_path: str,
+        package_dir: str | None = None,
+        package_options: PackageOptions = PackageOptions(),
+        module_tasks: dict[str, asyncio.Task] | None = None,
+        locked_packages: list[dict] | None = None,
+        wheelhouse: str | None = None,
+        remote_cache: CacheClient | None = None,
+    ) -> list[VernacStage]:
+    stages = []
+
+    if module_tasks is not None:
+        stages += [
+            AwaitModulesStage(module_tasks),
+        ]
+
     stages += [
         PackageStage(
             "Packaging",
             package_dir=package_dir,
             out_path=out_path,
+            options=package_options,
+            locked_packages=locked_packages,
+            wheelhouse=wheelhouse,
+            remote_cache=remote_cache,
         ),
-        CheckHelpStage("Checking --help"),
-        CheckTestsStage("Checking test output"),
     ]
 
     return stages
@@ -82,62 +246,592 @@ class RunPipelinesStage(VernacStage):
             out_path: str,
             injects: dict[str, str],
             package_dir: str | None = None,
+            package_options: PackageOptions = PackageOptions(),
+            max_prompt_tokens: int | None = None,
+            contract_first: bool = False,
+            check_performance: bool = False,
+            optimize: bool = False,
+            module_index: ModuleIndex | None = None,
+            reuse_similarity: float = 0.6,
+            build_store: BuildStore | None = None,
+            lock_path: str | None = None,
+            lock: Lockfile | None = None,
+            locked: bool = False,
+            wheelhouse: str | None = None,
+            prefetcher: DependencyPrefetcher | None = None,
+            fork_server: bool = False,
+            remote_cache: CacheClient | None = None,
+            combine_module_calls: bool = False,
+            module_concurrency: int | None = None,
+            job_queue: JobQueue | None = None,
         ):
         self.out_path = out_path
         self.injects = injects
         self.package_dir = package_dir
+        self.package_options = package_options
+        self.max_prompt_tokens = max_prompt_tokens
+        self.contract_first = contract_first
+        self.check_performance = check_performance
+        self.optimize = optimize
+        self.module_index = module_index
+        self.reuse_similarity = reuse_similarity
+        self.build_store = build_store
+        self.lock_path = lock_path
+        self.lock = lock
+        self.locked = locked
+        self.wheelhouse = wheelhouse
+        self.prefetcher = prefetcher
+        self.fork_server = fork_server
+        self.remote_cache = remote_cache
+        self.combine_module_calls = combine_module_calls
+        self.module_concurrency = module_concurrency
+        self.job_queue = job_queue
+        self.project = None
 
-    async def run(
+    def build_pipeline(
+            self,
+            context: StageContext,
+            name: str,
+            stages: list[VernacStage],
+            spec_name: str | None = None,
+        ) -> VernacPipeline:
+        # history follows a program's specs by name, across builds and edits
+        spec = f"{self.project}/{name if spec_name is None else spec_name}"
+
+        return VernacPipeline(
+            name,
+            stages,
+            log_sink=context.pipeline.log_sink,
+            models=context.pipeline.models,
+            verbose=context.verbose,
+            progress=context.pipeline.progress,
+            on_event=context.pipeline.on_event,
+            convergence=context.pipeline.convergence,
+            stats=context.pipeline.stats,
+            spec=spec,
+        )
+
+    def build_module_pipelines(
             self,
             context: StageContext,
-            english_all: dict[str, str],
-            main_name: str,
             module_names: list[str],
-        ) -> StageOutput:
-        # build module pipelines
+        ) -> dict[str, VernacPipeline]:
         module_pipelines: dict[str, VernacPipeline] = {}
 
         for name in module_names:
             module_stages = build_module_stages(
                 verbose=context.verbose,
                 inject_first_path=self.injects.get(name),
+                max_prompt_tokens=self.max_prompt_tokens,
+                # never regenerate injected code to fit a contract
+                contract_first=self.contract_first and name not in self.injects,
+                module_index=self.module_index,
+                reuse_similarity=self.reuse_similarity,
+                prefetcher=self.prefetcher,
+                combine_calls=self.combine_module_calls,
             )
 
-            module_pipelines[name] = VernacPipeline(
+            module_pipelines[name] = self.build_pipeline(
+                context,
                 f"module_{name}",
                 module_stages,
-                logs_base_path=context.pipeline.logs_base_path,
-                verbose=context.verbose,
             )
 
-        # run module pipelines to completion
-        modules: dict[str, dict] = {}
+        return module_pipelines
 
-        for (name, pipeline) in module_pipelines.items():
-            modules[name] = await pipeline.run(
-                dict(vn_name=name, english=english_all[name]),
+    def build_main_pipeline(
+            self,
+            context: StageContext,
+            module_tasks: dict[str, asyncio.Task] | None = None,
+            locked: bool = False,
+            locked_packages: list[dict] | None = None,
+        ) -> VernacPipeline:
+        if locked:
+            main_stages = build_locked_main_stages(
+                out_path=self.out_path,
+                package_dir=self.package_dir,
+                package_options=self.package_options,
+                module_tasks=module_tasks,
+                locked_packages=locked_packages,
+                wheelhouse=self.wheelhouse,
+                remote_cache=self.remote_cache,
             )
 
-        # build main pipeline
+            return self.build_pipeline(context, "main", main_stages)
+
         main_stages = build_main_stages(
             out_path=self.out_path,
             verbose=context.verbose,
             inject_first_path=None,
             package_dir=self.package_dir,
+            package_options=self.package_options,
+            max_prompt_tokens=self.max_prompt_tokens,
+            module_tasks=module_tasks,
+            check_performance=self.check_performance,
+            optimize=self.optimize,
+            prefetcher=self.prefetcher,
+            fork_server=self.fork_server,
+            remote_cache=self.remote_cache,
+            repair_module=self.build_module_repair(context),
+            frozen_modules=set(self.injects),
         )
-        main_pipeline = VernacPipeline(
-            "main",
-            main_stages,
-            logs_base_path=context.pipeline.logs_base_path,
-            verbose=context.verbose,
+
+        return self.build_pipeline(context, "main", main_stages)
+
+    def build_module_repair(self, context: StageContext) -> Callable[[str, dict], Awaitable[dict]]:
+        repairs = itertools.count()
+
+        async def repair_module(name: str, state: dict) -> dict:
+            module_stages = build_module_stages(
+                verbose=context.verbose,
+                max_prompt_tokens=self.max_prompt_tokens,
+                contract_first=self.contract_first,
+                # the index holds the very code being repaired
+                module_index=None,
+                prefetcher=self.prefetcher,
+                combine_calls=self.combine_module_calls,
+            )
+            pipeline = self.build_pipeline(
+                context,
+                f"repair_{next(repairs)}_{name}",
+                module_stages,
+                spec_name=f"repair_{name}",
+            )
+
+            return await pipeline.run(state)
+
+        return repair_module
+
+    async def derive_contracts(
+            self,
+            context: StageContext,
+            english_all: dict[str, str],
+            module_names: list[str],
+        ) -> dict[str, dict]:
+        derived = [n for n in module_names if n not in self.injects]
+        contracts = {}
+
+        # injected code is the contract, rather than something to hold to one
+        for name in [n for n in module_names if n in self.injects]:
+            try:
+                contract = get_contract_stub(read_inject(self.injects[name]))
+            except SyntaxError:
+                derived.append(name)
+
+                continue
+
+            contracts[name] = dict(
+                vn_name=name,
+                english=english_all[name],
+                py_name=get_py_name(name),
+                contract=contract,
+                documentation=format_contract_documentation(contract),
+            )
+
+            context.log_text(f"contracts/{name}.py", contract)
+
+        contract_pipelines = [
+            self.build_pipeline(
+                context,
+                f"contract_{name}",
+                [DeriveContractStage("Deriving contract")],
+            )
+            for name in derived
+        ]
+        contract_states = await asyncio.gather(
+            *(
+                p.run(dict(vn_name=n, english=english_all[n]))
+                for (n, p) in zip(derived, contract_pipelines)
+            )
         )
 
-        # run main pipeline to completion
-        main = await main_pipeline.run(
-            dict(
-                english=english_all[main_name],
-                modules=modules,
+        return contracts | dict(zip(derived, contract_states))
+
+    def schedule_modules(
+            self,
+            context: StageContext,
+            module_pipelines: dict[str, VernacPipeline],
+        ) -> dict[str, VernacPipeline]:
+        """
+        Order module pipelines longest first, going by past builds, so the
+        slowest ones are not left to start last.
+        """
+
+        stats = context.pipeline.stats
+
+        if stats is None:
+            return module_pipelines
+
+        estimates = {n: stats.estimate_pipeline(p.spec) for (n, p) in module_pipelines.items()}
+
+        # with no history a module might be the slowest of all
+        order = sorted(
+            module_pipelines,
+            key=lambda n: -math.inf if estimates[n] is None else -estimates[n],
+        )
+
+        context.log_json("schedule.json", [dict(name=n, estimate=estimates[n]) for n in order])
+
+        return {n: module_pipelines[n] for n in order}
+
+    async def run_module(
+            self,
+            context: StageContext,
+            name: str,
+            pipeline: VernacPipeline,
+            state: dict,
+        ) -> dict:
+        """
+        Run a module pipeline, on a worker if there is a job queue.
+        """
+
+        # injected code lives in files on this machine
+        if self.job_queue is None or name in self.injects:
+            return await pipeline.run(state)
+
+        convergence = pipeline.convergence
+        payload = dict(
+            pipeline=pipeline.name,
+            spec=pipeline.spec,
+            state=state,
+            settings=dict(
+                max_prompt_tokens=self.max_prompt_tokens,
+                contract_first=self.contract_first,
+                reuse=self.module_index is not None,
+                reuse_similarity=self.reuse_similarity,
+                combine_calls=self.combine_module_calls,
+            ),
+            convergence=None if convergence is None else asdict(convergence),
+        )
+
+        # a worker gets only what is left of the time budget once it starts
+        if convergence is not None and convergence.max_seconds is not None:
+            payload["deadline"] = time.time() + convergence.max_seconds
+
+        job_id = await asyncio.to_thread(self.job_queue.submit, "module", payload)
+
+        context.pipeline.on_event(dict(type="job_submitted", pipeline=pipeline.name, id=job_id))
+
+        result = await self.job_queue.wait(job_id)
+
+        # the worker's logs land where this pipeline's own would have
+        for (rel_path, contents) in read_jsonl_logs(base64.b64decode(result["logs"])):
+            context.pipeline.log_sink.write(rel_path, contents)
+
+        context.pipeline.models.hold(result.get("completions", {}))
+
+        return result["state"]
+
+    def limit_modules(self) -> Callable[[Awaitable[dict]], Awaitable[dict]]:
+        if self.module_concurrency is None:
+            limit = nullcontext()
+        else:
+            limit = asyncio.Semaphore(self.module_concurrency)
+
+        async def limited(run: Awaitable[dict]) -> dict:
+            async with limit:
+                return await run
+
+        return limited
+
+    def record_modules(self, modules: dict[str, dict]):
+        if self.module_index is None:
+            return
+
+        for module in modules.values():
+            self.module_index.add(
+                english=module["english"],
+                py_name=module["py_name"],
+                python=module["python"],
+                documentation=module["documentation"],
+                dependencies=module["dependencies"],
+            )
+
+    def save_build(
+            self,
+            english_all: dict[str, str],
+            main_name: str,
+            main_state: dict,
+        ):
+        if self.build_store is None:
+            return
+
+        sources = {
+            name: dict(english=english_all[name], python=module["python"])
+            for (name, module) in main_state["modules"].items()
+        }
+        sources[main_name] = dict(
+            english=english_all[main_name],
+            python=main_state["python"],
+        )
+
+        self.build_store.save(sources)
+
+    def get_locked_sources(self, english_all: dict[str, str]) -> dict[str, dict]:
+        if not self.locked or self.lock is None:
+            return {}
+
+        locked_sources = {}
+
+        for (name, english) in english_all.items():
+            source = self.lock.get_source(name, english)
+
+            if source is not None:
+                locked_sources[name] = dict(vn_name=name, english=english) | source
+
+        return locked_sources
+
+    def save_lock(
+            self,
+            context: StageContext,
+            english_all: dict[str, str],
+            main_name: str,
+            main_state: dict,
+        ):
+        if self.lock_path is None:
+            return
+
+        sources = {}
+
+        for (name, module) in main_state["modules"].items():
+            sources[name] = dict(
+                kind="module",
+                spec_sha256=get_spec_hash(english_all[name]),
+                py_name=module["py_name"],
+                python=module["python"],
+                documentation=module["documentation"],
+                dependencies=list(module["dependencies"]),
+            )
+
+        sources[main_name] = dict(
+            kind="main",
+            spec_sha256=get_spec_hash(english_all[main_name]),
+            python=main_state["python"],
+            dependencies=list(main_state["dependencies"]),
+        )
+
+        requirements = sorted({d for s in sources.values() for d in s["dependencies"]})
+
+        # re-resolve only when the requirements changed
+        if (
+            self.lock is not None
+            and self.lock.requirements == requirements
+            and self.lock.packages is not None
+        ):
+            packages = self.lock.packages
+        else:
+            try:
+                packages = resolve_packages(requirements)
+            except Exception as error:
+                # the build itself succeeded; lock its sources regardless
+                context.print(
+                    f"[yellow]warning:[/yellow] could not pin dependencies "
+                    f"in {self.lock_path}: {escape(str(error))}"
+                )
+
+                packages = None
+
+        Lockfile(sources, requirements, packages).save(self.lock_path)
+
+    def get_module_key(self, context: StageContext, name: str, english: str) -> str:
+        return get_cache_key(
+            name,
+            english,
+            self.contract_first,
+            self.combine_module_calls,
+            self.max_prompt_tokens,
+            context.pipeline.models.models,
+        )
+
+    async def get_shared_modules(
+            self,
+            context: StageContext,
+            english_all: dict[str, str],
+            module_names: list[str],
+        ) -> dict[str, dict]:
+        if self.remote_cache is None:
+            return {}
+
+        names = [n for n in module_names if n not in self.injects]
+        cached = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    self.remote_cache.get_json,
+                    "modules",
+                    self.get_module_key(context, n, english_all[n]),
+                )
+                for n in names
+            )
+        )
+
+        return {
+            name: dict(vn_name=name, english=english_all[name]) | module
+            for (name, module) in zip(names, cached)
+            if module is not None
+        }
+
+    async def share_modules(
+            self,
+            context: StageContext,
+            english_all: dict[str, str],
+            modules: dict[str, dict],
+        ):
+        if self.remote_cache is None:
+            return
+
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    self.remote_cache.put_json,
+                    "modules",
+                    self.get_module_key(context, name, english_all[name]),
+                    dict(
+                        py_name=module["py_name"],
+                        python=module["python"],
+                        documentation=module["documentation"],
+                        dependencies=list(module["dependencies"]),
+                    ),
+                )
+                for (name, module) in modules.items()
+                if name not in self.injects
+            )
+        )
+
+    async def run(
+            self,
+            context: StageContext,
+            english_all: dict[str, str],
+            main_name: str,
+            module_names: list[str],
+        ) -> StageOutput:
+        self.project = main_name
+
+        # sources whose spec matches the lockfile are not generated again
+        locked_sources = self.get_locked_sources(english_all)
+        locked_modules = {n: s for (n, s) in locked_sources.items() if n in module_names}
+        module_names = [n for n in module_names if n not in locked_sources]
+
+        # nor are modules that a teammate already built from the same spec
+        shared_modules = await self.get_shared_modules(context, english_all, module_names)
+        locked_modules |= shared_modules
+        module_names = [n for n in module_names if n not in shared_modules]
+        module_pipelines = self.build_module_pipelines(context, module_names)
+        module_pipelines = self.schedule_modules(context, module_pipelines)
+        limited = self.limit_modules()
+
+        if main_name in locked_sources:
+            main_input = dict(
+                python=locked_sources[main_name]["python"],
+                dependencies=locked_sources[main_name]["dependencies"],
             )
+        else:
+            main_input = {}
+
+        # pin packages only when every source, hence every requirement, is locked
+        if len(locked_sources) == len(english_all):
+            locked_packages = self.lock.packages
+        else:
+            locked_packages = None
+
+        context.log_json("locked.json", sorted(locked_sources))
+        context.log_json("shared.json", sorted(shared_modules))
+
+        # start each source from its code in the last accepted build
+        if self.build_store is None:
+            previous = {}
+        else:
+            previous = self.build_store.load()
+
+        def warm_start(name: str) -> dict:
+            if name in self.injects:
+                return {}
+
+            return get_warm_start(previous, name, english_all[name])
+
+        context.log_json("warm_starts.json", [n for n in english_all if warm_start(n)])
+
+        if self.contract_first:
+            # generate main and modules side by side against agreed interfaces
+            contracts = await self.derive_contracts(context, english_all, module_names)
+            module_tasks = {
+                name: asyncio.create_task(
+                    limited(
+                        self.run_module(
+                            context,
+                            name,
+                            pipeline,
+                            contracts[name] | warm_start(name),
+                        )
+                    )
+                )
+                for (name, pipeline) in module_pipelines.items()
+            }
+            modules = locked_modules | contracts
+            main_pipeline = self.build_main_pipeline(
+                context,
+                module_tasks,
+                locked=main_name in locked_sources,
+                locked_packages=locked_packages,
+            )
+
+            try:
+                main_state = await main_pipeline.run(
+                    dict(
+                        english=english_all[main_name],
+                        modules=modules,
+                        **warm_start(main_name),
+                        **main_input,
+                    )
+                )
+            finally:
+                for task in module_tasks.values():
+                    task.cancel()
+        else:
+            # run module pipelines to completion
+            module_states = await asyncio.gather(
+                *(
+                    limited(
+                        self.run_module(
+                            context,
+                            n,
+                            p,
+                            dict(vn_name=n, english=english_all[n], **warm_start(n)),
+                        )
+                    )
+                    for (n, p) in module_pipelines.items()
+                )
+            )
+            modules = locked_modules | dict(zip(module_pipelines, module_states))
+
+            # run main pipeline to completion
+            main_pipeline = self.build_main_pipeline(
+                context,
+                locked=main_name in locked_sources,
+                locked_packages=locked_packages,
+            )
+
+            main_state = await main_pipeline.run(
+                dict(
+                    english=english_all[main_name],
+                    modules=modules,
+                    **warm_start(main_name),
+                    **main_input,
+                )
+            )
+
+        # the program passed its checks, so its modules are worth reusing
+        self.record_modules(main_state["modules"])
+        self.save_build(english_all, main_name, main_state)
+        self.save_lock(context, english_all, main_name, main_state)
+
+        await self.share_modules(
+            context,
+            english_all,
+            {n: m for (n, m) in main_state["modules"].items() if n in module_names},
         )
 
-        return StageAction.NEXT.out()
+        return StageAction.NEXT.out(
+            python=main_state["python"],
+            dependencies=main_state["dependencies"],
+            modules=main_state["modules"],
+        )
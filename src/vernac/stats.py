@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import threading
+import statistics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_runs (
+    recorded_at REAL NOT NULL,
+    spec TEXT NOT NULL,
+    spec_key TEXT,
+    pipeline TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    action TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stage_runs_spec ON stage_runs (spec, stage, recorded_at);
+CREATE INDEX IF NOT EXISTS stage_runs_stage ON stage_runs (stage, recorded_at);
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    recorded_at REAL NOT NULL,
+    spec TEXT NOT NULL,
+    spec_key TEXT,
+    pipeline TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    loops INTEGER NOT NULL,
+    passed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pipeline_runs_spec ON pipeline_runs (spec, recorded_at);
+"""
+
+def median_or_none(values: list[float]) -> float | None:
+    return statistics.median(values) if len(values) > 0 else None
+
+class StatsStore:
+    """
+    Durations, token counts, loops and outcomes from past builds, for
+    estimates and scheduling.
+
+    Specs are identified by target and file name, so that history carries
+    across edits to a spec; `spec_key` records the exact spec text.
+    """
+
+    def __init__(self, path: str, history: int = 20):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.history = history
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def execute(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    def record_stage(
+            self,
+            spec: str,
+            spec_key: str | None,
+            pipeline: str,
+            stage: str,
+            seconds: float,
+            prompt_tokens: int,
+            completion_tokens: int,
+            action: str,
+        ):
+        self.execute(
+            "INSERT INTO stage_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                time.time(),
+                spec,
+                spec_key,
+                pipeline,
+                stage,
+                seconds,
+                prompt_tokens,
+                completion_tokens,
+                action,
+            ),
+        )
+
+    def record_pipeline(
+            self,
+            spec: str,
+            spec_key: str | None,
+            pipeline: str,
+            seconds: float,
+            loops: int,
+            passed: bool,
+        ):
+        self.execute(
+            "INSERT INTO pipeline_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), spec, spec_key, pipeline, seconds, loops, int(passed)),
+        )
+
+    def estimate_stage(self, spec: str, stage: str) -> tuple[float | None, int | None]:
+        """
+        Expected seconds and completion tokens for one run of a stage.
+
+        Falls back from this spec's history to that of the stage in general.
+        """
+
+        for (condition, parameters) in [
+            ("spec = ? AND stage = ?", (spec, stage)),
+            ("stage = ?", (stage,)),
+        ]:
+            rows = self.execute(
+                f"SELECT seconds, completion_tokens FROM stage_runs WHERE {condition} "
+                "ORDER BY recorded_at DESC LIMIT ?",
+                parameters + (self.history,),
+            )
+
+            if len(rows) > 0:
+                tokens = median_or_none([t for (_, t) in rows if t > 0])
+
+                return (
+                    median_or_none([s for (s, _) in rows]),
+                    None if tokens is None else round(tokens),
+                )
+
+        return (None, None)
+
+    def estimate_pipeline(self, spec: str) -> float | None:
+        rows = self.execute(
+            "SELECT seconds FROM pipeline_runs WHERE spec = ? AND passed = 1 "
+            "ORDER BY recorded_at DESC LIMIT ?",
+            (spec, self.history),
+        )
+
+        return median_or_none([s for (s,) in rows])
+
+    def get_pass_rate(self, spec: str) -> float | None:
+        rows = self.execute(
+            "SELECT passed FROM pipeline_runs WHERE spec = ? ORDER BY recorded_at DESC LIMIT ?",
+            (spec, self.history),
+        )
+
+        if len(rows) == 0:
+            return None
+
+        return sum(p for (p,) in rows) / len(rows)
+
+    def find_regression(
+            self,
+            spec: str,
+            seconds: float,
+            factor: float = 1.5,
+            min_runs: int = 3,
+        ) -> float | None:
+        """
+        Return the usual build time of a spec if `seconds` is well over it.
+        """
+
+        rows = self.execute(
+            "SELECT seconds FROM pipeline_runs WHERE spec = ? AND passed = 1 "
+            "ORDER BY recorded_at DESC LIMIT ?",
+            (spec, self.history),
+        )
+
+        if len(rows) < min_runs:
+            return None
+
+        usual = statistics.median(s for (s,) in rows)
+
+        return usual if seconds > factor * usual else None
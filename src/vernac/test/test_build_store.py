@@ -0,0 +1,20 @@
+from vernac.build_store import (
+    BuildStore,
+    get_warm_start,
+)
+
+def test_build_store_warm_start(tmp_path):
+    store = BuildStore(str(tmp_path), "/out/prog")
+
+    assert store.load() == {}
+
+    store.save({"main.vn": dict(english="print hello\n", python="print('hello')\n")})
+
+    previous = BuildStore(str(tmp_path), "/out/prog").load()
+    warm_start = get_warm_start(previous, "main.vn", "print goodbye\n")
+
+    assert warm_start["first_draft"] == "print('hello')\n"
+    assert "-print hello\n+print goodbye\n" in warm_start["spec_diff"]
+    assert get_warm_start(previous, "main.vn", "print hello\n")["spec_diff"] == ""
+    assert get_warm_start(previous, "other.vn", "print hello\n") == {}
+    assert BuildStore(str(tmp_path), "/other").load() == {}
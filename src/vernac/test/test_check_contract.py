@@ -0,0 +1,118 @@
+import pytest
+
+from rich.progress import Progress
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+)
+from vernac.pipeline import VernacPipeline
+from vernac.stages.check_contract import find_contract_mismatches
+from vernac.stages.derive_contract import (
+    DeriveContractStage,
+    get_contract_stub,
+)
+
+CONTRACT = '''\
+from dataclasses import dataclass
+
+DEFAULT_PATH: str
+
+@dataclass
+class Entry:
+    number: int
+    description: str
+
+    def toggle(self) -> None:
+        """Flip the status."""
+        ...
+
+def load(path: str = DEFAULT_PATH) -> list[Entry]:
+    """Load all entries."""
+    ...
+
+def save(entries: list[Entry], *, path: str) -> None:
+    ...
+'''
+
+GOOD = '''\
+import json
+import os.path
+
+DEFAULT_PATH = os.path.expanduser("~/.todo")
+
+class Entry:
+    def __init__(self, number, description, done=False):
+        self.number = number
+        self.description = description
+        self.done = done
+
+    def toggle(self):
+        self.done = not self.done
+
+def load(path=DEFAULT_PATH):
+    return []
+
+def save(entries, *, path, indent=2):
+    pass
+'''
+
+def test_conforming_module():
+    assert find_contract_mismatches(CONTRACT, GOOD) == []
+
+def test_mismatched_module():
+    bad = (
+        GOOD
+        .replace("def toggle(self):", "def flip(self):")
+        .replace("def load(path=DEFAULT_PATH):", "def load(path, strict):")
+        .replace("def save(entries, *, path, indent=2):\n    pass", "save = None")
+        .replace('DEFAULT_PATH = os.path.expanduser("~/.todo")', "")
+    )
+
+    assert find_contract_mismatches(CONTRACT, bad) == [
+        "`DEFAULT_PATH` is not defined",
+        "`Entry.toggle` is not defined",
+        "`load` requires more arguments than the contract allows",
+        "`save` should be a function",
+    ]
+
+def test_unparseable_module():
+    (mismatch,) = find_contract_mismatches(CONTRACT, "def (:")
+
+    assert mismatch.startswith("module does not parse")
+
+def test_unparseable_contract():
+    (mismatch,) = find_contract_mismatches("def (:", GOOD)
+
+    assert mismatch.startswith("contract does not parse")
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("completions, contract", [
+    (["def (:", CONTRACT], CONTRACT),
+    (["def (:", "def (:"], None),
+])
+async def test_derive_contract_retries(tmp_path, monkeypatch, completions, contract):
+    monkeypatch.chdir(tmp_path)
+
+    replies = iter(completions)
+
+    class ContractBackend(ChatBackend):
+        def stream_chat(self, messages, model):
+            yield f"```python\n{next(replies)}```"
+
+    pipeline = VernacPipeline(
+        "contract",
+        [DeriveContractStage("Deriving contract")],
+        models=ModelRouter(backends={"openai": ContractBackend()}),
+        progress=Progress(disable=True),
+    )
+    state = await pipeline.run(dict(vn_name="todo.vn", english="keep a todo list"))
+
+    assert state["contract"] == contract
+    assert "## Module interface" in state["documentation"]
+
+def test_contract_stub_of_existing_code():
+    stub = get_contract_stub(GOOD)
+
+    assert "..." in stub
+    assert find_contract_mismatches(stub, GOOD) == []
@@ -0,0 +1,23 @@
+import random
+
+from vernac.stages.check_performance import (
+    generate_input,
+    fit_growth_exponent,
+)
+
+def test_fit_growth_exponent():
+    sizes = [100, 200, 400, 800]
+
+    linear = fit_growth_exponent(sizes, [0.1 + n * 1e-3 for n in sizes], baseline=0.1)
+    quadratic = fit_growth_exponent(sizes, [n ** 2 * 1e-6 for n in sizes])
+
+    assert abs(linear - 1.0) < 1e-6
+    assert abs(quadratic - 2.0) < 1e-6
+    assert fit_growth_exponent([100], [1.0]) is None
+
+def test_generate_input():
+    numbers = generate_input("numbers", 10, random.Random(0)).splitlines()
+
+    assert len(numbers) == 10
+    assert all(n.lstrip(b"-").isdigit() for n in numbers)
+    assert generate_input("none", 10, random.Random(0)) == b""
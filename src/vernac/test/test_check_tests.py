@@ -0,0 +1,80 @@
+import pytest
+
+from rich.progress import Progress
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+)
+from vernac.pipeline import VernacPipeline
+from vernac.stages.interface import (
+    VernacStage,
+    StageAction,
+)
+from vernac.stages.check_tests import (
+    parse_verdicts,
+    judge_test_outputs,
+)
+
+RUNS = [
+    (["3"], "prints 3 lines", "a\nb\nc\n"),
+    (["--count", "2"], "prints 2 lines", "a\n"),
+    (["0"], "prints nothing", ""),
+]
+
+class StandInBackend(ChatBackend):
+    def __init__(self):
+        self.prompts = []
+
+    def stream_chat(self, messages, model):
+        self.prompts.append(messages)
+
+        if len(self.prompts) == 1:
+            # the third verdict is missing its problem
+            yield (
+                '```json\n[{"test": 1, "correct": true, "problem": null}, '
+                '{"test": 2, "correct": false, "problem": "prints 1 line"}, '
+                '{"test": 3, "correct": false}]\n```'
+            )
+        else:
+            yield "prints a blank line"
+
+class JudgeStage(VernacStage):
+    title = "Judging"
+    steps = 100
+
+    def run(self, context):
+        return StageAction.NEXT.out(problems=judge_test_outputs(context, "print lines", RUNS))
+
+def test_parse_verdicts():
+    assert parse_verdicts('[{"test": 1, "correct": true}]', 1) == {1: None}
+    assert parse_verdicts("the outputs look fine", 2) == {}
+    assert parse_verdicts('{"test": 1, "correct": true}', 1) == {}
+
+    verdicts = parse_verdicts(
+        '[{"test": 1, "correct": false, "problem": "no output"}, '
+        '{"test": 2, "correct": true}, {"test": 2, "correct": false, "problem": "x"}, '
+        '{"test": 9, "correct": true}, {"test": 3, "correct": false, "problem": " "}]',
+        3,
+    )
+
+    assert verdicts == {1: "no output"}
+
+@pytest.mark.asyncio
+async def test_judge_falls_back_per_test(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    backend = StandInBackend()
+    pipeline = VernacPipeline(
+        "main",
+        [JudgeStage()],
+        models=ModelRouter(backends={"openai": backend}),
+        progress=Progress(disable=True),
+    )
+    state = await pipeline.run()
+
+    assert state["problems"] == [None, "prints 1 line", "prints a blank line"]
+    # the spec went out once for the batch, and once more for the unusable verdict
+    assert len(backend.prompts) == 2
+    assert "## Test 3" in backend.prompts[0][1]["content"]
+    assert "./program 0" in backend.prompts[1][1]["content"]
@@ -0,0 +1,61 @@
+from vernac.compaction import (
+    ELIDED_MARKER,
+    truncate_middle,
+    imported_vnprog_modules,
+    elide_draft,
+    restore_elided,
+)
+
+DRAFT = '''\
+import argparse
+
+from vnprog import todo_storage
+import vnprog.formatting
+
+def load(path):
+    """Load entries."""
+    entries = []
+    with open(path) as file:
+        for line in file:
+            entries.append(line.strip())
+    return entries
+
+class Printer:
+    def show(self, entries):
+        for entry in entries:
+            print(entry)
+            print("-" * 8)
+        print("done")
+        print()
+
+def main():
+    Printer().show(load("x"))
+'''
+
+def test_truncate_middle():
+    assert truncate_middle("short", 10) == "short"
+
+    truncated = truncate_middle("a" * 100 + "b" * 100, 10)
+
+    assert truncated.startswith("a" * 20)
+    assert truncated.endswith("b" * 20)
+    assert "[160 characters omitted]" in truncated
+
+def test_imported_vnprog_modules():
+    assert imported_vnprog_modules(DRAFT) == {"todo_storage", "formatting"}
+    assert imported_vnprog_modules("def (:") is None
+
+def test_elide_and_restore():
+    (elided, bodies) = elide_draft(DRAFT, keep={"main"})
+
+    assert set(bodies) == {"load", "Printer.show"}
+    assert f"    {ELIDED_MARKER} load\n" in elided
+    assert f"        {ELIDED_MARKER} Printer.show\n" in elided
+    assert '"""Load entries."""' in elided
+    assert restore_elided(elided, bodies) == DRAFT
+
+def test_elide_keeps_named_functions():
+    (elided, bodies) = elide_draft(DRAFT, keep={"show"})
+
+    assert set(bodies) == {"load"}
+    assert 'print("done")' in elided
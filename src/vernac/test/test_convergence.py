@@ -0,0 +1,42 @@
+import pytest
+
+from vernac.stages.generate_code import TestFailure as Failure
+from vernac.convergence import (
+    ConvergencePolicy,
+    ConvergenceTracker,
+    ConvergenceError,
+    get_code_hash,
+)
+
+FAILURE = Failure(input="Ran program with `--help`.", expected="help", actual="crash")
+
+def test_get_code_hash():
+    assert get_code_hash("x = 1\n") == get_code_hash("x  =  1  # one\n")
+    assert get_code_hash("x = 1\n") != get_code_hash("x = 2\n")
+
+def test_escalate_then_fail():
+    tracker = ConvergenceTracker("main", ConvergencePolicy(max_iterations=None))
+    state = dict(python="x = 1\n", test_failures=[FAILURE])
+    changes = [tracker.loop(state) for _ in range(7)]
+
+    # the same code and failures every time escalate after two stagnant loops
+    assert "first_draft" not in changes[1]
+    assert changes[2]["first_draft"] is None
+    assert changes[4]["escalated"]
+    assert changes[6]["candidates"] == 3
+
+    with pytest.raises(ConvergenceError) as error:
+        tracker.loop(state)
+        tracker.loop(state)
+
+    assert error.value.report["escalations"] == ["fresh", "stronger_model", "candidates"]
+    assert "crash" in error.value.describe()
+
+def test_max_iterations():
+    tracker = ConvergenceTracker("main", ConvergencePolicy(max_iterations=3))
+
+    tracker.loop(dict(python="x = 1\n", test_failures=[FAILURE]))
+    tracker.loop(dict(python="x = 2\n", test_failures=[]))
+
+    with pytest.raises(ConvergenceError, match="after 3 iterations"):
+        tracker.loop(dict(python="x = 3\n", test_failures=[FAILURE, FAILURE]))
@@ -0,0 +1,61 @@
+import sys
+
+from vernac.sandbox import RunLimits
+from vernac.fork_server import (
+    ForkServer,
+    get_preload_modules,
+)
+
+MAIN = """\
+import sys
+import json
+import time
+
+def hang():
+    while True:
+        time.sleep(0.01)
+
+def main():
+    if sys.argv[1:] == ["exit"]:
+        sys.exit(3)
+    elif sys.argv[1:] == ["hang"]:
+        hang()
+
+    print(json.dumps(sys.argv[1:]))
+"""
+
+def test_get_preload_modules():
+    sources = [MAIN, "from vnprog import storage\nimport os.path\nfrom . import x\n"]
+
+    assert get_preload_modules(sources) == ["json", "os", "sys", "time"]
+
+def test_fork_server(tmp_path):
+    (tmp_path / "vnprog").mkdir()
+    (tmp_path / "vnprog" / "__init__.py").write_text("")
+    (tmp_path / "vnprog" / "main.py").write_text(MAIN)
+
+    with ForkServer([str(tmp_path)], preload=["json"]) as server:
+        first = server.run(["a", "b"])
+        second = server.run(["exit"], limits=RunLimits(timeout=4.0))
+        third = server.run(["hang"], limits=RunLimits(timeout=1.0, sample_interval=0.1))
+
+    assert (first.returncode, first.text) == (0, '["a", "b"]\n')
+    assert second.returncode == 3
+    assert third.timed_out
+    assert "main.py, line 7, in hang" in third.hot_frames
+
+def test_fork_server_target_python(tmp_path):
+    (tmp_path / "vnprog").mkdir()
+    (tmp_path / "vnprog" / "__init__.py").write_text("")
+    (tmp_path / "vnprog" / "main.py").write_text(MAIN)
+
+    # stands in for the interpreter named by --python
+    target = tmp_path / "python3"
+    target.write_text(f'#!/bin/sh\ntouch "{tmp_path}/used"\nexec "{sys.executable}" "$@"\n')
+    target.chmod(0o755)
+
+    with ForkServer([str(tmp_path)], python=str(target)) as server:
+        result = server.run(["a"])
+
+    assert (result.returncode, result.text) == (0, '["a"]\n')
+    assert (tmp_path / "used").exists()
@@ -0,0 +1,112 @@
+import pytest
+
+from rich.progress import Progress
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+)
+from vernac.pipeline import VernacPipeline
+from vernac.convergence import get_code_hash
+from vernac.stages.generate_module import (
+    GenerateModuleStage,
+    parse_sections,
+    validate_sections,
+)
+
+COMPLETION = """\
+=== CODE ===
+```python
+# DEPENDENCIES: requests
+import requests
+
+def fetch(url):
+    return requests.get(url).text
+```
+=== DEPENDENCIES ===
+requests
+"""
+
+DOCUMENTATION = """\
+=== DOCUMENTATION ===
+## Module interface
+
+`fetch(url: str) -> str`
+"""
+
+class StandInBackend(ChatBackend):
+    def __init__(self):
+        self.prompts = []
+
+    def stream_chat(self, messages, model):
+        self.prompts.append(messages)
+
+        if len(self.prompts) == 1:
+            yield COMPLETION
+        else:
+            yield DOCUMENTATION
+
+def test_parse_sections():
+    sections = parse_sections(COMPLETION + DOCUMENTATION)
+
+    assert sorted(sections) == ["code", "dependencies", "documentation"]
+    assert sections["dependencies"] == "requests"
+    assert validate_sections(sections) == {}
+    assert validate_sections(parse_sections(COMPLETION)) == dict(documentation="missing")
+    assert "code" in validate_sections(dict(code="def (", dependencies="", documentation=""))
+
+@pytest.mark.asyncio
+async def test_retry_missing_section(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    backend = StandInBackend()
+    pipeline = VernacPipeline(
+        "module",
+        [GenerateModuleStage("Generating module")],
+        models=ModelRouter(backends={"openai": backend}),
+        progress=Progress(disable=True),
+    )
+    state = await pipeline.run(dict(vn_name="fetch-page.vn", english="fetch a page"))
+
+    # the retry asks only for the missing section, given the code
+    assert len(backend.prompts) == 2
+    assert "=== CODE ===" not in backend.prompts[1][0]["content"]
+    assert "def fetch(url)" in backend.prompts[1][1]["content"]
+    assert state["py_name"] == "fetch_page.py"
+    assert state["dependencies"] == ["requests"]
+    assert state["python"].startswith("# DEPENDENCIES: requests")
+    assert state["documentation"].startswith("## Module interface")
+
+@pytest.mark.asyncio
+async def test_skip_tried_candidate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    tried = parse_sections(COMPLETION)["code"]
+    completions = iter([COMPLETION, COMPLETION.replace("fetch(url)", "fetch(url, timeout=10)")])
+    prompts = []
+
+    class CandidateBackend(ChatBackend):
+        def stream_chat(self, messages, model):
+            prompts.append(messages)
+
+            yield next(completions, DOCUMENTATION)
+
+    pipeline = VernacPipeline(
+        "module",
+        [GenerateModuleStage("Generating module")],
+        models=ModelRouter(backends={"openai": CandidateBackend()}),
+        progress=Progress(disable=True),
+    )
+    state = await pipeline.run(
+        dict(
+            vn_name="fetch-page.vn",
+            english="fetch a page",
+            candidates=3,
+            tried_hashes=[get_code_hash(tried)],
+        )
+    )
+
+    # the second candidate is shown the first, which was already tried
+    assert "# Previous attempts" in prompts[1][1]["content"]
+    assert "def fetch(url):" in prompts[1][1]["content"]
+    assert "timeout=10" in state["python"]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from vernac.llm import ChatBackend
+from vernac.hedging import (
+    LatencyPolicy,
+    GuardedBackend,
+    StallError,
+)
+
+class ScriptedBackend(ChatBackend):
+    """
+    Stream `tokens` for each request, sleeping per `delays` before each one.
+    """
+
+    def __init__(self, scripts: list[tuple[list[float], list[str]]]):
+        self.scripts = list(scripts)
+        self.requests = 0
+
+    def stream_chat(self, messages, model):
+        (delays, tokens) = self.scripts[min(self.requests, len(self.scripts) - 1)]
+        self.requests += 1
+
+        for (delay, token) in zip(delays, tokens):
+            time.sleep(delay)
+
+            yield token
+
+def test_guarded_passthrough():
+    inner = ScriptedBackend([([0, 0], ["a", "b"])])
+    backend = GuardedBackend(inner)
+
+    assert backend.complete_chat([], "m") == "ab"
+
+def test_guarded_retries_stall():
+    inner = ScriptedBackend([
+        ([0, 5.0], ["x", "y"]),
+        ([0, 0], ["a", "b"]),
+    ])
+    backend = GuardedBackend(inner, LatencyPolicy(stall_timeout=0.2, retries=1))
+
+    assert backend.complete_chat([], "m") == "ab"
+    assert inner.requests == 2
+
+def test_guarded_gives_up():
+    inner = ScriptedBackend([([5.0], ["x"])])
+    backend = GuardedBackend(inner, LatencyPolicy(ttft_timeout=0.1, retries=1))
+
+    with pytest.raises(StallError):
+        backend.complete_chat([], "m")
+
+def test_guarded_hedges_slow_first_token():
+    inner = ScriptedBackend([([0.0], ["a"])])
+    policy = LatencyPolicy(
+        hedge=True,
+        hedge_min_samples=4,
+        max_hedge_ratio=1.0,
+    )
+    backend = GuardedBackend(inner, policy)
+
+    for _ in range(4):
+        backend.complete_chat([], "m")
+
+    inner.scripts = [([2.0], ["slow"]), ([0.0], ["fast"])]
+    inner.requests = 0
+
+    assert backend.complete_chat([], "m") == "fast"
+    assert backend.hedges == 1
+
+def test_guarded_releases_hung_hedge():
+    inner = ScriptedBackend([([0.0], ["a"])])
+    policy = LatencyPolicy(
+        hedge=True,
+        hedge_min_samples=4,
+        max_hedge_ratio=1.0,
+        max_concurrent_hedges=1,
+    )
+    backend = GuardedBackend(inner, policy)
+
+    for _ in range(4):
+        backend.complete_chat([], "m")
+
+    inner.scripts = [([0.3], ["first"]), ([5.0], ["hung"])]
+    inner.requests = 0
+
+    assert backend.complete_chat([], "m") == "first"
+    assert backend.hedges == 1
+    # the losing hedge is still stuck, but its slot is free for the next request
+    assert backend._hedge_slots.acquire(blocking=False)
@@ -0,0 +1,82 @@
+import pytest
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+    parse_model_override,
+)
+
+class EchoBackend(ChatBackend):
+    def __init__(self, name: str):
+        self.name = name
+
+    def stream_chat(self, messages, model):
+        yield from [self.name, ":", model]
+
+def test_complete_chat_reports_tokens():
+    tokens = []
+    completion = EchoBackend("x").complete_chat([], "m", on_token=tokens.append)
+
+    assert completion == "x:m"
+    assert tokens == [0, 1, 2]
+
+def test_model_router():
+    router = ModelRouter(
+        backends=dict(openai=EchoBackend("openai"), local=EchoBackend("local")),
+        models=dict(classify="local:llama3:8b", judge_tests="gpt-3.5-turbo"),
+    )
+
+    assert router.complete_chat("classify", []) == "local:llama3:8b"
+    assert router.complete_chat("judge_tests", []) == "openai:gpt-3.5-turbo"
+    assert router.complete_chat("generate", []) == "openai:gpt-4"
+    assert router.complete_chat("unknown_role", []) == "openai:gpt-4"
+
+def test_model_router_from_config(tmp_path):
+    config_path = tmp_path / "models.toml"
+    config_path.write_text(
+        '[backends.local]\n'
+        'api_base = "http://localhost:8000/v1"\n'
+        '\n'
+        '[models]\n'
+        'dependencies = "local:qwen"\n'
+    )
+    router = ModelRouter.from_config(
+        str(config_path),
+        overrides=["generate=gpt-4-turbo"],
+    )
+    (backend, model) = router.route("dependencies")
+
+    assert backend.api_base == "http://localhost:8000/v1"
+    assert model == "qwen"
+    assert router.route("generate")[1] == "gpt-4-turbo"
+
+@pytest.mark.parametrize("override", ["generate", "generate=", "genrate=gpt-4"])
+def test_bad_model_override(override):
+    with pytest.raises(ValueError):
+        parse_model_override(override)
+
+    assert parse_model_override("classify=local:llama3:8b") == ("classify", "local:llama3:8b")
+
+def test_buffered_router_publishes_on_request():
+    class DictCache:
+        def __init__(self):
+            self.entries = {}
+
+        def get(self, namespace, key):
+            return self.entries.get((namespace, key))
+
+        def put(self, namespace, key, value):
+            self.entries[(namespace, key)] = value
+
+    cache = DictCache()
+    router = ModelRouter(backends=dict(openai=EchoBackend("openai")), cache=cache)
+    build = router.buffered()
+
+    assert build.complete_chat("generate", []) == "openai:gpt-4"
+    assert build.complete_chat("generate", []) == "openai:gpt-4"
+    # a build that fails never publishes what it generated
+    assert cache.entries == {}
+
+    build.publish()
+
+    assert list(cache.entries.values()) == [b"openai:gpt-4"]
@@ -0,0 +1,63 @@
+from vernac import lockfile
+from vernac.lockfile import (
+    Lockfile,
+    get_spec_hash,
+    get_pinned_requirements,
+    get_release_hashes,
+)
+
+def test_lockfile_round_trip(tmp_path):
+    path = str(tmp_path / "vernac.lock")
+    source = dict(
+        kind="main",
+        spec_sha256=get_spec_hash("print hello\n"),
+        python='def main():\n    print("hello \\"world\\"")\n',
+        dependencies=["requests"],
+    )
+    package = dict(name="requests", version="2.31.0", hashes=["ab" * 32, "cd" * 32])
+
+    assert Lockfile.load(path) is None
+
+    Lockfile({"main.vn": source}, ["requests"], [package]).save(path)
+
+    lock = Lockfile.load(path)
+
+    assert lock.get_source("main.vn", "print hello\n") == source
+    assert lock.get_source("main.vn", "print goodbye\n") is None
+    assert lock.requirements == ["requests"]
+    assert get_pinned_requirements(lock.packages) == (
+        f"requests==2.31.0 --hash=sha256:{'ab' * 32} --hash=sha256:{'cd' * 32}\n"
+    )
+
+def test_lockfile_without_packages(tmp_path):
+    path = str(tmp_path / "vernac.lock")
+
+    Lockfile({}, ["requests"], None).save(path)
+
+    assert Lockfile.load(path).packages is None
+
+def test_release_hashes_from_simple_index(monkeypatch):
+    class SimplePage:
+        status_code = 200
+        headers = {"content-type": "text/html"}
+        text = (
+            f'<a href="../../packages/tomli_w-1.0.0-py3-none-any.whl#sha256={"ab" * 32}">x</a>\n'
+            f'<a href="../../packages/tomli_w-1.0.0.tar.gz#sha256={"cd" * 32}">x</a>\n'
+            f'<a href="../../packages/tomli_w-1.0.1.tar.gz#sha256={"ef" * 32}">x</a>\n'
+        )
+
+        def raise_for_status(self):
+            pass
+
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+
+        return SimplePage()
+
+    monkeypatch.setattr(lockfile.requests, "get", get)
+
+    assert get_release_hashes("https://mirror.example/simple/", "Tomli.W", "1.0.0") == ["ab" * 32, "cd" * 32]
+    assert urls == ["https://mirror.example/simple/tomli-w/"]
+    assert get_release_hashes("file:///srv/wheels", "tomli-w", "1.0.0") == []
@@ -0,0 +1,80 @@
+import os
+import os.path
+import json
+import gzip
+import tarfile
+
+import pytest
+
+from vernac.logs import (
+    LogFormat,
+    LogSink,
+    prune_logs,
+)
+
+def test_log_sink_directory(tmp_path):
+    with LogSink(root=str(tmp_path)) as sink:
+        sink.write("main/00_generating_code/code.py", b"print()\n")
+
+    with open(os.path.join(sink.path, "main/00_generating_code/code.py"), "rb") as file:
+        assert file.read() == b"print()\n"
+
+def test_log_sink_tar(tmp_path):
+    with LogSink(root=str(tmp_path), format=LogFormat.TAR) as sink:
+        sink.write("main/prompt.json", b"[]")
+
+    with tarfile.open(sink.path) as archive:
+        (member,) = archive.getmembers()
+
+        assert member.name.endswith("/main/prompt.json")
+        assert archive.extractfile(member).read() == b"[]"
+
+def test_log_sink_jsonl(tmp_path):
+    with LogSink(root=str(tmp_path), format=LogFormat.JSONL) as sink:
+        sink.write("a.txt", b"text")
+        sink.write("b.bin", b"\xff\xfe")
+
+    with gzip.open(sink.path, "rt") as file:
+        records = [json.loads(l) for l in file]
+
+    assert records == [
+        dict(path="a.txt", text="text"),
+        dict(path="b.bin", base64="//4="),
+    ]
+
+LOG_NAMES = [
+    "20240101000001-0000000a",
+    "20240101000002-0000000b.tar.gz",
+    "20240101000003-0000000c",
+]
+
+@pytest.mark.parametrize("keep, max_bytes, expected", [
+    (None, None, LOG_NAMES),
+    (2, None, LOG_NAMES[1:]),
+    (None, 25, LOG_NAMES[1:]),
+    (1, 5, LOG_NAMES[2:]),
+])
+def test_prune_logs(tmp_path, keep, max_bytes, expected):
+    for name in LOG_NAMES:
+        if name.endswith(".tar.gz"):
+            path = os.path.join(tmp_path, name)
+        else:
+            os.makedirs(os.path.join(tmp_path, name))
+
+            path = os.path.join(tmp_path, name, "log.txt")
+
+        with open(path, "w") as file:
+            file.write("x" * 10)
+
+    # a log root may be shared with files that are not logs
+    with open(os.path.join(tmp_path, "main.vn"), "w") as file:
+        file.write("x" * 100)
+
+    prune_logs(
+        str(tmp_path),
+        keep=keep,
+        max_bytes=max_bytes,
+        protect=os.path.join(tmp_path, LOG_NAMES[2]),
+    )
+
+    assert sorted(os.listdir(tmp_path)) == sorted(expected + ["main.vn"])
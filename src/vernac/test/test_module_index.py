@@ -0,0 +1,24 @@
+from vernac.module_index import ModuleIndex
+
+STORAGE = "Store todo entries as JSON in a file in the home directory."
+FETCHER = "Fetch a URL over HTTP and return the response body, retrying on errors."
+
+def test_module_index(tmp_path):
+    path = str(tmp_path / "modules.jsonl")
+    index = ModuleIndex(path)
+
+    assert index.search(STORAGE) == []
+
+    index.add(STORAGE, "storage.py", "import json\n", "docs", [])
+    index.add(FETCHER, "fetch.py", "import requests\n", "docs", ["requests"])
+
+    # entries survive a reload
+    index = ModuleIndex(path)
+
+    assert index.lookup(f"  {STORAGE}\n\n", "storage.py")["python"] == "import json\n"
+    assert index.lookup(STORAGE, "other.py") is None
+
+    ((similarity, entry),) = index.search("Store notes as JSON in a file.")
+
+    assert entry["py_name"] == "storage.py"
+    assert 0 < similarity < 1
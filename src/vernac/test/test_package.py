@@ -0,0 +1,74 @@
+import os.path
+import sys
+import subprocess
+import zipfile
+
+from vernac.stages.package import (
+    ENV_ROOT_VARIABLE,
+    SHARED_MAIN,
+    PackageOptions,
+    compile_pyc,
+    zipapp_package,
+    get_shared_env_key,
+)
+
+def test_compile_pyc_syntax_error():
+    assert compile_pyc("def (:\n", "broken.py") is None
+
+def test_zipapp_package(tmp_path):
+    out_path = os.path.join(tmp_path, "prog")
+    py_files = {
+        "main.py": "from vnprog import helper\n\ndef main():\n    print(helper.answer())\n",
+        "helper.py": "def answer():\n    return 42\n",
+    }
+
+    zipapp_package(py_files, out_path)
+
+    with zipfile.ZipFile(out_path) as archive:
+        names = set(archive.namelist())
+
+    assert {"__main__.py", "vnprog/main.py", "vnprog/main.pyc", "vnprog/helper.pyc"} <= names
+    assert subprocess.check_output([out_path]) == b"42\n"
+
+def test_zipapp_package_target_python(tmp_path):
+    out_path = os.path.join(tmp_path, "prog")
+    py_files = {"main.py": "def main():\n    print(42)\n"}
+
+    zipapp_package(py_files, out_path, python=sys.executable)
+
+    with zipfile.ZipFile(out_path) as archive:
+        assert "vnprog/main.pyc" in archive.namelist()
+
+    assert subprocess.check_output([out_path]) == b"42\n"
+
+    # pycs the target would ignore are left out
+    zipapp_package(py_files, out_path, python="/nonexistent/python3")
+
+    with zipfile.ZipFile(out_path) as archive:
+        assert not any(n.endswith(".pyc") for n in archive.namelist())
+
+def test_shared_env_launcher(tmp_path):
+    options = PackageOptions()
+    env_key = get_shared_env_key(["rich", "requests", "rich"], None, options)
+    env_path = tmp_path / "envs" / env_key
+    out_path = os.path.join(tmp_path, "prog")
+    py_files = {"main.py": "import shared_dep\n\ndef main():\n    print(shared_dep.VALUE)\n"}
+
+    assert env_key == get_shared_env_key(["requests", "rich"], None, options)
+    assert env_key != get_shared_env_key(["requests"], None, options)
+
+    env_path.mkdir(parents=True)
+    (env_path / "shared_dep.py").write_text("VALUE = 7\n")
+
+    main_source = SHARED_MAIN.format(
+        variable=ENV_ROOT_VARIABLE,
+        env_root="/nonexistent",
+        env_key=env_key,
+    )
+
+    zipapp_package(py_files, out_path, main_source=main_source)
+
+    env = dict(os.environ, **{ENV_ROOT_VARIABLE: str(tmp_path / "envs")})
+
+    assert subprocess.check_output([out_path], env=env) == b"7\n"
+    assert subprocess.run([out_path], capture_output=True).returncode == 1
@@ -0,0 +1,62 @@
+import threading
+import subprocess
+
+from vernac.prefetch import (
+    DependencyPrefetcher,
+    parse_dependencies_header,
+)
+
+def test_parse_dependencies_header():
+    assert parse_dependencies_header("```python\n# DEPENDENCIES: requests, ri") is None
+    assert parse_dependencies_header("```python\n# DEPENDENCIES: requests, rich\nimport") == ["requests", "rich"]
+    assert parse_dependencies_header("# Dependencies: none\n") == []
+    assert parse_dependencies_header("# DEPENDENCIES: json vnprog.storage\n") == []
+
+def test_wait_for_own_requirements(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def run(args, **kwargs):
+        if args[-1] == "slow":
+            release.wait()
+
+    monkeypatch.setattr(subprocess, "run", run)
+
+    prefetcher = DependencyPrefetcher(str(tmp_path))
+
+    prefetcher.prefetch(["slow"])
+    # another build's download does not hold this one up
+    prefetcher.wait(["rich"])
+
+    release.set()
+    prefetcher.wait()
+
+    assert prefetcher.failed == set()
+    assert prefetcher._done == {}
+
+def test_retry_failed_requirement(tmp_path, monkeypatch):
+    attempts = []
+
+    def run(args, **kwargs):
+        attempts.append(args[-1])
+
+        if len(attempts) == 1:
+            raise subprocess.CalledProcessError(1, args)
+
+    monkeypatch.setattr(subprocess, "run", run)
+
+    prefetcher = DependencyPrefetcher(str(tmp_path))
+
+    prefetcher.prefetch(["flaky"])
+    prefetcher.wait(["flaky"])
+
+    assert prefetcher.failed == {"flaky"}
+    assert prefetcher.requested == set()
+
+    # a later build asks again and this time the wheel builds
+    prefetcher.prefetch(["flaky"])
+    prefetcher.wait(["flaky"])
+
+    assert attempts == ["flaky", "flaky"]
+    assert prefetcher.failed == set()
+    assert prefetcher.requested == {"flaky"}
+    assert prefetcher._done == {}
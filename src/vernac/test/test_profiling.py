@@ -0,0 +1,75 @@
+import sys
+
+from vernac.sandbox import run_sandboxed
+from vernac.profiling import (
+    Profiler,
+    find_hotspots,
+    splice_functions,
+)
+
+SLOW_MAIN = """\
+def build(n):
+    text = ""
+
+    for i in range(n):
+        text += str(i)
+
+    return text
+
+def slow_sum(n):
+    return sum([len(build(i)) for i in range(n)])
+
+def fast():
+    return 1
+
+if __name__ == "__main__":
+    print(slow_sum(400), fast())
+"""
+
+def test_profiler_finds_generated_hotspots(tmp_path):
+    (tmp_path / "vnprog").mkdir()
+    main_path = tmp_path / "vnprog" / "main.py"
+    main_path.write_text(SLOW_MAIN)
+
+    with Profiler() as profiler:
+        result = run_sandboxed([sys.executable, str(main_path)], env=profiler.get_env())
+        stats = profiler.load()
+
+    assert not result.failed
+    assert stats is not None
+
+    hotspots = find_hotspots(stats, {"main.py": SLOW_MAIN}, top=2)
+
+    assert [h.qualname for h in hotspots] == ["build", "slow_sum"]
+    assert hotspots[0].calls == 400
+    assert (hotspots[0].start, hotspots[0].end) == (1, 7)
+    assert 0 < hotspots[0].share <= 1
+
+def test_splice_functions():
+    python = (
+        "import os\n\n"
+        "class Store:\n"
+        "    def load(self):\n"
+        "        return [l for l in open(os.devnull)]\n\n"
+        "    def save(self):\n"
+        "        pass\n"
+    )
+    rewritten = (
+        "from functools import cache\n\n"
+        "class Store:\n"
+        "    @cache\n"
+        "    def load(self):\n"
+        "        return []\n"
+    )
+    spliced = splice_functions(python, rewritten, ["Store.load", "Store.missing"])
+
+    assert spliced == (
+        "import os\n"
+        "from functools import cache\n\n"
+        "class Store:\n"
+        "    @cache\n"
+        "    def load(self):\n"
+        "        return []\n\n"
+        "    def save(self):\n"
+        "        pass\n"
+    )
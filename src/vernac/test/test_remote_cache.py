@@ -0,0 +1,36 @@
+import os
+import asyncio
+
+import pytest
+
+from vernac.cache_server import CacheServer
+from vernac.remote_cache import (
+    CacheClient,
+    CacheMode,
+    get_cache_key,
+)
+
+@pytest.mark.asyncio
+async def test_remote_cache(tmp_path):
+    server = await CacheServer(str(tmp_path)).serve(port=0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    client = CacheClient(url)
+    reader = CacheClient(url, mode=CacheMode.READ_ONLY)
+    key = get_cache_key("completion", [dict(role="user", content="hi")])
+    other_key = get_cache_key("completion", [dict(role="user", content="bye")])
+
+    async with server:
+        assert await asyncio.to_thread(client.get, "completions", key) is None
+
+        await asyncio.to_thread(client.put, "completions", key, b"hello")
+        await asyncio.to_thread(reader.put, "completions", other_key, b"goodbye")
+
+        assert await asyncio.to_thread(reader.get, "completions", key) == b"hello"
+        assert await asyncio.to_thread(client.get, "completions", other_key) is None
+
+        # entries corrupted at rest read as misses
+        with open(os.path.join(tmp_path, "completions", key[:2], key), "wb") as entry_file:
+            entry_file.write(b"jello")
+
+        assert await asyncio.to_thread(client.get, "completions", key) is None
+        assert (reader.hits, client.misses) == (1, 3)
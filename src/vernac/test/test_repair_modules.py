@@ -0,0 +1,38 @@
+from vernac.stages.generate_code import TestFailure as Failure
+from vernac.stages.repair_modules import (
+    attribute_failure,
+    get_interface,
+)
+
+MODULES = {
+    "todo-storage.vn": dict(py_name="todo_storage.py"),
+    "todo-tui.vn": dict(py_name="todo_tui.py"),
+}
+
+TRACEBACK = """\
+Traceback (most recent call last):
+  File "/root/.shiv/prog_1234/site-packages/vnprog/main.py", line 12, in main
+    entries = todo_storage.load()
+  File "/root/.shiv/prog_1234/site-packages/vnprog/todo_storage.py", line 8, in load
+    return json.load(file)
+  File "/usr/lib/python3.11/json/__init__.py", line 293, in load
+    return loads(fp.read(),
+json.decoder.JSONDecodeError: Expecting value: line 1 column 1 (char 0)
+
+<exit code 1>"""
+
+def test_attribute_failure():
+    def attribute(actual: str) -> str | None:
+        return attribute_failure(Failure(input="", expected="", actual=actual), MODULES)
+
+    assert attribute(TRACEBACK) == "todo-storage.vn"
+    assert attribute(TRACEBACK.replace("todo_storage.py", "main.py")) is None
+    assert attribute("printed the wrong greeting") is None
+
+def test_get_interface():
+    before = "def load(path='x'):\n    return []\n\nclass Entry:\n    def toggle(self): pass\n"
+    fixed = "import json\n\ndef load(path='x'):\n    return json.load(open(path))\n\nclass Entry:\n    def toggle(self): pass\n    def _cache(self): pass\n"
+    changed = "def load(path, strict=False):\n    return []\n\nclass Entry:\n    def toggle(self): pass\n"
+
+    assert get_interface(before) == get_interface(fixed)
+    assert get_interface(before) != get_interface(changed)
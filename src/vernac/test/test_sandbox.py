@@ -0,0 +1,63 @@
+import sys
+
+from vernac.sandbox import (
+    RunLimits,
+    OutputCapture,
+    run_sandboxed,
+)
+
+def run_python(source: str, **limits):
+    return run_sandboxed([sys.executable, "-c", source], RunLimits(**limits))
+
+def test_output_capture():
+    capture = OutputCapture(8)
+
+    for _ in range(100):
+        capture.write(b"abcdef")
+
+    value = capture.getvalue()
+
+    assert value.startswith(b"abcd")
+    assert value.endswith(b"cdef")
+    assert b"[592 bytes omitted]" in value
+
+def test_run_sandboxed_success():
+    result = run_python("import os; print(os.getcwd() == os.environ['HOME'])")
+
+    assert not result.failed
+    assert result.text == "True\n"
+
+def test_run_sandboxed_exit_code():
+    result = run_python("raise SystemExit(3)")
+
+    assert result.failed
+    assert result.describe().endswith("<exit code 3>")
+
+def test_run_sandboxed_limits():
+    result = run_python("import resource; print(resource.getrlimit(resource.RLIMIT_CPU))", cpu_seconds=7)
+
+    assert result.text == "(7, 7)\n"
+    assert run_sandboxed(["/nonexistent/program"]).returncode == 127
+
+def test_run_sandboxed_timeout():
+    result = run_python("import time; time.sleep(60)", timeout=0.5)
+
+    assert result.timed_out
+    assert "timed out" in result.describe()
+
+def test_run_sandboxed_output_cap():
+    result = run_python(
+        "while True: print('spam')",
+        max_output_bytes=100,
+        kill_output_bytes=10_000,
+    )
+
+    assert result.output_exceeded
+    assert len(result.output) < 200
+
+def test_run_sandboxed_samples_stacks():
+    source = "import time\ndef spin():\n    while True:\n        time.sleep(0.01)\nspin()\n"
+    result = run_python(source, timeout=1.0, sample_interval=0.1)
+
+    assert result.timed_out
+    assert "line 4, in spin" in result.hot_frames.splitlines()[1]
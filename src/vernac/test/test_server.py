@@ -0,0 +1,101 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+)
+from vernac.api import Compiler
+from vernac.server import BuildServer
+
+PROGRAM = """\
+```python
+# DEPENDENCIES: none
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name")
+    print(f"hello {parser.parse_args().name}")
+```
+"""
+
+class StandInBackend(ChatBackend):
+    def stream_chat(self, messages, model):
+        if "Respond with Python 3 source code" in messages[0]["content"]:
+            yield from PROGRAM.splitlines(keepends=True)
+        else:
+            yield ""
+
+async def request(port: int, method: str, path: str, body: dict | None = None) -> bytes:
+    (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    payload = b"" if body is None else json.dumps(body).encode()
+
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+        + payload
+    )
+
+    response = await reader.read()
+
+    writer.close()
+
+    return response.partition(b"\r\n\r\n")[2]
+
+@pytest.mark.asyncio
+async def test_build_server(tmp_path):
+    compiler = Compiler(
+        models=ModelRouter(backends={"openai": StandInBackend()}),
+        cache_dir=str(tmp_path),
+        prefetch=False,
+    )
+    build_server = BuildServer(compiler, workers=2)
+    server = await build_server.serve(port=0)
+    port = server.sockets[0].getsockname()[1]
+    options = dict(reuse=False)
+
+    async with server:
+        jobs = [
+            json.loads(await request(port, "POST", "/builds", dict(specs={"hi.vn": "say hi"}, options=options)))
+            for _ in range(3)
+        ]
+        events = await request(port, "GET", f"/builds/{jobs[0]['id']}/events")
+        events = [json.loads(l) for l in events.splitlines()]
+
+        assert events[0]["type"] == "job_queued"
+        assert events[-1] == dict(type="job_finished", id=jobs[0]["id"], status="succeeded")
+        assert any(e["type"] == "stage_finished" and e["stage"] == "Packaging" for e in events)
+
+        artifact = await request(port, "GET", f"/builds/{jobs[0]['id']}/artifact")
+
+        assert artifact.startswith(b"#!")
+        assert b"unsupported options" in await request(port, "POST", "/builds", dict(specs={}, options=dict(log_root="/")))
+        assert b"unsupported options" in await request(port, "POST", "/builds", dict(specs={}, options=dict(python="/bin/sh")))
+
+        for job in jobs[1:]:
+            await request(port, "GET", f"/builds/{job['id']}/events")
+
+        assert all(j.status == "succeeded" for j in build_server.jobs.values())
+        # builds starting together must not share a log
+        assert len({j.result.log_path for j in build_server.jobs.values()}) == len(jobs)
+        # builds of the same specs warm-start from one store, not one per temporary output
+        assert len(os.listdir(tmp_path / "builds")) == 1
+
+    await build_server.stop()
+
+@pytest.mark.asyncio
+async def test_build_server_body_limit(tmp_path):
+    compiler = Compiler(cache_dir=str(tmp_path), prefetch=False)
+    build_server = BuildServer(compiler, max_body_bytes=16)
+    server = await build_server.serve(port=0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        response = await request(port, "POST", "/builds", dict(specs={"hi.vn": "say hi"}))
+
+        assert b"request body over 16 bytes" in response
+
+    await build_server.stop()
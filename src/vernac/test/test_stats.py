@@ -0,0 +1,59 @@
+import asyncio
+
+from vernac.stats import StatsStore
+from vernac.pipeline import VernacPipeline
+from vernac.logs import LogSink
+from vernac.stages.interface import (
+    VernacStage,
+    StageAction,
+    StageOutput,
+)
+
+class LoopOnceStage(VernacStage):
+    title = "Looping once"
+    steps = 1
+
+    def run(self, looped: bool = False):
+        if looped:
+            return StageAction.NEXT.out()
+
+        return StageOutput(StageAction.LOOP, dict(looped=True))
+
+def test_stats_estimates_and_regressions(tmp_path):
+    stats = StatsStore(str(tmp_path / "stats.sqlite3"))
+
+    assert stats.estimate_stage("prog/main", "Generating code") == (None, None)
+    assert stats.estimate_pipeline("prog/main") is None
+
+    for seconds in [10.0, 12.0, 11.0]:
+        stats.record_stage("prog/main", None, "main", "Generating code", seconds, 500, 300, "next")
+        stats.record_pipeline("prog/main", None, "main", seconds * 2, loops=0, passed=True)
+
+    stats.record_pipeline("prog/main", None, "main", 500.0, loops=5, passed=False)
+
+    assert stats.estimate_stage("prog/main", "Generating code") == (11.0, 300)
+    # other specs fall back to how long the stage takes in general
+    assert stats.estimate_stage("prog/other", "Generating code") == (11.0, 300)
+    assert stats.estimate_pipeline("prog/main") == 22.0
+    assert stats.get_pass_rate("prog/main") == 0.75
+    assert stats.find_regression("prog/main", 30.0) is None
+    assert stats.find_regression("prog/main", 40.0) == 22.0
+    assert stats.find_regression("prog/other", 40.0) is None
+
+def test_pipeline_records_stats(tmp_path):
+    stats = StatsStore(str(tmp_path / "stats.sqlite3"))
+    pipeline = VernacPipeline(
+        "main",
+        [LoopOnceStage()],
+        log_sink=LogSink(root=str(tmp_path / "logs")),
+        stats=stats,
+        spec="prog/main",
+    )
+
+    with pipeline.log_sink:
+        asyncio.run(pipeline.run())
+
+    runs = stats.execute("SELECT stage, action FROM stage_runs ORDER BY recorded_at")
+
+    assert runs == [("Looping once", "loop"), ("Looping once", "next")]
+    assert stats.execute("SELECT loops, passed FROM pipeline_runs") == [(1, 1)]
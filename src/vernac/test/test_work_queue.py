@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from vernac.llm import (
+    ChatBackend,
+    ModelRouter,
+)
+from vernac.api import (
+    BuildOptions,
+    Compiler,
+)
+from vernac.logs import read_jsonl_logs
+from vernac.work_queue import (
+    JobStatus,
+    JobFailedError,
+    SqliteJobQueue,
+)
+from vernac.distributed import (
+    BuildWorker,
+    BuildCoordinator,
+    batch_main,
+    decode_bytes,
+)
+
+MODULE_COMPLETION = """\
+=== CODE ===
+```python
+def add(a, b):
+    return a + b
+```
+=== DEPENDENCIES ===
+=== DOCUMENTATION ===
+## Module interface
+
+`add(a, b)`
+"""
+
+PROGRAM = """\
+```python
+# DEPENDENCIES: none
+def main():
+    print("hi")
+```
+"""
+
+class StandInBackend(ChatBackend):
+    def stream_chat(self, messages, model):
+        if "Respond with Python 3 source code" in messages[0]["content"]:
+            yield PROGRAM
+        elif "module" in messages[0]["content"]:
+            yield MODULE_COMPLETION
+        else:
+            yield ""
+
+def test_leases_and_retries(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"), max_attempts=2)
+    low = queue.submit("build", dict(n=1))
+    high = queue.submit("build", dict(n=2), priority=5)
+
+    assert queue.claim("a", lease_seconds=60).id == high
+
+    job = queue.claim("b", lease_seconds=0.05)
+
+    assert (job.id, job.payload, job.attempts) == (low, dict(n=1), 1)
+    assert queue.claim("c", lease_seconds=60) is None
+
+    # b goes quiet, so its job passes to c and b's late result is ignored
+    time.sleep(0.1)
+
+    assert queue.claim("c", lease_seconds=0.05).id == low
+    assert not queue.renew(low, "b", lease_seconds=60)
+    assert not queue.finish(low, "b", result=dict(stale=True))
+
+    time.sleep(0.1)
+
+    assert queue.claim("d", lease_seconds=60) is None
+    assert queue.get(low).status == JobStatus.FAILED
+    assert queue.get(low).error == "lost its worker 2 times"
+    assert queue.finish(high, "a", result=dict(ok=True))
+    assert queue.get(high).result == dict(ok=True)
+
+@pytest.mark.asyncio
+async def test_worker_runs_module_job(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"))
+    compiler = Compiler(
+        models=ModelRouter(backends={"openai": StandInBackend()}),
+        cache_dir=str(tmp_path / "cache"),
+        prefetch=False,
+    )
+    worker = BuildWorker(queue, compiler, name="w")
+    job_id = queue.submit(
+        "module",
+        dict(
+            pipeline="module_add.vn",
+            spec="main.vn/module_add.vn",
+            state=dict(vn_name="add.vn", english="add two numbers"),
+            settings=dict(
+                max_prompt_tokens=None,
+                contract_first=False,
+                reuse=False,
+                reuse_similarity=0.6,
+                combine_calls=True,
+            ),
+            convergence=None,
+        ),
+    )
+    broken_id = queue.submit("unknown", {})
+
+    assert await worker.work_once()
+    assert await worker.work_once()
+    assert not await worker.work_once()
+
+    result = await queue.wait(job_id)
+    log_paths = [p for (p, _) in read_jsonl_logs(decode_bytes(result["logs"]))]
+
+    assert result["state"]["py_name"] == "add.py"
+    assert "def add(a, b)" in result["state"]["python"]
+    assert any(p.startswith("module_add.vn/") for p in log_paths)
+
+    with pytest.raises(JobFailedError, match="unknown job kind"):
+        await queue.wait(broken_id)
+
+@pytest.mark.asyncio
+async def test_coordinator_runs_build_job(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / "queue.sqlite3"))
+    compiler = Compiler(
+        models=ModelRouter(backends={"openai": StandInBackend()}),
+        cache_dir=str(tmp_path / "cache"),
+        prefetch=False,
+    )
+    worker = asyncio.create_task(BuildWorker(queue, compiler, poll_interval=0.05).work())
+    coordinator = BuildCoordinator(queue, log_root=str(tmp_path / "logs"))
+
+    try:
+        # the coordinator's interpreter path means nothing on a worker
+        result = await coordinator.compile(
+            {"hi.vn": "say hi"},
+            BuildOptions(python="/nonexistent/python3", reuse=False),
+        )
+    finally:
+        worker.cancel()
+
+    assert result.artifact.startswith(b"#!/usr/bin/env python3")
+    assert 'print("hi")' in result.sources["hi.vn"]
+    # the worker keeps the accepted code to warm-start the next build of these specs
+    assert len(os.listdir(tmp_path / "cache" / "builds")) == 1
+
+@pytest.mark.asyncio
+async def test_batch_main(tmp_path, capsys):
+    queue_path = str(tmp_path / "queue.sqlite3")
+    compiler = Compiler(
+        models=ModelRouter(backends={"openai": StandInBackend()}),
+        cache_dir=str(tmp_path / "cache"),
+        prefetch=False,
+    )
+    worker = BuildWorker(SqliteJobQueue(queue_path), compiler, poll_interval=0.05)
+    workers = asyncio.gather(worker.work(), worker.work())
+
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.vn").write_text("say hi")
+
+    try:
+        await batch_main(
+            queue_path,
+            [[str(tmp_path / f"{n}.out"), str(tmp_path / f"{n}.vn")] for n in ["a", "b"]],
+            log_root=str(tmp_path / "logs"),
+        )
+    finally:
+        workers.cancel()
+
+    out = capsys.readouterr().out
+
+    for name in ["a", "b"]:
+        assert os.access(tmp_path / f"{name}.out", os.X_OK)
+        assert f"built {tmp_path / name}.out" in out
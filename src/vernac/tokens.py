@@ -0,0 +1,30 @@
+import math
+
+from functools import cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# rough average for English prose and Python source
+CHARS_PER_TOKEN = 4
+
+# per-message framing overhead in the chat format
+TOKENS_PER_MESSAGE = 4
+
+@cache
+def get_encoding(name: str = "cl100k_base"):
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text: str) -> int:
+    if tiktoken is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    else:
+        return len(get_encoding().encode(text, disallowed_special=()))
+
+def count_chat_tokens(messages: list[dict[str, str]]) -> int:
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(m["content"])
+        for m in messages
+    )
@@ -1,6 +1,7 @@
 import re
 import os.path
 import math
+import asyncio
 import inspect
 
 from typing import (
@@ -42,7 +43,8 @@ async def call_with_supported_args(func: Callable[..., T], args_dict: dict) -> T
     if inspect.iscoroutinefunction(func):
         return await func(**supported_args)
     else:
-        return func(**supported_args)
+        # keep blocking stages off the event loop so pipelines can overlap
+        return await asyncio.to_thread(func, **supported_args)
 
 def replace_ext(path, new_ext):
     (name, _) = os.path.splitext(path)
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from enum import Enum
+from dataclasses import dataclass
+from contextlib import contextmanager
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+@dataclass
+class QueuedJob:
+    id: str
+    kind: str
+    payload: dict
+    priority: int = 0
+    status: JobStatus = JobStatus.QUEUED
+    attempts: int = 0
+    worker: str | None = None
+    lease_expires: float | None = None
+    result: dict | None = None
+    error: str | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+class JobFailedError(Exception):
+    def __init__(self, job: QueuedJob):
+        super().__init__(f"{job.kind} job {job.id} failed: {job.error}")
+
+        self.job = job
+
+class JobQueue(ABC):
+    """
+    Where coordinators leave jobs and workers take them. Workers hold a job
+    under a lease that they keep renewing; a job whose lease runs out, as
+    when its worker dies, goes to the next worker to ask.
+    """
+
+    @abstractmethod
+    def submit(self, kind: str, payload: dict, priority: int = 0) -> str:
+        ...
+
+    @abstractmethod
+    def claim(self, worker: str, lease_seconds: float) -> QueuedJob | None:
+        ...
+
+    @abstractmethod
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """
+        Extend a lease, returning False if the worker no longer holds it.
+        """
+
+    @abstractmethod
+    def finish(
+            self,
+            job_id: str,
+            worker: str,
+            result: dict | None = None,
+            error: str | None = None,
+        ) -> bool:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> QueuedJob:
+        ...
+
+    async def wait(self, job_id: str, poll_interval: float = 0.5) -> dict:
+        """
+        Wait for a job to finish, returning its result or raising
+        `JobFailedError`.
+        """
+
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+
+            match job.status:
+                case JobStatus.SUCCEEDED:
+                    return job.result
+                case JobStatus.FAILED:
+                    raise JobFailedError(job)
+
+            await asyncio.sleep(poll_interval)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    submitted_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, submitted_at);
+"""
+
+class SqliteJobQueue(JobQueue):
+    """
+    Job queue in one SQLite file, for workers on this machine or on a
+    filesystem with working locks.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path,
+            timeout=30.0,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so two claims cannot race
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield self._db
+
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+
+                raise
+
+    def submit(self, kind: str, payload: dict, priority: int = 0) -> str:
+        job_id = uuid.uuid4().hex
+
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO jobs (id, kind, payload, priority, submitted_at, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), priority, time.time(), JobStatus.QUEUED.value),
+            )
+
+        return job_id
+
+    def claim(self, worker: str, lease_seconds: float) -> QueuedJob | None:
+        now = time.time()
+
+        with self.transaction() as db:
+            # jobs whose workers stopped renewing are retried, or given up on
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, "
+                "error = 'lost its worker ' || attempts || ' times' "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (JobStatus.FAILED.value, JobStatus.RUNNING.value, now, self.max_attempts),
+            )
+
+            rows = db.execute(
+                "SELECT id FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY priority DESC, submitted_at LIMIT 1",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value, now),
+            ).fetchall()
+
+            if len(rows) == 0:
+                return None
+
+            [(job_id,)] = rows
+
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (JobStatus.RUNNING.value, worker, now + lease_seconds, job_id),
+            )
+
+            return self.get_locked(job_id)
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        with self.transaction() as db:
+            rows = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ? "
+                "RETURNING id",
+                (time.time() + lease_seconds, job_id, worker, JobStatus.RUNNING.value),
+            ).fetchall()
+
+        return len(rows) > 0
+
+    def finish(
+            self,
+            job_id: str,
+            worker: str,
+            result: dict | None = None,
+            error: str | None = None,
+        ) -> bool:
+        status = JobStatus.SUCCEEDED if error is None else JobStatus.FAILED
+
+        with self.transaction() as db:
+            rows = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = ? RETURNING id",
+                (
+                    status.value,
+                    None if result is None else json.dumps(result),
+                    error,
+                    job_id,
+                    worker,
+                    JobStatus.RUNNING.value,
+                ),
+            ).fetchall()
+
+        # a worker that lost its lease does not get the last word
+        return len(rows) > 0
+
+    def get(self, job_id: str) -> QueuedJob:
+        with self._lock:
+            return self.get_locked(job_id)
+
+    def get_locked(self, job_id: str) -> QueuedJob:
+        rows = self._db.execute(
+            "SELECT id, kind, payload, priority, status, attempts, worker, lease_expires, "
+            "result, error FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchall()
+
+        if len(rows) == 0:
+            raise KeyError(f"no such job: {job_id}")
+
+        [(_, kind, payload, priority, status, attempts, worker, lease_expires, result, error)] = rows
+
+        return QueuedJob(
+            id=job_id,
+            kind=kind,
+            payload=json.loads(payload),
+            priority=priority,
+            status=JobStatus(status),
+            attempts=attempts,
+            worker=worker,
+            lease_expires=lease_expires,
+            result=None if result is None else json.loads(result),
+            error=error,
+        )